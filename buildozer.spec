@@ -27,6 +27,8 @@ source.include_exts = py,png,jpg,kv,atlas
 
 # (list) Application requirements
 # comma separated e.g. requirements = sqlite3,kivy
+# numpy is intentionally not listed: the network traffic time series is desktop-only
+# and core.network disables it when numpy is missing
 requirements = python3,kivy==2.1.0,cython==0.29.36,pillow,pyjnius
 
 # (str) Custom source folders for requirements
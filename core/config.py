@@ -123,6 +123,8 @@ class AppConfig:
             'timeout': 30,
             'max_history': 1000,
             'wordlist_path': None,
+            # 阻止IP的执行后端：None为只在内存中记录，'auto'、'nftables'、'ipset'或'dry-run'
+            'enforcement_backend': None,
             'plugins': []
         }
         
@@ -1,19 +1,34 @@
 # 网络安全模块主文件
 # 整合流量监控、恶意软件检测和入侵防御功能
 
+from core.config import app_config
 from .traffic_monitor import NetworkMonitor
+from .flow_archive import FlowArchive
+from .ip_enrichment import IpEnricher
 from .malware_detector import MalwareDetector
 from .intrusion_prevention import IntrusionPrevention
+from .enforcement import BlockEnforcer, EnforcementBackend, create_backend
 from .vulnerability_scanner import VulnerabilityScanner
 
 class NetworkSecurity:
-    def __init__(self):
-        self.traffic_monitor = NetworkMonitor()
+    def __init__(self, pcap_ring=None, enforcement=None):
+        # enforcement为执行后端名称（'auto'、'nftables'、'ipset'、'dry-run'）或EnforcementBackend，
+        # 设置后阻止的IP按批写入内核防火墙集合
+        if isinstance(enforcement, str):
+            enforcement = create_backend(enforcement)
+        enforcer = BlockEnforcer(enforcement) if isinstance(enforcement, EnforcementBackend) else None
+        self.intrusion_prevention = IntrusionPrevention(enforcer=enforcer)
+        # pcap_ring为可选的PcapRing，入侵防御阻止IP时保留告警前后的原始抓包；
+        # 实时抓包的连接按批交给入侵防御评估。流归档与IP信息补充在首次开始监控或回放时才创建（见_prepare）
+        self.traffic_monitor = NetworkMonitor(pcap_ring=pcap_ring, intrusion_prevention=self.intrusion_prevention)
         self.malware_detector = MalwareDetector()
-        self.intrusion_prevention = IntrusionPrevention()
+        self.intrusion_prevention.block_listeners.append(self._on_block)
         self.vulnerability_scanner = VulnerabilityScanner()
         self.is_initialized = False
     
+    def _on_block(self, ip, reason, timestamp):
+        self.traffic_monitor.freeze_capture(ip, reason, timestamp)
+    
     def initialize(self):
         """初始化网络安全模块"""
         if not self.is_initialized:
@@ -21,9 +36,17 @@ class NetworkSecurity:
             self.malware_detector.load_signature_db()
             self.is_initialized = True
     
+    def _prepare(self):
+        """创建流归档，并加载应用数据目录ipdb下的前缀表，用于为流、主机与被阻止的IP补充ASN、组织与国家"""
+        if self.traffic_monitor.flow_archive is None:
+            self.traffic_monitor.set_flow_archive(FlowArchive())
+        if self.traffic_monitor.enricher is None:
+            self.traffic_monitor.enricher = IpEnricher.from_directory()
+    
     def start_monitoring(self, interface=None):
         """开始所有监控功能"""
         self.initialize()
+        self._prepare()
         self.traffic_monitor.start_monitoring(interface)
         self.intrusion_prevention.start_monitoring()
     
@@ -32,6 +55,18 @@ class NetworkSecurity:
         self.traffic_monitor.stop_monitoring()
         self.intrusion_prevention.stop_monitoring()
     
+    def replay_capture(self, path, speed=None):
+        """离线回放抓包文件或目录，同时驱动流量分析与入侵检测
+        
+        入侵检测使用相同规则的独立实例：不写入防火墙、不触发阻止回调，也不影响实时监控的检测状态，
+        历史数据中的告警与应阻止的IP只出现在返回报告的alerts与blocked_ips中。
+        """
+        self.initialize()
+        self._prepare()
+        live = self.intrusion_prevention
+        intrusion_prevention = IntrusionPrevention(rules=list(live.rules), allowlist=live.allowlist)
+        return self.traffic_monitor.replay(path, speed, intrusion_prevention)
+    
     def get_network_statistics(self):
         """获取网络统计信息"""
         return self.traffic_monitor.get_statistics()
@@ -44,6 +79,47 @@ class NetworkSecurity:
         """获取流量最大的前N个流"""
         return self.traffic_monitor.get_top_flows(limit)
     
+    def get_top_talkers(self, limit=10):
+        """获取收发总字节数最多的前N个主机"""
+        return self.traffic_monitor.get_top_talkers(limit)
+    
+    def get_host_statistics(self, ip):
+        """获取单个主机的收发字节数、包数、对端数与首末活动时间"""
+        return self.traffic_monitor.get_host(ip)
+    
+    def get_top_domains(self, limit=10):
+        """获取查询次数最多的前N个域名"""
+        return self.traffic_monitor.get_top_domains(limit)
+    
+    def get_tcp_statistics(self, limit=10):
+        """获取TCP握手时延、半开连接与握手最慢的服务器"""
+        return self.traffic_monitor.get_tcp_statistics(limit)
+    
+    def get_traffic_snapshot(self):
+        """获取最新的不可变流量统计快照，版本号未变时界面可跳过重绘"""
+        return self.traffic_monitor.get_snapshot()
+    
+    def get_pipeline_metrics(self):
+        """获取抓包丢包、处理延迟与队列深度指标"""
+        return self.traffic_monitor.get_pipeline_metrics()
+    
+    def get_interface_statistics(self):
+        """获取各网卡的抓包计数"""
+        return self.traffic_monitor.get_interface_statistics()
+    
+    def get_traffic_timeseries(self, metric='bytes', resolution=1, count=60):
+        """获取流量时间序列 (时间数组, 数值数组)"""
+        return self.traffic_monitor.get_timeseries(metric, resolution, count)
+    
+    def get_source_spread(self, ip, window_start=None):
+        """获取某个源在时间窗口内访问的不同端口与主机数量"""
+        return self.traffic_monitor.get_source_spread(ip, window_start)
+    
+    def query_flows(self, start=None, end=None, ip=None, port=None, protocol=None, limit=1000, interface=None):
+        """按时间范围、IP、端口、协议与网卡查询历史流记录"""
+        self._prepare()
+        return self.traffic_monitor.query_flows(start, end, ip, port, protocol, limit, interface)
+    
     def scan_file(self, file_path):
         """扫描单个文件"""
         return self.malware_detector.scan_file(file_path)
@@ -68,6 +144,18 @@ class NetworkSecurity:
         """解除IP阻止"""
         return self.intrusion_prevention.unblock_ip(ip)
     
+    def get_enforcement_statistics(self):
+        """获取防火墙执行后端的集合大小与提交统计，未启用时返回None"""
+        return self.intrusion_prevention.get_statistics()['enforcement']
+    
+    def describe_ip(self, ip):
+        """获取IP所属ASN、组织与国家的简短描述，没有信息时返回空字符串"""
+        return self.traffic_monitor.describe_ip(ip)
+    
+    def get_frozen_captures(self):
+        """获取因阻止IP而保留的告警抓包列表"""
+        return self.traffic_monitor.get_frozen_captures()
+    
     def get_security_status(self):
         """获取整体安全状态"""
         network_stats = self.get_network_statistics()
@@ -107,7 +195,7 @@ class NetworkSecurity:
         return self.vulnerability_scanner.generate_report(scan_results)
 
 # 全局实例
-network_security = NetworkSecurity()
+network_security = NetworkSecurity(enforcement=app_config.get('enforcement_backend'))
 
 # 示例用法
 if __name__ == "__main__":
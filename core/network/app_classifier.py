@@ -0,0 +1,141 @@
+# 应用层协议识别模块
+# 只检查每个TCP流最前面的几个数据包的载荷，提取HTTP Host、TLS SNI与SSH版本标识后即停止检查该流
+
+import struct
+
+# 识别出的应用层协议
+APP_HTTP = 'HTTP'
+APP_TLS = 'TLS'
+APP_SSH = 'SSH'
+
+# 每个流最多检查的数据包数（含不带载荷的握手包），用完后不再检查
+INSPECT_PACKETS = 8
+# 跨多个TCP分段的ClientHello最多缓存的字节数
+TLS_BUFFER_LIMIT = 8192
+# 检查HTTP请求头与SSH标识时最多查看的字节数
+HEADER_LIMIT = 2048
+
+_HTTP_METHODS = (
+    b'GET ', b'POST ', b'HEAD ', b'PUT ', b'DELETE ', b'OPTIONS ', b'PATCH ', b'CONNECT ', b'TRACE '
+)
+_TLS_HANDSHAKE = 0x16
+_TLS_CLIENT_HELLO = 0x01
+_TLS_SERVER_HELLO = 0x02
+_TLS_EXT_SERVER_NAME = 0
+_u16 = struct.Struct('!H')
+
+
+def http_host(payload):
+    """HTTP请求中的Host头（去掉端口），没有Host头时返回空字符串"""
+    head = bytes(payload[:HEADER_LIMIT])
+    end = head.find(b'\r\n\r\n')
+    if end >= 0:
+        head = head[:end]
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'host':
+            host = value.strip().decode('ascii', 'replace')
+            # 保留IPv6字面量的方括号，只去掉末尾的端口
+            if host.rfind(':') > host.rfind(']'):
+                host = host[:host.rfind(':')]
+            return host
+    return ''
+
+
+def ssh_banner(payload):
+    """SSH版本标识行，如 'SSH-2.0-OpenSSH_9.6'"""
+    line = bytes(payload[:255]).split(b'\r\n', 1)[0].split(b'\n', 1)[0]
+    return line.decode('ascii', 'replace')
+
+
+def tls_client_hello_sni(data):
+    """从以TLS记录开头的ClientHello中提取SNI
+
+    返回 (是否完整, 服务器名称)：数据在找到SNI之前就结束时返回 (False, None)，
+    需要后续分段；ClientHello不含SNI或格式错误时返回 (True, None)。
+    """
+    try:
+        # 记录头(5) + 握手类型(1)与长度(3) + 版本(2) + 随机数(32)
+        offset = 43
+        offset += 1 + data[offset]                              # session_id
+        offset += 2 + _u16.unpack_from(data, offset)[0]         # cipher_suites
+        offset += 1 + data[offset]                              # compression_methods
+        extensions_end = offset + 2 + _u16.unpack_from(data, offset)[0]
+        offset += 2
+        while offset < extensions_end:
+            ext_type, ext_length = struct.unpack_from('!HH', data, offset)
+            offset += 4
+            if ext_type == _TLS_EXT_SERVER_NAME:
+                # server_name_list: 列表长度(2)，名称类型(1)，名称长度(2)，名称
+                name_length = _u16.unpack_from(data, offset + 3)[0]
+                name = bytes(data[offset + 5:offset + 5 + name_length])
+                if len(name) < name_length:
+                    return False, None
+                return True, name.decode('ascii', 'replace')
+            offset += ext_length
+        if offset > len(data):
+            return False, None
+        return True, None
+    except (IndexError, struct.error):
+        return False, None
+
+
+def inspect_payload(record, frame, offset, forward):
+    """检查流的一个数据包，识别出协议或检查次数用完后把record.inspect置0
+
+    offset为载荷在frame中的起始位置（没有载荷时为None），forward表示数据包来自流的发起方。
+    识别结果写入record.app（协议）与record.app_detail（Host、SNI或SSH标识）。
+    """
+    record.inspect -= 1
+    buffer = record.app_buffer
+    if offset is None or offset >= len(frame) or (buffer is not None and not forward):
+        # 缓存ClientHello时只接收发起方方向的后续分段
+        if not record.inspect:
+            _give_up(record)
+        return
+
+    if buffer is not None:
+        payload = buffer + bytes(frame[offset:offset + TLS_BUFFER_LIMIT - len(buffer)])
+    else:
+        payload = frame[offset:]
+
+    first = payload[0]
+    if first == _TLS_HANDSHAKE and len(payload) >= 6:
+        handshake = payload[5]
+        if handshake == _TLS_CLIENT_HELLO:
+            complete, server_name = tls_client_hello_sni(payload)
+            if not complete and record.inspect and len(payload) < TLS_BUFFER_LIMIT:
+                record.app_buffer = bytes(payload)
+                return
+            _finish(record, APP_TLS, server_name)
+            return
+        if handshake == _TLS_SERVER_HELLO:
+            # 没有看到ClientHello（如抓包开始时连接已建立）
+            _finish(record, APP_TLS, None)
+            return
+    elif payload[:4] == b'SSH-':
+        _finish(record, APP_SSH, ssh_banner(payload))
+        return
+    elif bytes(payload[:8]).startswith(_HTTP_METHODS):
+        _finish(record, APP_HTTP, http_host(payload) or None)
+        return
+    elif payload[:7] == b'HTTP/1.':
+        # 先看到响应，继续等待请求中的Host
+        record.app = APP_HTTP
+
+    if not record.inspect:
+        _give_up(record)
+
+
+def _give_up(record):
+    """检查次数用完：已开始缓存ClientHello的流仍记为TLS"""
+    if record.app_buffer is not None:
+        record.app = APP_TLS
+        record.app_buffer = None
+
+
+def _finish(record, app, detail):
+    record.app = app
+    record.app_detail = detail
+    record.inspect = 0
+    record.app_buffer = None
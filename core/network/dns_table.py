@@ -0,0 +1,275 @@
+# DNS统计模块
+# 用struct直接解析UDP/53上的DNS查询与响应，维护有界的按域名统计与IP到域名的缓存
+
+import heapq
+import socket
+import struct
+from collections import OrderedDict
+
+from .packet_utils import ip_to_int
+
+DNS_PORT = 53
+
+# 常见的查询类型
+QTYPE_A = 1
+QTYPE_CNAME = 5
+QTYPE_AAAA = 28
+QTYPE_NAMES = {1: 'A', 2: 'NS', 5: 'CNAME', 6: 'SOA', 12: 'PTR', 15: 'MX', 16: 'TXT', 28: 'AAAA', 33: 'SRV',
+               65: 'HTTPS', 255: 'ANY'}
+RCODE_NXDOMAIN = 3
+
+_header = struct.Struct('!HHHHHH')
+_question = struct.Struct('!HH')
+_answer = struct.Struct('!HHIH')
+# 解析一条响应时最多读取的应答记录数与名称压缩指针跳转次数
+MAX_ANSWERS = 32
+MAX_POINTERS = 16
+
+
+def _read_name(buf, pos, end, base):
+    """读取pos处的域名，返回 (小写域名, 名称之后的位置)；压缩指针相对于报文起始位置base"""
+    labels = []
+    next_pos = None
+    jumps = 0
+    while True:
+        if pos >= end:
+            raise ValueError("域名越界")
+        length = buf[pos]
+        if length & 0xC0 == 0xC0:
+            if pos + 1 >= end or jumps >= MAX_POINTERS:
+                raise ValueError("无效的压缩指针")
+            if next_pos is None:
+                next_pos = pos + 2
+            pos = ((length & 0x3F) << 8 | buf[pos + 1]) + base
+            jumps += 1
+            continue
+        pos += 1
+        if not length:
+            break
+        labels.append(bytes(buf[pos:pos + length]).decode('ascii', 'replace').lower())
+        pos += length
+    return '.'.join(labels), next_pos if next_pos is not None else pos
+
+
+def _skip_name(buf, pos, end):
+    """跳过pos处的域名，返回名称之后的位置"""
+    while pos < end:
+        length = buf[pos]
+        if length & 0xC0 == 0xC0:
+            return pos + 2
+        pos += 1 + length
+        if not length:
+            return pos
+    raise ValueError("域名越界")
+
+
+def parse_dns(buf, offset=0, end=None):
+    """解析从offset开始的DNS报文
+
+    返回 (是否为响应, 查询名, 查询类型, 响应码, 应答中的IP地址列表)，无法解析时返回None。
+    只读取第一个问题；应答中的A与AAAA记录都归属于查询名（CNAME链不单独记录）。
+    """
+    if end is None:
+        end = len(buf)
+    if end - offset < 12:
+        return None
+    try:
+        _, flags, questions, answers, _, _ = _header.unpack_from(buf, offset)
+        if not questions:
+            return None
+        qname, pos = _read_name(buf, offset + 12, end, offset)
+        qtype = _question.unpack_from(buf, pos)[0]
+        pos += 4
+        for _ in range(questions - 1):
+            pos = _skip_name(buf, pos, end) + 4
+
+        addresses = []
+        response = bool(flags & 0x8000)
+        if response:
+            for _ in range(min(answers, MAX_ANSWERS)):
+                pos = _skip_name(buf, pos, end)
+                rtype, _, _, rdlength = _answer.unpack_from(buf, pos)
+                pos += 10
+                if pos + rdlength > end:
+                    break
+                if rtype == QTYPE_A and rdlength == 4:
+                    addresses.append(socket.inet_ntoa(bytes(buf[pos:pos + 4])))
+                elif rtype == QTYPE_AAAA and rdlength == 16:
+                    addresses.append(socket.inet_ntop(socket.AF_INET6, bytes(buf[pos:pos + 16])))
+                pos += rdlength
+        return response, qname, qtype, flags & 0x0F, addresses
+    except (ValueError, IndexError, struct.error):
+        return None
+
+
+class DomainRecord:
+    """单个域名的查询统计"""
+    __slots__ = ('name', 'queries', 'responses', 'nxdomain', 'failures', 'first_seen', 'last_seen',
+                 'qtypes', 'addresses')
+
+    def __init__(self, name, timestamp):
+        self.name = name
+        self.queries = 0
+        self.responses = 0
+        # 响应码为NXDOMAIN与其他非零响应码的响应数
+        self.nxdomain = 0
+        self.failures = 0
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        # 出现过的查询类型编号
+        self.qtypes = set()
+        # 最近一次成功应答中的地址
+        self.addresses = ()
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'queries': self.queries,
+            'responses': self.responses,
+            'nxdomain': self.nxdomain,
+            'failures': self.failures,
+            'qtypes': sorted(QTYPE_NAMES.get(qtype, str(qtype)) for qtype in self.qtypes),
+            'addresses': list(self.addresses),
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen
+        }
+
+
+class DnsTable:
+    """DNS查询统计与反查缓存
+
+    domains: 按域名的查询、响应、NXDOMAIN与失败计数，最多max_domains个，按最近活动淘汰；
+    names: IPv4地址（整数）到最近一次解析出该地址的域名，最多max_addresses个，按最近写入淘汰。
+
+    export_changes为True时（流水线分片）按域名的计数只累计增量，由drain_export()导出后
+    在主进程的表中merge_export()；反查缓存仍在本地维护，用于给流标注主机名。
+    """
+
+    def __init__(self, max_domains=10000, max_addresses=100000, export_changes=False):
+        self.max_domains = max_domains
+        self.max_addresses = max_addresses
+        self.export_changes = export_changes
+        self.domains = OrderedDict()
+        self.names = OrderedDict()
+        self.pending = {}
+
+    def __len__(self):
+        return len(self.domains)
+
+    def clear(self):
+        self.domains.clear()
+        self.names.clear()
+        self.pending = {}
+
+    def add_packet(self, timestamp, frame, offset, weight=1):
+        """解析并记录一个DNS报文，返回parse_dns()的结果；weight为0时只更新反查缓存"""
+        parsed = parse_dns(frame, offset)
+        if parsed is None:
+            return None
+        response, qname, qtype, rcode, addresses = parsed
+        if addresses:
+            self.learn(qname, addresses)
+        if weight:
+            self._count(qname, timestamp, qtype, response, rcode, addresses, weight)
+        return parsed
+
+    def learn(self, name, addresses):
+        """记录解析出的地址，只缓存IPv4地址"""
+        names = self.names
+        for address in addresses:
+            if ':' in address:
+                continue
+            ip = ip_to_int(address)
+            if ip in names:
+                names.move_to_end(ip)
+            elif len(names) >= self.max_addresses:
+                names.popitem(last=False)
+            names[ip] = name
+
+    def lookup(self, ip):
+        """IP（整数或点分十进制）对应的域名，没有记录时返回None"""
+        if isinstance(ip, str):
+            ip = ip_to_int(ip)
+        return self.names.get(ip)
+
+    def _count(self, name, timestamp, qtype, response, rcode, addresses, weight):
+        if self.export_changes:
+            entry = self.pending.get(name)
+            if entry is None:
+                entry = self.pending[name] = [0, 0, 0, 0, timestamp, timestamp, set(), ()]
+            entry[5] = timestamp
+        else:
+            entry = None
+            record = self._domain(name, timestamp)
+            record.last_seen = timestamp
+
+        queries = responses = nxdomain = failures = 0
+        if not response:
+            queries = weight
+        else:
+            responses = weight
+            if rcode == RCODE_NXDOMAIN:
+                nxdomain = weight
+            elif rcode:
+                failures = weight
+
+        if entry is not None:
+            entry[0] += queries
+            entry[1] += responses
+            entry[2] += nxdomain
+            entry[3] += failures
+            entry[6].add(qtype)
+            if addresses:
+                entry[7] = tuple(addresses)
+            return
+        record.queries += queries
+        record.responses += responses
+        record.nxdomain += nxdomain
+        record.failures += failures
+        record.qtypes.add(qtype)
+        if addresses:
+            record.addresses = tuple(addresses)
+
+    def _domain(self, name, timestamp):
+        domains = self.domains
+        record = domains.get(name)
+        if record is None:
+            if len(domains) >= self.max_domains:
+                domains.popitem(last=False)
+            record = domains[name] = DomainRecord(name, timestamp)
+        else:
+            domains.move_to_end(name)
+        return record
+
+    def drain_export(self):
+        """导出并清空增量 [(域名, 查询数, 响应数, NXDOMAIN数, 失败数, 首次, 末次, 查询类型元组, 地址元组)]"""
+        pending, self.pending = self.pending, {}
+        return [
+            (name, entry[0], entry[1], entry[2], entry[3], entry[4], entry[5], tuple(entry[6]), entry[7])
+            for name, entry in pending.items()
+        ]
+
+    def merge_export(self, rows):
+        """合并分片导出的增量"""
+        for name, queries, responses, nxdomain, failures, first_seen, last_seen, qtypes, addresses in rows:
+            record = self._domain(name, first_seen)
+            record.first_seen = min(record.first_seen, first_seen)
+            record.last_seen = max(record.last_seen, last_seen)
+            record.queries += queries
+            record.responses += responses
+            record.nxdomain += nxdomain
+            record.failures += failures
+            record.qtypes.update(qtypes)
+            if addresses:
+                record.addresses = addresses
+                self.learn(name, addresses)
+
+    def get_domain(self, name):
+        """单个域名的统计字典，不在表中时返回None"""
+        record = self.domains.get(name.lower().rstrip('.'))
+        return record.to_dict() if record is not None else None
+
+    def top_domains(self, limit=10, key='queries'):
+        """按查询数（或 'nxdomain'、'responses' 等计数）排序的前N个域名 [统计字典]"""
+        top = heapq.nlargest(limit, self.domains.values(), key=lambda record: getattr(record, key))
+        return [record.to_dict() for record in top]
@@ -0,0 +1,186 @@
+# 主机端点表模块
+# 按IP增量维护收发字节数与包数、不同对端数量与首末活动时间，容量有界并按最近最少使用淘汰
+
+from collections import OrderedDict
+
+from .heavy_hitters import SpaceSaving
+from .packet_utils import int_to_ip, ip_to_int
+from .sketches import HyperLogLog
+
+# 对端数量不超过该值时精确记录，超过后改用小型HyperLogLog估计
+PEER_SET_LIMIT = 64
+PEER_HLL_PRECISION = 8
+
+
+class EndpointRecord:
+    """单个主机的收发统计，out为该主机作为源发出的，in为作为目的收到的"""
+    __slots__ = (
+        'ip', 'packets_out', 'bytes_out', 'packets_in', 'bytes_in',
+        'first_seen', 'last_seen', 'peers'
+    )
+
+    def __init__(self, ip, timestamp):
+        self.ip = ip
+        self.packets_out = 0
+        self.bytes_out = 0
+        self.packets_in = 0
+        self.bytes_in = 0
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        # 对端IP集合，超过PEER_SET_LIMIT后换成HyperLogLog
+        self.peers = set()
+
+    def add_peer(self, peer):
+        peers = self.peers
+        if type(peers) is set:
+            if peer in peers:
+                return
+            if len(peers) < PEER_SET_LIMIT:
+                peers.add(peer)
+                return
+            hll = HyperLogLog(PEER_HLL_PRECISION)
+            for value in peers:
+                hll.add(value)
+            self.peers = peers = hll
+        peers.add(peer)
+
+    @property
+    def peer_count(self):
+        peers = self.peers
+        return len(peers) if type(peers) is set else round(peers.count())
+
+    def to_dict(self):
+        return {
+            'ip': int_to_ip(self.ip),
+            'packets_out': self.packets_out,
+            'bytes_out': self.bytes_out,
+            'packets_in': self.packets_in,
+            'bytes_in': self.bytes_in,
+            # 不同对端数量，超过PEER_SET_LIMIT时为估计值
+            'peers': self.peer_count,
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen
+        }
+
+
+class EndpointTable:
+    """有界主机端点表
+
+    每个数据包更新源与目的两个主机的记录，单个主机的查询为O(1)；
+    最近最少活动的主机在超出max_hosts时被淘汰。
+    按收发总字节数的Top-K由Space-Saving计数器维护，查询不需要扫描整张表。
+
+    export_changes为True时（流水线分片）不维护完整的表，只累计自上次导出以来各主机的增量，
+    由drain_export()导出，再由主进程的表通过merge_export()合并。
+    """
+
+    def __init__(self, max_hosts=100000, top_capacity=1000, export_changes=False):
+        self.max_hosts = max_hosts
+        self.export_changes = export_changes
+        self.hosts = OrderedDict()
+        self.top = SpaceSaving(top_capacity)
+        self.evicted_count = 0
+        # 增量模式下 {IP: [发出包数, 发出字节数, 收到包数, 收到字节数, 首次时间, 末次时间, 对端集合]}
+        self.pending = {}
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def clear(self):
+        self.hosts.clear()
+        self.top.clear()
+        self.evicted_count = 0
+        self.pending = {}
+
+    def add_packet(self, timestamp, length, src, dst, weight=1):
+        """累计一个数据包，src/dst为整数形式的IPv4地址，weight为抽样时这个包代表的包数"""
+        size = length * weight
+        if self.export_changes:
+            self._add_pending(src, timestamp, weight, size, 0, 0, dst)
+            self._add_pending(dst, timestamp, 0, 0, weight, size, src)
+            return
+
+        record = self._host(src, timestamp)
+        record.packets_out += weight
+        record.bytes_out += size
+        record.add_peer(dst)
+        self.top.update(src, size, record)
+
+        record = self._host(dst, timestamp)
+        record.packets_in += weight
+        record.bytes_in += size
+        record.add_peer(src)
+        self.top.update(dst, size, record)
+
+    def _host(self, ip, timestamp):
+        hosts = self.hosts
+        record = hosts.get(ip)
+        if record is None:
+            if len(hosts) >= self.max_hosts:
+                hosts.popitem(last=False)
+                self.evicted_count += 1
+            record = hosts[ip] = EndpointRecord(ip, timestamp)
+        else:
+            hosts.move_to_end(ip)
+            record.last_seen = timestamp
+        return record
+
+    def _add_pending(self, ip, timestamp, packets_out, bytes_out, packets_in, bytes_in, peer):
+        entry = self.pending.get(ip)
+        if entry is None:
+            self.pending[ip] = [packets_out, bytes_out, packets_in, bytes_in, timestamp, timestamp, {peer}]
+            return
+        entry[0] += packets_out
+        entry[1] += bytes_out
+        entry[2] += packets_in
+        entry[3] += bytes_in
+        entry[5] = timestamp
+        entry[6].add(peer)
+
+    def drain_export(self):
+        """导出并清空自上次导出以来的增量 [(IP, 发出包数, 发出字节数, 收到包数, 收到字节数, 首次, 末次, 对端元组)]"""
+        pending, self.pending = self.pending, {}
+        return [
+            (ip, entry[0], entry[1], entry[2], entry[3], entry[4], entry[5], tuple(entry[6]))
+            for ip, entry in pending.items()
+        ]
+
+    def merge_export(self, rows):
+        """合并分片导出的增量"""
+        for ip, packets_out, bytes_out, packets_in, bytes_in, first_seen, last_seen, peers in rows:
+            record = self.hosts.get(ip)
+            if record is None:
+                record = self._host(ip, first_seen)
+            else:
+                self.hosts.move_to_end(ip)
+                record.first_seen = min(record.first_seen, first_seen)
+            record.last_seen = max(record.last_seen, last_seen)
+            record.packets_out += packets_out
+            record.bytes_out += bytes_out
+            record.packets_in += packets_in
+            record.bytes_in += bytes_in
+            for peer in peers:
+                record.add_peer(peer)
+            self.top.update(ip, bytes_out + bytes_in, record)
+
+    def get_host(self, ip):
+        """单个主机的统计字典，ip为点分十进制或整数；不在表中时返回None"""
+        if isinstance(ip, str):
+            ip = ip_to_int(ip)
+        record = self.hosts.get(ip)
+        return record.to_dict() if record is not None else None
+
+    def top_talkers(self, limit=10):
+        """收发总字节数最多的前N个主机 [(IP, 统计字典)]
+
+        统计字典另含排名依据的估计总字节数estimated_bytes及其误差上界error；
+        已被淘汰的主机给出淘汰时的统计。
+        """
+        talkers = []
+        payloads = self.top.payloads
+        for ip, estimate, error in self.top.top(limit):
+            data = payloads[ip].to_dict()
+            data['estimated_bytes'] = estimate
+            data['error'] = error
+            talkers.append((data['ip'], data))
+        return talkers
@@ -0,0 +1,431 @@
+# 阻止执行模块
+# 把入侵防御阻止的IP写入内核防火墙的地址集合（nftables或ipset），阻止与解除阻止攒成批次一次提交
+
+import ipaddress
+import socket
+import shutil
+import struct
+import subprocess
+import threading
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+BACKEND_NFTABLES = 'nftables'
+BACKEND_IPSET = 'ipset'
+BACKEND_DRY_RUN = 'dry-run'
+BACKEND_AUTO = 'auto'
+
+
+def split_addresses(ips):
+    """把IP按版本分为 (IPv4列表, IPv6列表)，无效的地址被跳过（地址会被写入命令脚本，必须先校验）"""
+    ipv4 = []
+    ipv6 = []
+    for ip in ips:
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            print(f"忽略无效的IP地址: {ip!r}")
+            continue
+        if address.version == 4:
+            ipv4.append(str(address))
+        else:
+            ipv6.append(str(address))
+    return ipv4, ipv6
+
+
+# 始终允许的地址：本机回环
+LOOPBACK_NETWORKS = ('127.0.0.0/8', '::1/128')
+
+
+class Allowlist:
+    """永不阻止的地址与网段
+
+    条目可以是IP地址或CIDR网段；精确地址用集合查找，网段逐个比较（条目数通常很少）。
+    """
+
+    def __init__(self, entries=()):
+        self.addresses = set()
+        self.networks = []
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry):
+        """添加IP地址或CIDR网段，无效的条目被忽略"""
+        try:
+            if '/' in entry:
+                self.networks.append(ipaddress.ip_network(entry, strict=False))
+            else:
+                self.addresses.add(str(ipaddress.ip_address(entry)))
+        except ValueError:
+            print(f"忽略无效的允许条目: {entry!r}")
+
+    def __contains__(self, ip):
+        if ip in self.addresses:
+            return True
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        if str(address) in self.addresses:
+            return True
+        for network in self.networks:
+            if address.version == network.version and address in network:
+                return True
+        return False
+
+    def __len__(self):
+        return len(self.addresses) + len(self.networks)
+
+    def to_list(self):
+        return sorted(self.addresses) + [str(network) for network in self.networks]
+
+
+def local_addresses():
+    """本机各网卡的IP地址（未安装psutil时退回到主机名解析）"""
+    addresses = set()
+    if psutil is not None:
+        for entries in psutil.net_if_addrs().values():
+            for entry in entries:
+                if entry.family in (socket.AF_INET, socket.AF_INET6):
+                    # 去掉IPv6链路本地地址的 %网卡 后缀
+                    addresses.add(entry.address.split('%', 1)[0])
+        return addresses
+    try:
+        for info in socket.getaddrinfo(socket.gethostname(), None):
+            addresses.add(info[4][0].split('%', 1)[0])
+    except OSError:
+        pass
+    return addresses
+
+
+def default_gateways(route_path='/proc/net/route'):
+    """Linux上IPv4默认路由的网关地址"""
+    gateways = set()
+    try:
+        with open(route_path, 'r') as routes:
+            next(routes, None)
+            for line in routes:
+                fields = line.split()
+                if len(fields) >= 3 and fields[1] == '00000000' and fields[2] != '00000000':
+                    gateways.add(socket.inet_ntoa(struct.pack('<I', int(fields[2], 16))))
+    except (OSError, ValueError):
+        pass
+    return gateways
+
+
+def configured_resolvers(resolv_path='/etc/resolv.conf'):
+    """resolv.conf中配置的DNS服务器地址"""
+    resolvers = set()
+    try:
+        with open(resolv_path, 'r') as resolv:
+            for line in resolv:
+                fields = line.split()
+                if len(fields) >= 2 and fields[0] == 'nameserver':
+                    resolvers.add(fields[1].split('%', 1)[0])
+    except OSError:
+        pass
+    return resolvers
+
+
+def default_allowlist(extra=()):
+    """本机回环、本机地址、默认网关与配置的DNS服务器，加上extra中的条目
+
+    这些地址被误判时阻止它们会让本机断网，因此永不阻止。
+    """
+    allowlist = Allowlist(LOOPBACK_NETWORKS)
+    for address in local_addresses() | default_gateways() | configured_resolvers():
+        allowlist.add(address)
+    for entry in extra:
+        allowlist.add(entry)
+    return allowlist
+
+
+class EnforcementBackend:
+    """执行后端基类
+
+    setup(ips)建立防火墙规则与地址集合并以ips为初始内容，apply(added, removed)把一批变更
+    作为一次更新提交，teardown()删除规则与集合；成功时返回True。
+    dry_run为True时不执行任何命令，只把 (参数列表, 标准输入) 记录在commands中，供测试检查。
+    """
+    name = None
+
+    def __init__(self, dry_run=False, timeout=10):
+        self.dry_run = dry_run
+        self.timeout = timeout
+        self.commands = []
+
+    def setup(self, ips=()):
+        raise NotImplementedError
+
+    def apply(self, added, removed):
+        raise NotImplementedError
+
+    def teardown(self):
+        raise NotImplementedError
+
+    def _run(self, argv, script=None):
+        if self.dry_run:
+            self.commands.append((argv, script))
+            return True
+        try:
+            result = subprocess.run(argv, input=script, capture_output=True, text=True, timeout=self.timeout)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            print(f"执行 {argv[0]} 失败: {e}")
+            return False
+        if result.returncode != 0:
+            print(f"执行 {argv[0]} 失败: {result.stderr.strip()}")
+            return False
+        return True
+
+
+class NftablesBackend(EnforcementBackend):
+    """nftables执行后端
+
+    在独立的表中建立IPv4与IPv6地址集合，以及挂在hooks上、丢弃源地址在集合中的数据包的链。
+    每次apply()生成一个脚本交给一次 `nft -f -`，脚本中的所有增删在内核中作为一个事务原子生效；
+    元素按chunk_size个一组写成add/delete element命令。
+    """
+    name = BACKEND_NFTABLES
+
+    def __init__(self, table='kali_app', family='inet', hooks=('input', 'forward'), priority=-10,
+                 nft='nft', chunk_size=4096, dry_run=False, timeout=10):
+        super().__init__(dry_run, timeout)
+        self.table = f"{family} {table}"
+        self.hooks = hooks
+        self.priority = priority
+        self.nft = nft
+        self.chunk_size = chunk_size
+
+    def setup(self, ips=()):
+        table = self.table
+        lines = [
+            f"add table {table}",
+            f"add set {table} blocked_v4 {{ type ipv4_addr; }}",
+            f"add set {table} blocked_v6 {{ type ipv6_addr; }}",
+            f"flush set {table} blocked_v4",
+            f"flush set {table} blocked_v6"
+        ]
+        for hook in self.hooks:
+            lines += [
+                f"add chain {table} {hook} {{ type filter hook {hook} priority {self.priority}; policy accept; }}",
+                f"flush chain {table} {hook}",
+                f"add rule {table} {hook} ip saddr @blocked_v4 drop",
+                f"add rule {table} {hook} ip6 saddr @blocked_v6 drop"
+            ]
+        lines += self._element_lines('add', ips)
+        return self._submit(lines)
+
+    def apply(self, added, removed):
+        return self._submit(self._element_lines('delete', removed) + self._element_lines('add', added))
+
+    def teardown(self):
+        return self._submit([f"delete table {self.table}"])
+
+    def _element_lines(self, verb, ips):
+        lines = []
+        size = self.chunk_size
+        for set_name, addresses in zip(('blocked_v4', 'blocked_v6'), split_addresses(ips)):
+            for start in range(0, len(addresses), size):
+                elements = ', '.join(addresses[start:start + size])
+                lines.append(f"{verb} element {self.table} {set_name} {{ {elements} }}")
+        return lines
+
+    def _submit(self, lines):
+        if not lines:
+            return True
+        return self._run([self.nft, '-f', '-'], '\n'.join(lines) + '\n')
+
+
+class IpsetBackend(EnforcementBackend):
+    """ipset执行后端（没有nftables的系统）
+
+    建立IPv4与IPv6的hash:ip集合，并在iptables/ip6tables的chain链首插入丢弃集合中源地址的规则。
+    每次apply()把所有增删写成一个脚本交给一次 `ipset restore`，在同一个进程中批量提交；
+    ipset不支持跨元素的事务，中途失败时之前的行已经生效。
+    """
+    name = BACKEND_IPSET
+
+    def __init__(self, set_name='kali_blocked', chain='INPUT', maxelem=1048576, ipset='ipset',
+                 iptables='iptables', ip6tables='ip6tables', dry_run=False, timeout=10):
+        super().__init__(dry_run, timeout)
+        self.sets = (set_name, set_name + '6')
+        self.chain = chain
+        self.maxelem = maxelem
+        self.ipset = ipset
+        self.iptables = (iptables, ip6tables)
+
+    def setup(self, ips=()):
+        lines = []
+        for set_name, family in zip(self.sets, ('inet', 'inet6')):
+            lines += [f"create {set_name} hash:ip family {family} maxelem {self.maxelem}", f"flush {set_name}"]
+        lines += self._element_lines('add', ips)
+        if not self._submit(lines):
+            return False
+        for iptables, set_name in zip(self.iptables, self.sets):
+            rule = [self.chain, '-m', 'set', '--match-set', set_name, 'src', '-j', 'DROP']
+            # 规则已存在时不重复插入
+            if self.dry_run or not self._run([iptables, '-C'] + rule):
+                if not self._run([iptables, '-I'] + rule):
+                    return False
+        return True
+
+    def apply(self, added, removed):
+        return self._submit(self._element_lines('del', removed) + self._element_lines('add', added))
+
+    def teardown(self):
+        success = True
+        for iptables, set_name in zip(self.iptables, self.sets):
+            rule = [self.chain, '-m', 'set', '--match-set', set_name, 'src', '-j', 'DROP']
+            success = self._run([iptables, '-D'] + rule) and success
+            success = self._run([self.ipset, 'destroy', set_name]) and success
+        return success
+
+    def _element_lines(self, verb, ips):
+        lines = []
+        for set_name, addresses in zip(self.sets, split_addresses(ips)):
+            lines += [f"{verb} {set_name} {address}" for address in addresses]
+        return lines
+
+    def _submit(self, lines):
+        if not lines:
+            return True
+        # -exist：创建已存在的集合、添加已存在或删除不存在的元素不视为错误
+        return self._run([self.ipset, '-exist', 'restore'], '\n'.join(lines) + '\n')
+
+
+def create_backend(name, dry_run=False):
+    """按名称创建执行后端
+
+    'nftables'、'ipset'、'dry-run'（只记录命令的nftables后端），
+    'auto'为系统上可用的第一个（优先nftables），都不可用时返回None。
+    """
+    if name == BACKEND_DRY_RUN:
+        return NftablesBackend(dry_run=True)
+    if name == BACKEND_NFTABLES:
+        return NftablesBackend(dry_run=dry_run)
+    if name == BACKEND_IPSET:
+        return IpsetBackend(dry_run=dry_run)
+    if name == BACKEND_AUTO:
+        if shutil.which('nft'):
+            return NftablesBackend(dry_run=dry_run)
+        if shutil.which('ipset') and shutil.which('iptables'):
+            return IpsetBackend(dry_run=dry_run)
+        return None
+    raise ValueError(f"未知的执行后端: {name}")
+
+
+class BlockEnforcer:
+    """把阻止与解除阻止攒成批次提交给执行后端
+
+    block()/unblock()只在内存中记录每个IP最终的目标状态，不执行任何命令，可直接在检测路径上调用；
+    后台线程每flush_interval秒（或待提交的变更达到max_pending个时立即）把全部变更作为一次apply()提交，
+    一阵突发的上万次阻止只产生少数几次内核更新。同一批中先阻止又解除的IP互相抵消。
+    提交失败的变更被丢弃并计入failed_changes，不会反复重试。
+    """
+
+    def __init__(self, backend, flush_interval=0.5, max_pending=50000, keep_on_stop=False):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        # 为True时停止后保留内核中的规则与集合
+        self.keep_on_stop = keep_on_stop
+        # IP -> True（阻止）/ False（解除阻止）
+        self.pending = {}
+        # 已在内核集合中的IP
+        self.applied = set()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.updates = 0
+        self.applied_changes = 0
+        self.failed_changes = 0
+        self.is_running = False
+        self.flush_thread = None
+        self._wakeup = threading.Event()
+
+    def start(self, blocked_ips=()):
+        """建立防火墙规则，以blocked_ips为集合的初始内容，并启动后台提交线程"""
+        if self.is_running:
+            return
+        with self.lock:
+            self.pending.clear()
+            blocked = set(blocked_ips)
+        if not self.backend.setup(blocked):
+            print(f"{self.backend.name} 执行后端初始化失败，阻止的IP不会写入防火墙")
+            return
+        self.applied = blocked
+        self.is_running = True
+        self._wakeup.clear()
+        self.flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flush_thread.start()
+
+    def stop(self, timeout=5):
+        """提交剩余的变更并停止后台线程，keep_on_stop为False时删除防火墙规则"""
+        if not self.is_running:
+            return
+        self.is_running = False
+        self._wakeup.set()
+        if self.flush_thread:
+            self.flush_thread.join(timeout=timeout)
+        if not self.keep_on_stop:
+            self.backend.teardown()
+            self.applied = set()
+
+    def block(self, ip):
+        try:
+            ipaddress.ip_address(ip)
+        except ValueError:
+            print(f"忽略无效的IP地址: {ip!r}")
+            return
+        self._queue(ip, True)
+
+    def unblock(self, ip):
+        self._queue(ip, False)
+
+    def _queue(self, ip, blocked):
+        with self.lock:
+            self.pending[ip] = blocked
+            full = len(self.pending) >= self.max_pending
+        if full:
+            self._wakeup.set()
+
+    def _flush_loop(self):
+        while self.is_running:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """把待提交的变更作为一次更新交给后端，返回提交的变更数"""
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+            applied = self.applied
+            added = [ip for ip, blocked in pending.items() if blocked and ip not in applied]
+            removed = [ip for ip, blocked in pending.items() if not blocked and ip in applied]
+            if not added and not removed:
+                return 0
+            changes = len(added) + len(removed)
+            if not self.backend.apply(added, removed):
+                self.failed_changes += changes
+                return 0
+            applied.update(added)
+            applied.difference_update(removed)
+            self.updates += 1
+            self.applied_changes += changes
+            return changes
+
+    def get_statistics(self):
+        """后端名称、集合中的IP数、待提交的变更数、提交次数与成功/失败的变更数"""
+        return {
+            'backend': self.backend.name,
+            'running': self.is_running,
+            'enforced_ips': len(self.applied),
+            'pending_changes': len(self.pending),
+            'updates': self.updates,
+            'applied_changes': self.applied_changes,
+            'failed_changes': self.failed_changes
+        }
@@ -0,0 +1,236 @@
+# 快速抓包模块
+# 基于AF_PACKET原始套接字与内核BPF过滤，使用struct只解析所需的首部字段
+
+import ctypes
+import socket
+import struct
+import subprocess
+import threading
+import time
+
+from .packet_utils import bits_to_flags
+
+ETH_P_ALL = 0x0003
+ETH_P_IP = 0x0800
+ETH_P_8021Q = 0x8100
+ETH_P_8021AD = 0x88A8
+SO_ATTACH_FILTER = 26
+SOL_PACKET = 263
+PACKET_STATISTICS = 6
+
+IPPROTO_ICMP = 1
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+_ethertype = struct.Struct('!H')
+_ipv4_header = struct.Struct('!BxH2xHxB2x4s4s')
+_ports = struct.Struct('!HH')
+_tcp_flags = struct.Struct('!BB')
+_icmp_header = struct.Struct('!BB')
+# struct tpacket_stats { unsigned int tp_packets; unsigned int tp_drops; }
+_tpacket_stats = struct.Struct('II')
+
+
+class SockFilter(ctypes.Structure):
+    """struct sock_filter"""
+    _fields_ = [
+        ('code', ctypes.c_uint16),
+        ('jt', ctypes.c_uint8),
+        ('jf', ctypes.c_uint8),
+        ('k', ctypes.c_uint32)
+    ]
+
+
+class SockFprog(ctypes.Structure):
+    """struct sock_fprog"""
+    _fields_ = [
+        ('len', ctypes.c_uint16),
+        ('filter', ctypes.POINTER(SockFilter))
+    ]
+
+
+def decode_frame(frame, timestamp=None):
+    """解析以太网帧，返回与NetworkMonitor.analyze_packet相同格式的数据包信息"""
+    packet_info = {
+        'timestamp': timestamp if timestamp is not None else time.time(),
+        'length': len(frame),
+        'protocol': 'Unknown'
+    }
+
+    if len(frame) < 14:
+        return packet_info
+
+    offset = 14
+    ethertype = _ethertype.unpack_from(frame, 12)[0]
+    # 跳过VLAN标签
+    while (ethertype == ETH_P_8021Q or ethertype == ETH_P_8021AD) and len(frame) >= offset + 4:
+        ethertype = _ethertype.unpack_from(frame, offset + 2)[0]
+        offset += 4
+
+    if ethertype == ETH_P_IP:
+        decode_ipv4(frame, offset, packet_info)
+    return packet_info
+
+
+def decode_ipv4(buf, offset, packet_info):
+    """从buf的offset处解析IPv4及传输层首部，结果写入packet_info"""
+    if len(buf) < offset + 20:
+        return packet_info
+
+    version_ihl, total_length, fragment, proto, src, dst = _ipv4_header.unpack_from(buf, offset)
+    if version_ihl >> 4 != 4:
+        return packet_info
+
+    packet_info['protocol'] = 'IP'
+    packet_info['src'] = socket.inet_ntoa(src)
+    packet_info['dst'] = socket.inet_ntoa(dst)
+
+    # 非首个分片不含传输层首部
+    if fragment & 0x1FFF:
+        return packet_info
+
+    # IP总长度为0时（如网卡分段卸载的大包）以帧长为准
+    end = offset + total_length if total_length else len(buf)
+    offset += (version_ihl & 0x0F) * 4
+    if proto == IPPROTO_TCP:
+        if len(buf) >= offset + 14:
+            packet_info['protocol'] = 'TCP'
+            packet_info['sport'], packet_info['dport'] = _ports.unpack_from(buf, offset)
+            high, low = _tcp_flags.unpack_from(buf, offset + 12)
+            packet_info['flags'] = bits_to_flags(((high & 0x01) << 8) | low)
+            # 带载荷时记录载荷在帧中的起始位置，供应用层协议识别与DNS解析使用
+            payload_offset = offset + (high >> 4) * 4
+            if payload_offset < end and payload_offset < len(buf):
+                packet_info['payload_offset'] = payload_offset
+    elif proto == IPPROTO_UDP:
+        if len(buf) >= offset + 4:
+            packet_info['protocol'] = 'UDP'
+            packet_info['sport'], packet_info['dport'] = _ports.unpack_from(buf, offset)
+            if offset + 8 < end and offset + 8 < len(buf):
+                packet_info['payload_offset'] = offset + 8
+    elif proto == IPPROTO_ICMP:
+        if len(buf) >= offset + 2:
+            packet_info['protocol'] = 'ICMP'
+            packet_info['type'], packet_info['code'] = _icmp_header.unpack_from(buf, offset)
+    return packet_info
+
+
+def compile_bpf(filter_expr, interface=None):
+    """使用tcpdump将过滤表达式编译为BPF指令列表 [(code, jt, jf, k), ...]"""
+    cmd = ['tcpdump', '-ddd']
+    if interface:
+        cmd += ['-i', interface]
+    cmd.append(filter_expr)
+
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise ValueError(f"无法编译BPF过滤器: {e}")
+    if result.returncode != 0:
+        raise ValueError(f"无法编译BPF过滤器: {result.stderr.strip()}")
+
+    lines = result.stdout.split('\n')
+    count = int(lines[0])
+    return [tuple(int(field) for field in line.split()) for line in lines[1:count + 1]]
+
+
+def attach_bpf(sock, instructions):
+    """将已编译的BPF指令挂载到套接字上，由内核完成过滤"""
+    program = (SockFilter * len(instructions))(*[
+        SockFilter(code, jt, jf, k) for code, jt, jf, k in instructions
+    ])
+    fprog = SockFprog(len(instructions), program)
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, bytes(fprog))
+
+
+def raw_capture_available():
+    """检查当前环境能否打开AF_PACKET原始套接字"""
+    if not hasattr(socket, 'AF_PACKET'):
+        return False
+    try:
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+    except OSError:
+        return False
+    sock.close()
+    return True
+
+
+class RawSocketCapture:
+    """AF_PACKET原始套接字抓包器
+
+    bpf_filter可以是过滤表达式字符串，也可以是已编译的指令列表。
+    """
+
+    def __init__(self, interface=None, bpf_filter=None, snaplen=65535, rcvbuf=4 * 1024 * 1024):
+        self.interface = interface
+        self.bpf_filter = bpf_filter
+        self.snaplen = snaplen
+        self.rcvbuf = rcvbuf
+        self.sock = None
+        # 内核统计的累计值：收到的包数（含丢弃）与因接收缓冲区满而丢弃的包数
+        self.kernel_received = 0
+        self.kernel_dropped = 0
+        self._stats_lock = threading.Lock()
+
+    def open(self):
+        """打开套接字并挂载BPF过滤器"""
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+            if self.bpf_filter:
+                instructions = self.bpf_filter
+                if isinstance(instructions, str):
+                    instructions = compile_bpf(instructions, self.interface)
+                attach_bpf(sock, instructions)
+            if self.interface:
+                sock.bind((self.interface, 0))
+            sock.settimeout(0.5)
+        except Exception:
+            sock.close()
+            raise
+        self.sock = sock
+
+    def run(self, handler, should_continue):
+        """抓包循环，对每一帧调用 handler(frame, timestamp)
+
+        frame为接收缓冲区的memoryview切片，仅在回调期间有效。
+        """
+        if self.sock is None:
+            self.open()
+        buffer = bytearray(self.snaplen)
+        view = memoryview(buffer)
+        recv_into = self.sock.recv_into
+        try:
+            while should_continue():
+                try:
+                    length = recv_into(buffer)
+                except socket.timeout:
+                    continue
+                handler(view[:length], time.time())
+        finally:
+            self.close()
+
+    def read_statistics(self):
+        """读取并累计内核的PACKET_STATISTICS计数，返回 (收到, 丢弃)
+
+        内核在每次读取后清零计数，因此这里累加保存；可从其他线程调用。
+        """
+        with self._stats_lock:
+            sock = self.sock
+            if sock is not None:
+                try:
+                    received, dropped = _tpacket_stats.unpack(
+                        sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, _tpacket_stats.size)
+                    )
+                    self.kernel_received += received
+                    self.kernel_dropped += dropped
+                except OSError:
+                    pass
+            return self.kernel_received, self.kernel_dropped
+
+    def close(self):
+        """关闭套接字（关闭前读取最后一次内核统计）"""
+        if self.sock:
+            self.read_statistics()
+            self.sock.close()
+            self.sock = None
@@ -0,0 +1,256 @@
+# 流记录归档模块
+# 将结束或被淘汰的流按时间分段批量写入SQLite，支持按时间、IP、端口与协议查询
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from core.config import PlatformConfig
+from .flow_table import FlowRecord
+from .packet_utils import PROTO_CODES, PROTO_NAMES, ip_to_int, int_to_ip
+from .tcp_state import TCP_STATE_NAMES
+
+SEGMENT_PREFIX = 'flows_'
+SEGMENT_SUFFIX = '.db'
+
+_COLUMNS = ', '.join(FlowRecord.ROW_FIELDS)
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS flows (
+    first_seen REAL, last_seen REAL, protocol INTEGER,
+    src INTEGER, dst INTEGER, sport INTEGER, dport INTEGER,
+    count INTEGER, bytes INTEGER, rev_count INTEGER, rev_bytes INTEGER, interface TEXT,
+    app TEXT, app_detail TEXT, hostname TEXT, tcp_state INTEGER, rtt REAL
+)
+"""
+# 早期版本创建的分段中没有的列
+_ADDED_COLUMNS = (('interface', 'TEXT'), ('app', 'TEXT'), ('app_detail', 'TEXT'), ('hostname', 'TEXT'),
+                  ('tcp_state', 'INTEGER'), ('rtt', 'REAL'))
+_CREATE_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_flows_last_seen ON flows (last_seen)",
+    "CREATE INDEX IF NOT EXISTS idx_flows_src ON flows (src)",
+    "CREATE INDEX IF NOT EXISTS idx_flows_dst ON flows (dst)",
+    "CREATE INDEX IF NOT EXISTS idx_flows_dport ON flows (dport)",
+)
+_INSERT = f"INSERT INTO flows ({_COLUMNS}) VALUES ({', '.join('?' * len(FlowRecord.ROW_FIELDS))})"
+
+
+class FlowArchive:
+    """按时间分段、只追加的流记录存储
+
+    每个分段是一个SQLite文件，覆盖segment_seconds秒（按流的最后活动时间划分）。
+    写入由后台线程批量完成，submit()只做入队，可直接作为FlowTable的sink；
+    过期数据按整段删除。
+    """
+
+    def __init__(self, directory=None, segment_seconds=3600, retention_seconds=7 * 86400,
+                 batch_size=500, flush_interval=2.0, queue_size=100000):
+        self.directory = directory or os.path.join(PlatformConfig.get_cache_dir(), 'flows')
+        self.segment_seconds = segment_seconds
+        self.retention_seconds = retention_seconds
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(queue_size)
+        self.written_count = 0
+        self.dropped_count = 0
+        self.is_running = False
+        self.writer_thread = None
+        self._connections = {}
+        self._last_retention = 0.0
+
+    def start(self):
+        """启动后台写入线程"""
+        if self.is_running:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.is_running = True
+        self.writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer_thread.start()
+
+    def stop(self, timeout=5):
+        """停止写入线程，队列中剩余的记录会先写完"""
+        if not self.is_running:
+            return
+        self.is_running = False
+        if self.writer_thread:
+            self.writer_thread.join(timeout=timeout)
+
+    def submit(self, record):
+        """提交一条流记录（FlowTable的sink），不在调用线程做任何IO"""
+        try:
+            self.queue.put_nowait(record.to_row())
+        except queue.Full:
+            self.dropped_count += 1
+
+    def _writer_loop(self):
+        batch = []
+        last_flush = time.time()
+        while self.is_running or not self.queue.empty():
+            try:
+                batch.append(self.queue.get(timeout=self.flush_interval))
+            except queue.Empty:
+                pass
+
+            now = time.time()
+            if batch and (len(batch) >= self.batch_size or now - last_flush >= self.flush_interval
+                          or not self.is_running):
+                self._write_batch(batch)
+                batch = []
+                last_flush = now
+            if now - self._last_retention >= 60:
+                self.enforce_retention(now)
+        if batch:
+            self._write_batch(batch)
+        self._close_connections()
+
+    def _segment_start(self, timestamp):
+        return int(timestamp // self.segment_seconds * self.segment_seconds)
+
+    def _segment_path(self, segment_start):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{segment_start}{SEGMENT_SUFFIX}")
+
+    def _connection(self, segment_start):
+        connection = self._connections.get(segment_start)
+        if connection is None:
+            connection = sqlite3.connect(self._segment_path(segment_start), check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(_CREATE_TABLE)
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(flows)")]
+            for name, column_type in _ADDED_COLUMNS:
+                if name not in columns:
+                    connection.execute(f"ALTER TABLE flows ADD COLUMN {name} {column_type}")
+            for statement in _CREATE_INDEXES:
+                connection.execute(statement)
+            self._connections[segment_start] = connection
+        return connection
+
+    def _write_batch(self, rows):
+        """按分段分组，每个分段一个事务批量写入"""
+        segments = {}
+        last_seen_index = FlowRecord.ROW_FIELDS.index('last_seen')
+        for row in rows:
+            segments.setdefault(self._segment_start(row[last_seen_index]), []).append(row)
+
+        for segment_start, segment_rows in segments.items():
+            try:
+                connection = self._connection(segment_start)
+                with connection:
+                    connection.executemany(_INSERT, segment_rows)
+                self.written_count += len(segment_rows)
+            except sqlite3.Error as e:
+                self.dropped_count += len(segment_rows)
+                print(f"流记录归档失败: {e}")
+
+        # 只保留最近两个分段的连接
+        for segment_start in sorted(self._connections)[:-2]:
+            self._connections.pop(segment_start).close()
+
+    def _close_connections(self):
+        for connection in self._connections.values():
+            connection.close()
+        self._connections = {}
+
+    def list_segments(self):
+        """列出所有分段 [(分段起始时间, 文件路径)]，按时间排序"""
+        segments = []
+        if not os.path.isdir(self.directory):
+            return segments
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                try:
+                    segment_start = int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+                except ValueError:
+                    continue
+                segments.append((segment_start, os.path.join(self.directory, name)))
+        segments.sort()
+        return segments
+
+    def enforce_retention(self, now=None):
+        """删除整段超出保留期的数据，返回删除的分段数"""
+        if now is None:
+            now = time.time()
+        self._last_retention = now
+        deadline = now - self.retention_seconds
+        removed = 0
+        for segment_start, path in self.list_segments():
+            if segment_start + self.segment_seconds > deadline:
+                break
+            connection = self._connections.pop(segment_start, None)
+            if connection:
+                connection.close()
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.remove(path + suffix)
+                except OSError:
+                    pass
+            removed += 1
+        return removed
+
+    def query(self, start=None, end=None, ip=None, port=None, protocol=None, limit=1000, interface=None):
+        """查询归档的流记录
+
+        start/end: 时间范围，返回与该范围有重叠的流
+        ip: 源或目的为该地址的流
+        port: 源或目的端口
+        protocol: 协议名称（如 'TCP'）或编号
+        interface: 首次看到该流的网卡
+        """
+        conditions = []
+        params = []
+        if start is not None:
+            conditions.append("last_seen >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("first_seen <= ?")
+            params.append(end)
+        if ip is not None:
+            value = ip_to_int(ip)
+            conditions.append("(src = ? OR dst = ?)")
+            params += [value, value]
+        if port is not None:
+            conditions.append("(sport = ? OR dport = ?)")
+            params += [port, port]
+        if protocol is not None:
+            conditions.append("protocol = ?")
+            params.append(PROTO_CODES.get(protocol, protocol))
+        if interface is not None:
+            conditions.append("interface = ?")
+            params.append(interface)
+
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+
+        results = []
+        for segment_start, path in self.list_segments():
+            # 分段按最后活动时间划分，早于start的分段中不会有符合条件的流
+            if start is not None and segment_start + self.segment_seconds <= start:
+                continue
+            try:
+                connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+                try:
+                    columns = set(row[1] for row in connection.execute("PRAGMA table_info(flows)"))
+                    if interface is not None and 'interface' not in columns:
+                        continue
+                    # 早期版本的分段缺少的列按空值读取
+                    selected = ', '.join(name if name in columns else 'NULL' for name in FlowRecord.ROW_FIELDS)
+                    statement = f"SELECT {selected} FROM flows{where} ORDER BY last_seen LIMIT ?"
+                    rows = connection.execute(statement, params + [limit - len(results)]).fetchall()
+                finally:
+                    connection.close()
+            except sqlite3.Error:
+                continue
+            results.extend(self._row_to_dict(row) for row in rows)
+            if len(results) >= limit:
+                break
+        return results
+
+    @staticmethod
+    def _row_to_dict(row):
+        flow = dict(zip(FlowRecord.ROW_FIELDS, row))
+        flow['protocol'] = PROTO_NAMES[flow['protocol']]
+        flow['src'] = int_to_ip(flow['src'])
+        flow['dst'] = int_to_ip(flow['dst'])
+        if flow['tcp_state'] is not None:
+            flow['tcp_state'] = TCP_STATE_NAMES[flow['tcp_state']]
+        return flow
@@ -0,0 +1,324 @@
+# 流表模块
+# 以紧凑的五元组整数为键，双向合并，支持空闲超时与容量上限淘汰
+
+import heapq
+import time
+from collections import OrderedDict
+
+from .packet_utils import PROTO_CODES, PROTO_NAMES, PROTO_TCP, PROTO_UNKNOWN, ip_to_int, int_to_ip
+from .app_classifier import INSPECT_PACKETS
+from .tcp_state import TCP_NONE, TCP_STATE_NAMES
+
+
+def make_flow_key(protocol, src, sport, dst, dport):
+    """生成双向合并的流键
+
+    两个端点按 (IP, 端口) 排序后打包为一个整数，正反方向得到同一个键。
+    返回 (键, 是否为正向)。
+    """
+    a = (src << 16) | sport
+    b = (dst << 16) | dport
+    if a <= b:
+        return (a << 56) | (b << 8) | protocol, True
+    return (b << 56) | (a << 8) | protocol, False
+
+
+class FlowRecord:
+    """单个流的统计记录，方向以首个数据包的发起方为准"""
+    __slots__ = (
+        'key', 'protocol', 'src', 'dst', 'sport', 'dport',
+        'count', 'bytes', 'rev_count', 'rev_bytes',
+        'first_seen', 'last_seen', 'interface',
+        'app', 'app_detail', 'inspect', 'app_buffer', 'hostname',
+        'tcp_state', 'tcp_time', 'rtt', 'ack_rtt'
+    )
+
+    # to_row()/from_row()使用的扁平字段顺序（用于跨进程传递与归档）
+    ROW_FIELDS = (
+        'first_seen', 'last_seen', 'protocol', 'src', 'dst', 'sport', 'dport',
+        'count', 'bytes', 'rev_count', 'rev_bytes', 'interface', 'app', 'app_detail', 'hostname',
+        'tcp_state', 'rtt'
+    )
+
+    def __init__(self, key, protocol, src, dst, sport, dport, timestamp, interface=None):
+        self.key = key
+        self.protocol = protocol
+        self.src = src
+        self.dst = dst
+        self.sport = sport
+        self.dport = dport
+        self.count = 0
+        self.bytes = 0
+        # count/bytes为双向合计，rev_*为其中反方向（响应方 -> 发起方）的部分
+        self.rev_count = 0
+        self.rev_bytes = 0
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        # 多接口抓包时首次看到该流的网卡名称
+        self.interface = interface
+        # 应用层协议及其Host、SNI或SSH标识；inspect为还要检查载荷的数据包数，
+        # app_buffer缓存跨分段的TLS ClientHello
+        self.app = None
+        self.app_detail = None
+        self.inspect = INSPECT_PACKETS if protocol == PROTO_TCP else 0
+        self.app_buffer = None
+        # 由DNS应答得到的响应方主机名
+        self.hostname = None
+        # TCP连接状态（见tcp_state模块）、最近一次握手事件的时间与握手往返时间（秒）
+        self.tcp_state = TCP_NONE
+        self.tcp_time = None
+        self.rtt = None
+        self.ack_rtt = None
+
+    def to_row(self):
+        """导出为按ROW_FIELDS排列的元组"""
+        return (
+            self.first_seen, self.last_seen, self.protocol, self.src, self.dst, self.sport, self.dport,
+            self.count, self.bytes, self.rev_count, self.rev_bytes, self.interface, self.app, self.app_detail,
+            self.hostname, self.tcp_state, self.rtt
+        )
+
+    @classmethod
+    def from_row(cls, row):
+        """由to_row()导出的元组重建流记录"""
+        (first_seen, last_seen, protocol, src, dst, sport, dport, count, size, rev_count, rev_bytes,
+         interface, app, app_detail, hostname, tcp_state, rtt) = row
+        record = cls(make_flow_key(protocol, src, sport, dst, dport)[0], protocol, src, dst, sport, dport,
+                     first_seen, interface)
+        record.app = app
+        record.app_detail = app_detail
+        record.hostname = hostname
+        record.tcp_state = tcp_state or TCP_NONE
+        record.rtt = rtt
+        record.inspect = 0
+        record.last_seen = last_seen
+        record.count = count
+        record.bytes = size
+        record.rev_count = rev_count
+        record.rev_bytes = rev_bytes
+        return record
+
+    @property
+    def src_ip(self):
+        return int_to_ip(self.src)
+
+    @property
+    def dst_ip(self):
+        return int_to_ip(self.dst)
+
+    @property
+    def protocol_name(self):
+        return PROTO_NAMES[self.protocol]
+
+    @property
+    def label(self):
+        """流的可读名称，格式与旧版flow_data的键一致"""
+        if self.sport or self.dport:
+            return f"{self.src_ip}:{self.sport}->{self.dst_ip}:{self.dport}"
+        return f"{self.src_ip}->{self.dst_ip}"
+
+    def to_dict(self):
+        """转换为旧版flow_data条目格式的字典"""
+        return {
+            'src': self.src_ip,
+            'dst': self.dst_ip,
+            'count': self.count,
+            'bytes': self.bytes,
+            'rev_count': self.rev_count,
+            'rev_bytes': self.rev_bytes,
+            'protocol': self.protocol_name,
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen,
+            'interface': self.interface,
+            'app': self.app,
+            'app_detail': self.app_detail,
+            'hostname': self.hostname,
+            'tcp_state': TCP_STATE_NAMES[self.tcp_state] if self.protocol == PROTO_TCP else None,
+            'rtt': self.rtt
+        }
+
+
+class ActivityWheel:
+    """按秒分桶的时间轮，用于O(1)统计最近window秒内有活动的流数量
+
+    每个流只计入其最后活动所在的那一秒的桶；桶循环复用，过期的桶在写入时重置。
+    """
+
+    def __init__(self, window=10):
+        self.window = window
+        self.size = window + 2
+        self.seconds = [-1] * self.size
+        self.counts = [0] * self.size
+
+    def clear(self):
+        self.seconds = [-1] * self.size
+        self.counts = [0] * self.size
+
+    def add(self, timestamp):
+        """登记一个在timestamp有活动的流"""
+        second = int(timestamp)
+        slot = second % self.size
+        if self.seconds[slot] != second:
+            self.seconds[slot] = second
+            self.counts[slot] = 0
+        self.counts[slot] += 1
+
+    def remove(self, timestamp):
+        """撤销之前在timestamp登记的流（桶已被复用时忽略）"""
+        second = int(timestamp)
+        slot = second % self.size
+        if self.seconds[slot] == second and self.counts[slot] > 0:
+            self.counts[slot] -= 1
+
+    def count(self, now):
+        """最近window秒内（按整秒计）有活动的流数量"""
+        current = int(now)
+        total = 0
+        for second in range(current - self.window + 1, current + 1):
+            slot = second % self.size
+            if self.seconds[slot] == second:
+                total += self.counts[slot]
+        return total
+
+
+class FlowTable:
+    """有界流表
+
+    按最近活动时间维护顺序，超过idle_timeout未活动或超出max_flows时
+    从最久未活动的一端淘汰，被淘汰的流交给可选的sink回调。
+    """
+
+    def __init__(self, max_flows=100000, idle_timeout=120, sink=None, expire_interval=1.0, active_window=10,
+                 on_evict=None):
+        self.max_flows = max_flows
+        self.idle_timeout = idle_timeout
+        self.sink = sink
+        # 流被淘汰时（在交给sink之前）调用，用于撤销依赖该流的计数
+        self.on_evict = on_evict
+        self.expire_interval = expire_interval
+        self.flows = OrderedDict()
+        # 活跃流计数，随流的更新与淘汰增量维护
+        self.activity = ActivityWheel(active_window)
+        self.evicted_count = 0
+        # 最近一个数据包的时间戳（离线回放时作为统计活跃流的当前时间）
+        self.latest = 0.0
+        self._last_expire = 0.0
+
+    def __len__(self):
+        return len(self.flows)
+
+    def __iter__(self):
+        return iter(self.flows.values())
+
+    def values(self):
+        return self.flows.values()
+
+    def clear(self):
+        """清空流表（不触发sink）"""
+        self.flows.clear()
+        self.activity.clear()
+        self.evicted_count = 0
+        self.latest = 0.0
+        self._last_expire = 0.0
+
+    def update(self, packet_info):
+        """根据analyze_packet生成的数据包信息更新流表"""
+        src = packet_info.get('src')
+        dst = packet_info.get('dst')
+        if not src or not dst:
+            return None
+        return self.update_fields(
+            PROTO_CODES.get(packet_info['protocol'], PROTO_UNKNOWN),
+            ip_to_int(src),
+            packet_info.get('sport', 0),
+            ip_to_int(dst),
+            packet_info.get('dport', 0),
+            packet_info['length'],
+            packet_info['timestamp'],
+            packet_info.get('interface')
+        )
+
+    def update_fields(self, protocol, src, sport, dst, dport, length, timestamp, interface=None):
+        """按已编码的字段更新流表，返回对应的流记录"""
+        key, forward = make_flow_key(protocol, src, sport, dst, dport)
+        flows = self.flows
+        record = flows.get(key)
+        if record is None:
+            if len(flows) >= self.max_flows:
+                self._evict(flows.popitem(last=False)[1])
+            record = FlowRecord(key, protocol, src, dst, sport, dport, timestamp, interface)
+            flows[key] = record
+            self.activity.add(timestamp)
+            forward = True
+        else:
+            flows.move_to_end(key)
+            forward = src == record.src and sport == record.sport
+            if int(timestamp) != int(record.last_seen):
+                self.activity.remove(record.last_seen)
+                self.activity.add(timestamp)
+
+        record.count += 1
+        record.bytes += length
+        if not forward:
+            record.rev_count += 1
+            record.rev_bytes += length
+        record.last_seen = timestamp
+        if timestamp > self.latest:
+            self.latest = timestamp
+
+        if timestamp - self._last_expire >= self.expire_interval:
+            self.expire(timestamp)
+        return record
+
+    def expire(self, now=None):
+        """淘汰超过idle_timeout未活动的流，返回淘汰数量"""
+        if now is None:
+            now = time.time()
+        self._last_expire = now
+        deadline = now - self.idle_timeout
+        flows = self.flows
+        expired = 0
+        while flows:
+            record = next(iter(flows.values()))
+            if record.last_seen >= deadline:
+                break
+            del flows[record.key]
+            self._evict(record)
+            expired += 1
+        return expired
+
+    def flush(self, keep=False):
+        """将所有流交给sink并清空流表
+
+        keep为True时只输出、不移除（停止监控时归档，同时保留界面上的展示）。
+        """
+        if keep:
+            if self.sink:
+                for record in list(self.flows.values()):
+                    self._emit(record)
+            return
+        while self.flows:
+            self._evict(self.flows.popitem(last=False)[1])
+
+    def _evict(self, record):
+        self.activity.remove(record.last_seen)
+        self.evicted_count += 1
+        if self.on_evict is not None:
+            self.on_evict(record)
+        self._emit(record)
+
+    def _emit(self, record):
+        if self.sink:
+            try:
+                self.sink(record)
+            except Exception as e:
+                print(f"流记录输出失败: {e}")
+
+    def active_flows(self, now=None):
+        """最近active_window秒内有活动的流数量"""
+        return self.activity.count(time.time() if now is None else now)
+
+    def get_top_flows(self, limit=10):
+        """获取字节数最多的前N个流，返回 [(流名称, 统计字典)]"""
+        top = heapq.nlargest(limit, self.flows.values(), key=lambda record: record.bytes)
+        return [(record.label, record.to_dict()) for record in top]
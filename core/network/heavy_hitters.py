@@ -0,0 +1,111 @@
+# 流式Top-K统计模块
+# 基于Space-Saving算法的重流量项（heavy hitter）统计，内存占用固定
+
+import heapq
+from operator import itemgetter
+
+
+class SpaceSaving:
+    """带权Space-Saving计数器
+
+    最多跟踪capacity个键；表满时新键替换当前计数最小的键，
+    并继承其计数作为误差上界。估计值不低于真实值，误差不超过error。
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.payloads = {}
+        # 每个键在堆中恰有一项，计数只增不减，堆中的值可能偏小，取最小值时再校正
+        self._heap = []
+
+    def __len__(self):
+        return len(self.counts)
+
+    def clear(self):
+        self.counts.clear()
+        self.errors.clear()
+        self.payloads.clear()
+        self._heap = []
+
+    def update(self, key, weight=1, payload=None):
+        """为key累加weight，payload为随键保存的附加对象"""
+        counts = self.counts
+        count = counts.get(key)
+        if count is not None:
+            counts[key] = count + weight
+        elif len(counts) < self.capacity:
+            counts[key] = weight
+            self.errors[key] = 0
+            heapq.heappush(self._heap, (weight, key))
+        else:
+            heap = self._heap
+            while True:
+                low, victim = heap[0]
+                actual = counts[victim]
+                if actual == low:
+                    break
+                heapq.heapreplace(heap, (actual, victim))
+            del counts[victim]
+            del self.errors[victim]
+            self.payloads.pop(victim, None)
+            counts[key] = low + weight
+            self.errors[key] = low
+            heapq.heapreplace(heap, (low + weight, key))
+
+        if payload is not None:
+            self.payloads[key] = payload
+
+    def top(self, limit=10):
+        """返回估计值最大的limit项 [(键, 估计值, 误差上界)]"""
+        errors = self.errors
+        return [
+            (key, count, errors[key])
+            for key, count in heapq.nlargest(limit, self.counts.items(), key=itemgetter(1))
+        ]
+
+
+class ExactCounter:
+    """精确计数器，接口与SpaceSaving一致，内存随键数量增长"""
+
+    def __init__(self):
+        self.counts = {}
+        self.payloads = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def clear(self):
+        self.counts.clear()
+        self.payloads.clear()
+
+    def update(self, key, weight=1, payload=None):
+        self.counts[key] = self.counts.get(key, 0) + weight
+        if payload is not None:
+            self.payloads[key] = payload
+
+    def top(self, limit=10):
+        return [
+            (key, count, 0)
+            for key, count in heapq.nlargest(limit, self.counts.items(), key=itemgetter(1))
+        ]
+
+
+def make_counter(exact=False, capacity=1000):
+    """按精确/近似开关创建计数器"""
+    return ExactCounter() if exact else SpaceSaving(capacity)
+
+
+def merge_top(lists, limit=10):
+    """合并多个分片的 [(键, 估计值, 误差)] 列表，同一键的计数相加"""
+    counts = {}
+    errors = {}
+    for entries in lists:
+        for key, count, error in entries:
+            counts[key] = counts.get(key, 0) + count
+            errors[key] = errors.get(key, 0) + error
+    return [
+        (key, count, errors[key])
+        for key, count in heapq.nlargest(limit, counts.items(), key=itemgetter(1))
+    ]
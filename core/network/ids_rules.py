@@ -0,0 +1,264 @@
+# 入侵检测规则引擎模块
+# 把声明式规则编译为按协议与目的端口分派的评估计划，条件与窗口相同的规则共享同一个滑动窗口
+
+from .packet_utils import flags_to_bits
+from .sliding_window import WindowCounter, DistinctWindow
+
+AGGREGATE_COUNT = 'count'
+AGGREGATE_DISTINCT = 'distinct'
+
+# match中支持的条件
+MATCH_FIELDS = ('protocol', 'sport', 'dport', 'flags', 'flags_absent', 'icmp_type', 'icmp_code')
+# 规则中的icmp_type/icmp_code对应连接信息中的字段
+_CONNECTION_FIELDS = {'icmp_type': 'type', 'icmp_code': 'code'}
+
+
+def _parse_values(value):
+    """把端口或类型条件解析为 (值集合, 区间列表)
+
+    支持整数、整数列表，以及 '22,80,8000-8100' 这样的字符串。
+    """
+    if isinstance(value, int):
+        return frozenset((value,)), ()
+    values = set()
+    ranges = []
+    parts = value.split(',') if isinstance(value, str) else value
+    for part in parts:
+        if isinstance(part, str) and '-' in part:
+            low, high = (int(bound) for bound in part.split('-', 1))
+            if high - low < 64:
+                values.update(range(low, high + 1))
+            else:
+                ranges.append((low, high))
+        else:
+            values.add(int(part))
+    return frozenset(values), tuple(sorted(ranges))
+
+
+def normalize_rule(rule):
+    """补全规则的默认值，并把旧格式（time_window、pattern、由是否有pattern推断聚合方式）转换为声明式格式"""
+    rule = dict(rule)
+    if 'window' not in rule:
+        rule['window'] = rule.get('time_window', 10)
+    if 'aggregate' not in rule:
+        if 'pattern' in rule:
+            rule['aggregate'] = AGGREGATE_COUNT
+        else:
+            rule['aggregate'] = AGGREGATE_DISTINCT
+            rule.setdefault('field', 'dport')
+    if rule['aggregate'] not in (AGGREGATE_COUNT, AGGREGATE_DISTINCT):
+        raise ValueError(f"规则 {rule.get('name')} 的聚合方式无效: {rule['aggregate']}")
+    if rule['aggregate'] == AGGREGATE_DISTINCT and not rule.get('field'):
+        raise ValueError(f"规则 {rule.get('name')} 缺少去重字段field")
+    match = dict(rule.get('match') or {})
+    unknown = set(match) - set(MATCH_FIELDS)
+    if unknown:
+        raise ValueError(f"规则 {rule.get('name')} 包含未知的匹配条件: {', '.join(sorted(unknown))}")
+    rule['match'] = match
+    rule.setdefault('key', 'src')
+    rule.setdefault('action', 'alert')
+    rule.setdefault('severity', 'medium')
+    return rule
+
+
+class WindowGroup:
+    """共享同一个滑动窗口的一组规则：匹配条件、键、聚合方式与窗口都相同，只有阈值不同
+
+    thresholds按阈值从小到大排列 [(阈值, 规则)]。
+    """
+    __slots__ = ('id', 'key', 'aggregate', 'field', 'window', 'checks', 'thresholds')
+
+    def __init__(self, group_id, key, aggregate, field, window, checks):
+        self.id = group_id
+        self.key = key
+        self.aggregate = aggregate
+        self.field = field
+        self.window = window
+        self.checks = checks
+        self.thresholds = []
+
+    def new_window(self):
+        if self.aggregate == AGGREGATE_COUNT:
+            return WindowCounter(self.window)
+        return DistinctWindow(self.window)
+
+    def key_value(self, conn):
+        """连接所属的跟踪键：按源IP时为IP字符串，否则为 (字段名, 值...) 元组"""
+        key = self.key
+        if key == ('src',):
+            return conn.get('src')
+        values = tuple(conn.get(name) for name in key)
+        if None in values:
+            return None
+        return key + values
+
+    def matches(self, conn):
+        for check in self.checks:
+            if not check(conn):
+                return False
+        return True
+
+
+def _compile_checks(match, pattern):
+    """把分派之外的条件编译为检查函数元组（协议与精确目的端口由分派索引处理）"""
+    checks = []
+    for name in ('sport', 'dport'):
+        if name in match:
+            values, ranges = _parse_values(match[name])
+            if name == 'dport' and not ranges:
+                continue
+            checks.append(_value_check(name, values, ranges))
+    for name in ('icmp_type', 'icmp_code'):
+        if name in match:
+            values, ranges = _parse_values(match[name])
+            checks.append(_value_check(_CONNECTION_FIELDS[name], values, ranges))
+    required = flags_to_bits(match['flags']) if match.get('flags') else 0
+    absent = flags_to_bits(match['flags_absent']) if match.get('flags_absent') else 0
+    if required or absent:
+        def flags_check(conn):
+            bits = flags_to_bits(conn.get('flags', ''))
+            return bits & required == required and not bits & absent
+        checks.append(flags_check)
+    if pattern is not None:
+        checks.append(pattern)
+    return tuple(checks)
+
+
+def _value_check(field, values, ranges):
+    def check(conn):
+        value = conn.get(field)
+        if value is None:
+            return False
+        if value in values:
+            return True
+        for low, high in ranges:
+            if low <= value <= high:
+                return True
+        return False
+    return check
+
+
+def _signature(rule):
+    """规则的窗口共享签名：除名称、阈值、动作与严重程度外的所有内容"""
+    match = tuple(sorted((name, repr(value)) for name, value in rule['match'].items()))
+    return (match, rule['key'], rule['aggregate'], rule.get('field'), rule['window'], id(rule.get('pattern')))
+
+
+class RuleEngine:
+    """编译后的规则评估计划
+
+    分派索引按协议、再按精确的目的端口找到候选窗口组，与连接无关的规则不会被检查，
+    规则数量增加时单个连接的评估成本只随真正候选的规则增长。
+    """
+
+    def __init__(self, rules):
+        self.rules = [normalize_rule(rule) for rule in rules]
+        self.groups = []
+        # 协议（None为任意协议） -> ({目的端口: [窗口组]}, [不限目的端口的窗口组])
+        self.dispatch = {}
+        self.idle_timeout = 0
+        self._compile()
+
+    def _compile(self):
+        groups = {}
+        for rule in self.rules:
+            if 'threshold' not in rule:
+                continue
+            signature = _signature(rule)
+            group = groups.get(signature)
+            if group is None:
+                key = rule['key']
+                key = (key,) if isinstance(key, str) else tuple(key)
+                group = WindowGroup(
+                    len(self.groups), key, rule['aggregate'], rule.get('field'), rule['window'],
+                    _compile_checks(rule['match'], rule.get('pattern'))
+                )
+                groups[signature] = group
+                self.groups.append(group)
+                self._index(group, rule['match'])
+            group.thresholds.append((rule['threshold'], rule))
+        for group in self.groups:
+            group.thresholds.sort(key=lambda item: item[0])
+        self.idle_timeout = max((group.window for group in self.groups), default=0)
+
+    def _index(self, group, match):
+        protocols = match.get('protocol')
+        if protocols is None or isinstance(protocols, str):
+            protocols = (protocols,)
+        ports = None
+        if 'dport' in match:
+            values, ranges = _parse_values(match['dport'])
+            if not ranges:
+                ports = values
+        for protocol in protocols:
+            by_port, any_port = self.dispatch.setdefault(protocol, ({}, []))
+            if ports is None:
+                any_port.append(group)
+            else:
+                for port in ports:
+                    by_port.setdefault(port, []).append(group)
+
+    def candidates(self, conn):
+        """可能匹配该连接的窗口组（已按协议与目的端口筛选）"""
+        dport = conn.get('dport')
+        protocol = conn.get('protocol')
+        for protocol in ((protocol, None) if protocol is not None else (None,)):
+            entry = self.dispatch.get(protocol)
+            if entry is None:
+                continue
+            by_port, any_port = entry
+            if dport is not None and by_port:
+                yield from by_port.get(dport, ())
+            yield from any_port
+
+    def observe(self, conn, timestamp, state_for):
+        """把一个连接计入匹配的窗口，返回超过阈值的告警
+
+        state_for(跟踪键, 时间)返回保存窗口的字典 {窗口组ID: 窗口}，由调用方管理生命周期。
+        """
+        alerts = []
+        for group in self.candidates(conn):
+            if group.checks and not group.matches(conn):
+                continue
+            if group.aggregate == AGGREGATE_DISTINCT:
+                value = conn.get(group.field)
+                if value is None:
+                    continue
+            key = group.key_value(conn)
+            if key is None:
+                continue
+            windows = state_for(key, timestamp)
+            window = windows.get(group.id)
+            if window is None:
+                window = windows[group.id] = group.new_window()
+            if group.aggregate == AGGREGATE_DISTINCT:
+                count = window.add(value, timestamp)
+            else:
+                count = window.add(timestamp)
+            for threshold, rule in group.thresholds:
+                if count <= threshold:
+                    break
+                alerts.append(make_alert(rule, count, key))
+        return alerts
+
+    def check(self, windows, timestamp, key=None):
+        """按截至timestamp的窗口计数检查一个跟踪键的全部规则"""
+        alerts = []
+        for group_id, window in windows.items():
+            group = self.groups[group_id]
+            count = window.count(timestamp)
+            for threshold, rule in group.thresholds:
+                if count <= threshold:
+                    break
+                alerts.append(make_alert(rule, count, key))
+        return alerts
+
+
+def make_alert(rule, count, key):
+    return {
+        'rule': rule['name'],
+        'action': rule['action'],
+        'severity': rule['severity'],
+        'count': count,
+        'key': key
+    }
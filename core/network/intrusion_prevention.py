@@ -1,47 +1,117 @@
 # 入侵防御模块
 # 实现异常连接检测与阻止
 
+import json
+import queue
 import time
 import threading
-from collections import defaultdict, deque
+from collections import OrderedDict, deque
+
+from .ids_rules import RuleEngine
+from .enforcement import Allowlist, default_allowlist
+from .sliding_window import TimingWheel
+
+
+class SourceState:
+    """单个跟踪键（通常是源IP）的滑动窗口 {窗口组ID: 窗口}；expires为其在时间轮中的到期tick，
+    alerted为各规则最近一次记入告警历史的时间 {规则名: 时间}"""
+    __slots__ = ('windows', 'last_seen', 'expires', 'alerted')
+    
+    def __init__(self, timestamp):
+        self.windows = {}
+        self.last_seen = timestamp
+        self.expires = None
+        self.alerted = {}
 
 class IntrusionPrevention:
-    def __init__(self):
-        self.connection_history = defaultdict(lambda: deque(maxlen=100))
+    def __init__(self, max_sources=100000, rules=None, batch_queue_size=1024, enforcer=None, allowlist=None,
+                 alert_history_size=1000):
+        # 跟踪键 -> SourceState：按规则引擎的窗口组保存滑动窗口（计数器或去重集合），
+        # 连接到达时增量更新，规则阈值检查为O(1)，不保存连接历史。
+        # 按最近活动排序，超过max_sources时淘汰最久未活动的键
+        self.sources = OrderedDict()
+        self.max_sources = max_sources
+        # 空闲超过最长规则窗口的键由时间轮到期释放；active_sources为上次检测以来有新连接的键
+        self.wheel = TimingWheel()
+        self.active_sources = set()
+        self.expired_sources = 0
+        self.evicted_sources = 0
+        self.lock = threading.Lock()
         self.blocked_ips = set()
-        self.rules = self.load_rules()
+        self.rules = rules if rules is not None else self.load_rules()
+        self.compile_rules()
         self.is_running = False
         self.monitor_thread = None
+        # 新阻止一个IP时调用的回调 listener(ip, reason, timestamp)，如保留告警前后的抓包；
+        # 解除阻止时调用 listener(ip)
+        self.block_listeners = []
+        self.unblock_listeners = []
+        # 流量监控投递的连接批次（数据包信息字典的列表），由监控线程逐批评估
+        self.batch_queue = queue.Queue(batch_queue_size)
+        self.dropped_connections = 0
+        # 可选的BlockEnforcer：把阻止的IP按批写入内核防火墙集合，为空时只在内存中记录
+        self.enforcer = enforcer
+        # 永不阻止的地址（Allowlist或IP/CIDR条目）；为空时使用本机地址、默认网关与DNS服务器，
+        # 在首次阻止时检测，每次开始监控时重新检测。spared_ips为因此未被阻止的IP
+        self.detect_allowlist = allowlist is None
+        if allowlist is not None and not isinstance(allowlist, Allowlist):
+            allowlist = Allowlist(allowlist)
+        self.allowlist = allowlist
+        self.spared_ips = set()
+        # 最近的告警（包括只告警不阻止的规则），同一规则对同一跟踪键在规则窗口内只记录一次
+        self.alert_history = deque(maxlen=alert_history_size)
     
     def load_rules(self):
-        """加载入侵检测规则"""
+        """加载入侵检测规则
+        
+        规则是声明式的：match为匹配条件（protocol、sport、dport、flags、flags_absent、icmp_type、icmp_code），
+        aggregate为 'count'（匹配的连接数）或 'distinct'（field字段的不同值数），
+        key为统计的分组字段（默认 'src'），window秒内超过threshold时产生告警；
+        action为 'block' 时阻止连接的源IP。
+        """
         return [
             {
                 'name': '端口扫描检测',
+                'aggregate': 'distinct',
+                'field': 'dport',
                 'threshold': 10,  # 10秒内尝试连接超过10个不同端口
-                'time_window': 10,
+                'window': 10,
                 'action': 'block',
                 'severity': 'high'
             },
             {
                 'name': '连接频率检测',
-                'threshold': 50,  # 5秒内超过50个连接
-                'time_window': 5,
+                'aggregate': 'count',
+                'threshold': 50,  # 5秒内发起超过50个新连接（任意协议）
+                'window': 5,
                 'action': 'block',
                 'severity': 'medium'
             },
             {
                 'name': '异常协议检测',
-                'pattern': lambda conn: conn.get('protocol') == 'ICMP' and conn.get('type') == 8,  # ICMP Echo Request
+                'match': {'protocol': 'ICMP', 'icmp_type': 8},  # ICMP Echo Request
+                'aggregate': 'count',
                 'threshold': 20,  # 10秒内超过20个ICMP请求
-                'time_window': 10,
+                'window': 10,
                 'action': 'block',
                 'severity': 'medium'
             }
         ]
     
+    def load_rules_file(self, path):
+        """从JSON文件（规则字典的列表）加载规则并替换当前规则"""
+        with open(path, 'r', encoding='utf-8') as f:
+            rules = json.load(f)
+        self.rules = rules
+        self.compile_rules()
+        return len(rules)
+    
     def start_monitoring(self):
         """开始入侵防御监控"""
+        if self.detect_allowlist:
+            self.allowlist = default_allowlist()
+        if self.enforcer is not None:
+            self.enforcer.start(self.blocked_ips)
         self.is_running = True
         self.monitor_thread = threading.Thread(
             target=self._monitoring_loop,
@@ -54,15 +124,72 @@ class IntrusionPrevention:
         self.is_running = False
         if self.monitor_thread:
             self.monitor_thread.join(timeout=2)
+        if self.enforcer is not None:
+            self.enforcer.stop()
     
     def _monitoring_loop(self):
-        """监控循环"""
+        """监控循环：逐批评估投递来的连接；每秒检查有新活动的源，并释放空闲的源"""
+        next_check = time.time() + 1
         while self.is_running:
-            time.sleep(1)
-            self.detect_intrusions()
+            try:
+                batch = self.batch_queue.get(timeout=max(0.0, next_check - time.time()))
+            except queue.Empty:
+                batch = None
+            if batch:
+                self.add_connections(batch)
+            now = time.time()
+            if now >= next_check:
+                self.detect_intrusions()
+                self.expire_idle(now)
+                next_check = now + 1
+        # 评估停止前已投递的批次
+        while True:
+            try:
+                self.add_connections(self.batch_queue.get_nowait())
+            except queue.Empty:
+                break
     
-    def add_connection(self, connection_info):
-        """添加连接信息"""
+    def submit_connections(self, connections):
+        """投递一批连接信息（不复制，评估时会写入timestamp字段），队列已满时丢弃整批，不阻塞调用方"""
+        try:
+            self.batch_queue.put_nowait(connections)
+        except queue.Full:
+            self.dropped_connections += len(connections)
+    
+    def compile_rules(self):
+        """把self.rules编译为规则引擎的评估计划
+        
+        修改self.rules后需要重新调用；已跟踪的键会丢弃旧的窗口状态。
+        """
+        engine = RuleEngine(self.rules)
+        with self.lock:
+            self.engine = engine
+            # 所有窗口都已清空的键没有保留的必要
+            self.idle_timeout = engine.idle_timeout
+            self.rule_windows = {rule.get('name'): rule['window'] for rule in engine.rules}
+            self.sources.clear()
+            self.active_sources.clear()
+            self.wheel.clear()
+    
+    def _state_for(self, key, timestamp):
+        """规则引擎的状态回调：返回跟踪键的窗口字典，必要时创建并登记到时间轮（持有锁时调用）"""
+        sources = self.sources
+        source = sources.get(key)
+        if source is None:
+            if len(sources) >= self.max_sources:
+                sources.popitem(last=False)
+                self.evicted_sources += 1
+            source = sources[key] = SourceState(timestamp)
+            source.expires = self.wheel.schedule(key, timestamp + self.idle_timeout)
+        else:
+            sources.move_to_end(key)
+            if timestamp > source.last_seen:
+                source.last_seen = timestamp
+        self.active_sources.add(key)
+        return source.windows
+    
+    def add_connection(self, connection_info, timestamp=None):
+        """添加连接信息，timestamp为空时使用当前时间（离线回放时传入记录的时间）"""
         src_ip = connection_info.get('src')
         if not src_ip:
             return
@@ -71,103 +198,202 @@ class IntrusionPrevention:
         if src_ip in self.blocked_ips:
             return {'status': 'blocked', 'reason': 'IP已被阻止'}
         
-        # 记录连接
-        timestamp = time.time()
+        # 更新匹配规则的滑动窗口并检查阈值
+        if timestamp is None:
+            timestamp = time.time()
         connection_info['timestamp'] = timestamp
-        self.connection_history[src_ip].append(connection_info)
-        
-        # 实时检测
-        alerts = self.check_rules(src_ip)
+        with self.lock:
+            # 时间轮按连接时间前进（离线回放时与实际时间无关）
+            if self.wheel.current is None or timestamp >= (self.wheel.current + 1) * self.wheel.resolution:
+                self._expire_idle(timestamp)
+            alerts = self.engine.observe(connection_info, timestamp, self._state_for)
+            if alerts:
+                self._record_alerts(alerts, timestamp)
         if alerts:
             for alert in alerts:
-                if alert['action'] == 'block':
-                    self.block_ip(src_ip, alert['rule'])
+                # 按源IP之外的键分组的规则只产生告警
+                if alert['action'] == 'block' and alert['key'] == src_ip:
+                    self.block_ip(src_ip, alert['rule'], timestamp)
+                    break
         
         return {'status': 'allowed'}
     
-    def check_rules(self, src_ip):
-        """检查规则"""
-        alerts = []
-        connections = self.connection_history[src_ip]
-        current_time = time.time()
+    def add_connections(self, connections, timestamps=None):
+        """批量添加连接信息：一次加锁评估整批连接，返回本批新阻止的IP列表
         
-        for rule in self.rules:
-            if 'threshold' in rule:
-                # 基于阈值的规则
-                time_window = rule['time_window']
-                threshold = rule['threshold']
-                
-                # 统计时间窗口内的连接
-                recent_connections = [
-                    conn for conn in connections
-                    if current_time - conn['timestamp'] <= time_window
-                ]
-                
-                if 'pattern' in rule:
-                    # 基于模式的规则
-                    matching_connections = [
-                        conn for conn in recent_connections
-                        if rule['pattern'](conn)
-                    ]
-                    if len(matching_connections) > threshold:
-                        alerts.append({
-                            'rule': rule['name'],
-                            'action': rule['action'],
-                            'severity': rule['severity'],
-                            'count': len(matching_connections)
-                        })
+        timestamps为与connections等长的时间序列，为空时使用连接信息中的timestamp（没有时为当前时间）。
+        同一批中已被阻止的源的后续连接会被跳过。
+        """
+        blocked_ips = self.blocked_ips
+        observe = self.engine.observe
+        state_for = self._state_for
+        wheel = self.wheel
+        blocks = {}
+        now = None
+        with self.lock:
+            for index, conn in enumerate(connections):
+                src_ip = conn.get('src')
+                if not src_ip or src_ip in blocked_ips or src_ip in blocks:
+                    continue
+                if timestamps is not None:
+                    timestamp = timestamps[index]
                 else:
-                    # 基于端口扫描的规则
-                    unique_ports = set()
-                    for conn in recent_connections:
-                        if 'dport' in conn:
-                            unique_ports.add(conn['dport'])
-                    
-                    if len(unique_ports) > threshold:
-                        alerts.append({
-                            'rule': rule['name'],
-                            'action': rule['action'],
-                            'severity': rule['severity'],
-                            'count': len(unique_ports)
-                        })
+                    timestamp = conn.get('timestamp')
+                    if timestamp is None:
+                        if now is None:
+                            now = time.time()
+                        timestamp = now
+                if wheel.current is None or timestamp >= (wheel.current + 1) * wheel.resolution:
+                    self._expire_idle(timestamp)
+                alerts = observe(conn, timestamp, state_for)
+                if not alerts:
+                    continue
+                self._record_alerts(alerts, timestamp)
+                for alert in alerts:
+                    if alert['action'] == 'block' and alert['key'] == src_ip:
+                        blocks[src_ip] = (alert['rule'], timestamp)
+                        break
+        return [
+            src_ip for src_ip, (reason, timestamp) in blocks.items() if self.block_ip(src_ip, reason, timestamp)
+        ]
+    
+    def check_rules(self, src_ip, current_time=None):
+        """检查规则：按各规则窗口截至current_time的计数判断阈值，不扫描连接历史"""
+        alerts = []
+        if current_time is None:
+            current_time = time.time()
+        with self.lock:
+            source = self.sources.get(src_ip)
+            if source is None:
+                return alerts
+            alerts = self.engine.check(source.windows, current_time, src_ip)
         
         return alerts
     
+    def expire_idle(self, now=None):
+        """释放空闲超过最长规则窗口的源，返回释放的数量"""
+        with self.lock:
+            return self._expire_idle(time.time() if now is None else now)
+    
+    def _expire_idle(self, now):
+        expired = 0
+        sources = self.sources
+        for tick, src_ip in self.wheel.advance(now):
+            source = sources.get(src_ip)
+            if source is None or source.expires != tick:
+                # 已被淘汰、阻止或重新创建的源留下的过时条目
+                continue
+            deadline = source.last_seen + self.idle_timeout
+            if deadline > now:
+                source.expires = self.wheel.schedule(src_ip, deadline)
+                continue
+            del sources[src_ip]
+            self.active_sources.discard(src_ip)
+            expired += 1
+        self.expired_sources += expired
+        return expired
+    
     def detect_intrusions(self):
-        """检测入侵行为"""
-        for src_ip in list(self.connection_history.keys()):
-            alerts = self.check_rules(src_ip)
+        """检测入侵行为：只检查上次检测以来有新连接的源"""
+        with self.lock:
+            active, self.active_sources = self.active_sources, set()
+        for key in active:
+            now = time.time()
+            alerts = self.check_rules(key, now)
             if alerts:
+                with self.lock:
+                    self._record_alerts(alerts, now)
                 for alert in alerts:
-                    if alert['action'] == 'block':
-                        self.block_ip(src_ip, alert['rule'])
+                    # 按源IP之外的键分组的规则只产生告警，阻止的对象始终是源IP
+                    if alert['action'] == 'block' and isinstance(key, str):
+                        self.block_ip(key, alert['rule'])
+    
+    def _record_alerts(self, alerts, timestamp):
+        """把告警记入历史（持有锁时调用）：同一规则对同一跟踪键在规则窗口内只记录一次"""
+        sources = self.sources
+        for alert in alerts:
+            source = sources.get(alert['key'])
+            if source is not None:
+                rule = alert['rule']
+                last = source.alerted.get(rule)
+                if last is not None and timestamp - last < self.rule_windows.get(rule, 0):
+                    continue
+                source.alerted[rule] = timestamp
+            alert['timestamp'] = timestamp
+            self.alert_history.append(alert)
     
-    def block_ip(self, ip, reason):
-        """阻止IP"""
+    def block_ip(self, ip, reason, timestamp=None):
+        """阻止IP，timestamp为触发告警的时间（为空时使用当前时间）
+        
+        允许列表中的地址不会被阻止。返回是否新阻止了该IP。
+        """
+        if ip in self.blocked_ips:
+            return False
+        if self.is_allowed(ip):
+            if ip not in self.spared_ips:
+                self.spared_ips.add(ip)
+                print(f"IP在允许列表中，不予阻止: {ip}, 原因: {reason}")
+            return False
         self.blocked_ips.add(ip)
+        # 被阻止的源不再检测，释放其窗口状态
+        with self.lock:
+            self.sources.pop(ip, None)
+            self.active_sources.discard(ip)
         print(f"阻止IP: {ip}, 原因: {reason}")
+        if self.enforcer is not None:
+            self.enforcer.block(ip)
+        if timestamp is None:
+            timestamp = time.time()
+        for listener in self.block_listeners:
+            try:
+                listener(ip, reason, timestamp)
+            except Exception as e:
+                print(f"阻止回调失败: {e}")
+        return True
+    
+    def is_allowed(self, ip):
+        """IP是否在允许列表中（永不阻止）"""
+        if self.allowlist is None:
+            self.allowlist = default_allowlist()
+        return ip in self.allowlist
     
     def unblock_ip(self, ip):
         """解除IP阻止"""
         if ip in self.blocked_ips:
             self.blocked_ips.remove(ip)
             print(f"解除阻止IP: {ip}")
+            if self.enforcer is not None:
+                self.enforcer.unblock(ip)
+            for listener in self.unblock_listeners:
+                try:
+                    listener(ip)
+                except Exception as e:
+                    print(f"解除阻止回调失败: {e}")
     
     def get_blocked_ips(self):
         """获取被阻止的IP列表"""
         return list(self.blocked_ips)
     
     def get_alert_history(self, limit=50):
-        """获取告警历史"""
-        # 这里可以实现告警历史记录
-        return []
+        """获取最近的limit条告警（按时间从旧到新）"""
+        with self.lock:
+            alerts = list(self.alert_history)
+        return alerts[-limit:] if limit else alerts
     
     def get_statistics(self):
         """获取统计信息"""
         return {
             'blocked_ips': len(self.blocked_ips),
-            'monitored_ips': len(self.connection_history),
-            'rules_count': len(self.rules)
+            'monitored_ips': len(self.sources),
+            'expired_sources': self.expired_sources,
+            'evicted_sources': self.evicted_sources,
+            'rules_count': len(self.rules),
+            'window_groups': len(self.engine.groups),
+            'queued_batches': self.batch_queue.qsize(),
+            'dropped_connections': self.dropped_connections,
+            'spared_ips': len(self.spared_ips),
+            'alerts': len(self.alert_history),
+            'enforcement': self.enforcer.get_statistics() if self.enforcer is not None else None
         }
 
 # 示例用法
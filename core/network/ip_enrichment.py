@@ -0,0 +1,292 @@
+# IP信息补充模块
+# 从本地内存映射的有序二进制前缀表中二分查找IP所属的ASN、组织与国家，前面加一层LRU缓存
+
+import csv
+import ipaddress
+import mmap
+import os
+import struct
+import sys
+import threading
+from collections import OrderedDict
+
+from core.config import PlatformConfig
+from .packet_utils import ip_to_int
+
+DATABASE_SUFFIX = '.ipdb'
+DATABASE_MAGIC = b'KALIIPDB'
+
+# 文件头：魔数、区间数、字符串区偏移；之后是按起始地址排序、互不重叠的定长区间记录，
+# 最后是以NUL结尾的UTF-8组织名称
+_file_header = struct.Struct('<8sII')
+# 起始地址、结束地址（含）、ASN（0为未知）、组织名称偏移（0xFFFFFFFF为无）、国家代码
+_range = struct.Struct('<IIII2s2x')
+_start = struct.Struct('<I')
+NO_STRING = 0xFFFFFFFF
+
+
+def _flatten(ranges):
+    """把可能嵌套的区间 [(起始, 结束, 数据)] 展开为互不重叠的区间，嵌套时更具体的区间优先"""
+    ranges.sort(key=lambda item: (item[0], -item[1]))
+    flat = []
+    stack = []
+    cursor = 0
+    for start, end, data in ranges:
+        while stack and stack[-1][1] < start:
+            _, top_end, top_data = stack.pop()
+            if cursor <= top_end:
+                flat.append((cursor, top_end, top_data))
+                cursor = top_end + 1
+        if stack and cursor < start:
+            flat.append((cursor, start - 1, stack[-1][2]))
+        cursor = max(cursor, start)
+        stack.append((start, end, data))
+    while stack:
+        _, top_end, top_data = stack.pop()
+        if cursor <= top_end:
+            flat.append((cursor, top_end, top_data))
+            cursor = top_end + 1
+    return flat
+
+
+def build_database(entries, path):
+    """由 (起始IP, 结束IP, ASN, 组织, 国家) 生成前缀表文件，IP可以是整数或点分十进制，返回区间数"""
+    ranges = []
+    for start, end, asn, organisation, country in entries:
+        if isinstance(start, str):
+            start = ip_to_int(start)
+        if isinstance(end, str):
+            end = ip_to_int(end)
+        if start <= end:
+            ranges.append((start, end, (asn or 0, organisation or None, (country or '').upper()[:2])))
+    flat = _flatten(ranges)
+
+    strings = bytearray()
+    offsets = {}
+    records = bytearray()
+    for start, end, (asn, organisation, country) in flat:
+        offset = NO_STRING
+        if organisation:
+            offset = offsets.get(organisation)
+            if offset is None:
+                offset = offsets[organisation] = len(strings)
+                strings += organisation.encode('utf-8', 'replace').replace(b'\0', b'') + b'\0'
+        records += _range.pack(start, end, asn, offset, country.encode('ascii', 'replace'))
+
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as output:
+        output.write(_file_header.pack(DATABASE_MAGIC, len(flat), _file_header.size + len(records)))
+        output.write(records)
+        output.write(strings)
+    os.replace(temporary, path)
+    return len(flat)
+
+
+def read_source(path):
+    """读取常见的文本格式前缀数据，产出 (起始IP, 结束IP, ASN, 组织, 国家)
+
+    .tsv: ip2asn格式（起始IP、结束IP、AS号、国家代码、AS描述），AS号为0的未路由区间被跳过；
+    .csv: 网络（CIDR或 '起始-结束'）、ASN、组织、国家，列可以缺省，首行可以是表头。
+    只处理IPv4。
+    """
+    with open(path, newline='', encoding='utf-8', errors='replace') as source:
+        if path.endswith('.tsv'):
+            for line in source:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) < 5 or ':' in fields[0] or fields[2] in ('0', ''):
+                    continue
+                try:
+                    asn = int(fields[2])
+                except ValueError:
+                    continue
+                country = fields[3] if fields[3] not in ('None', 'ZZ') else ''
+                yield fields[0], fields[1], asn, fields[4], country
+            return
+
+        for row in csv.reader(source):
+            if not row or ':' in row[0]:
+                continue
+            network = row[0].strip()
+            try:
+                if '-' in network:
+                    start, end = (ip_to_int(part.strip()) for part in network.split('-', 1))
+                else:
+                    parsed = ipaddress.IPv4Network(network, strict=False)
+                    start, end = int(parsed.network_address), int(parsed.broadcast_address)
+                asn = row[1].strip().upper().lstrip('AS') if len(row) > 1 else ''
+                asn = int(asn) if asn else 0
+            except ValueError:
+                # 表头或无效行
+                continue
+            organisation = row[2].strip() if len(row) > 2 else ''
+            country = row[3].strip() if len(row) > 3 else ''
+            yield start, end, asn, organisation, country
+
+
+class PrefixDatabase:
+    """内存映射的前缀表文件，lookup()对定长区间记录做二分查找，不把表读入内存"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self.count, self._strings = _file_header.unpack_from(self._mmap, 0)
+            if magic != DATABASE_MAGIC:
+                raise ValueError(f"不是前缀表文件: {path}")
+        except (ValueError, struct.error):
+            self._file.close()
+            raise ValueError(f"不是前缀表文件: {path}")
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def __len__(self):
+        return self.count
+
+    def lookup(self, ip):
+        """整数IP所在区间的 (ASN, 组织, 国家)，不在任何区间中时返回None"""
+        data = self._mmap
+        unpack_start = _start.unpack_from
+        base = _file_header.size
+        size = _range.size
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) >> 1
+            if unpack_start(data, base + middle * size)[0] <= ip:
+                low = middle + 1
+            else:
+                high = middle
+        if not low:
+            return None
+        _, end, asn, offset, country = _range.unpack_from(data, base + (low - 1) * size)
+        if ip > end:
+            return None
+        organisation = None
+        if offset != NO_STRING:
+            position = self._strings + offset
+            organisation = data[position:data.find(b'\0', position)].decode('utf-8', 'replace')
+        return asn, organisation, country.decode('ascii', 'replace').rstrip('\0')
+
+
+class IpEnricher:
+    """按IP补充ASN、组织与国家
+
+    可以加载多个前缀表（如一个ASN表与一个国家表），同一字段取第一个有值的表；
+    最近查询过的地址（包括查不到的）保存在容量为cache_size的LRU缓存中。
+    """
+
+    def __init__(self, paths=(), cache_size=65536):
+        self.databases = []
+        for path in paths:
+            try:
+                self.databases.append(PrefixDatabase(path))
+            except (OSError, ValueError) as e:
+                print(f"加载前缀表失败: {e}")
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_directory(cls, directory=None, cache_size=65536):
+        """加载目录（默认为应用数据目录下的ipdb）中所有.ipdb文件"""
+        directory = directory or default_directory()
+        paths = []
+        if os.path.isdir(directory):
+            paths = sorted(
+                os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(DATABASE_SUFFIX)
+            )
+        return cls(paths, cache_size)
+
+    def close(self):
+        for database in self.databases:
+            database.close()
+        self.databases = []
+        self.clear_cache()
+
+    def clear_cache(self):
+        with self.lock:
+            self.cache.clear()
+
+    def lookup(self, ip):
+        """IP（点分十进制或整数）的 {'asn', 'organisation', 'country'}，没有任何信息时返回None"""
+        if not self.databases:
+            return None
+        if isinstance(ip, str):
+            if ':' in ip:
+                return None
+            ip = ip_to_int(ip)
+        cache = self.cache
+        with self.lock:
+            if ip in cache:
+                cache.move_to_end(ip)
+                self.hits += 1
+                return cache[ip]
+        info = self._resolve(ip)
+        with self.lock:
+            self.misses += 1
+            cache[ip] = info
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return info
+
+    def _resolve(self, ip):
+        asn = organisation = country = None
+        for database in self.databases:
+            found = database.lookup(ip)
+            if found is None:
+                continue
+            asn = asn or found[0] or None
+            organisation = organisation or found[1]
+            country = country or found[2] or None
+            if asn and organisation and country:
+                break
+        if asn is None and organisation is None and country is None:
+            return None
+        return {'asn': asn, 'organisation': organisation, 'country': country}
+
+    def describe(self, ip):
+        """IP的简短描述，如 'AS15169 Google LLC, US'，没有信息时返回空字符串"""
+        info = self.lookup(ip)
+        if info is None:
+            return ''
+        parts = []
+        if info['asn']:
+            parts.append(f"AS{info['asn']}")
+        if info['organisation']:
+            parts.append(info['organisation'])
+        text = ' '.join(parts)
+        if info['country']:
+            text = f"{text}, {info['country']}" if text else info['country']
+        return text
+
+    def get_statistics(self):
+        return {
+            'databases': [database.path for database in self.databases],
+            'ranges': sum(len(database) for database in self.databases),
+            'cached': len(self.cache),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+def default_directory():
+    """前缀表的默认存放目录"""
+    return os.path.join(PlatformConfig.get_app_data_dir(), 'ipdb')
+
+
+# 示例用法：把文本格式的前缀数据转换为前缀表
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("用法: python -m core.network.ip_enrichment 源文件(.tsv/.csv) [输出文件.ipdb]")
+        sys.exit(1)
+    source_path = sys.argv[1]
+    output_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(
+        default_directory(), os.path.splitext(os.path.basename(source_path))[0] + DATABASE_SUFFIX
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    count = build_database(read_source(source_path), output_path)
+    print(f"已写入 {count} 个区间: {output_path}")
@@ -0,0 +1,113 @@
+# 处理延迟统计模块
+# 对数分桶的延迟直方图与按阶段的抽样计时，用于判断分析路径是否跟得上抓包速度
+
+import time
+
+# 计时的处理阶段：解析（帧或scapy包 -> 数据包信息）、流表更新、历史记录追加
+STAGE_DISSECT = 'dissect'
+STAGE_FLOW_UPDATE = 'flow_update'
+STAGE_HISTORY_APPEND = 'history_append'
+STAGES = (STAGE_DISSECT, STAGE_FLOW_UPDATE, STAGE_HISTORY_APPEND)
+
+
+class LatencyHistogram:
+    """以微秒为单位、按2的幂分桶的延迟直方图
+
+    桶i覆盖 [2**(i-1), 2**i) 微秒（桶0为不足1微秒），百分位取所在桶的上界（不超过最大值）。
+    """
+
+    BUCKETS = 32
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def clear(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        micros = seconds * 1e6
+        self.counts[min(int(micros).bit_length(), self.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += micros
+        if micros > self.max:
+            self.max = micros
+
+    def export(self):
+        """导出可跨进程传递的元组"""
+        return list(self.counts), self.count, self.total, self.max
+
+    def merge(self, data):
+        counts, count, total, maximum = data
+        for index, value in enumerate(counts):
+            self.counts[index] += value
+        self.count += count
+        self.total += total
+        self.max = max(self.max, maximum)
+
+    def percentile(self, fraction):
+        if not self.count:
+            return 0.0
+        threshold = fraction * self.count
+        seen = 0
+        for index, value in enumerate(self.counts):
+            seen += value
+            if seen >= threshold:
+                return min(float(1 << index), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'samples': self.count,
+            'mean_us': self.total / self.count if self.count else 0.0,
+            'p50_us': self.percentile(0.5),
+            'p90_us': self.percentile(0.9),
+            'p99_us': self.percentile(0.99),
+            'max_us': self.max
+        }
+
+
+class StageLatency:
+    """各处理阶段的延迟直方图
+
+    每sample_every个数据包只计时一个（须为2的幂），避免在每个包上调用计时器。
+    """
+
+    def __init__(self, sample_every=64):
+        self.sample_mask = max(1, sample_every) - 1
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+        self.clock = time.perf_counter
+        self._counter = 0
+
+    def clear(self):
+        for histogram in self.histograms.values():
+            histogram.clear()
+        self._counter = 0
+
+    def sample(self):
+        """是否对当前这个包计时"""
+        self._counter += 1
+        return not self._counter & self.sample_mask
+
+    def record(self, stage, seconds):
+        self.histograms[stage].add(seconds)
+
+    def export(self):
+        return {stage: histogram.export() for stage, histogram in self.histograms.items()}
+
+    def to_dict(self):
+        return {stage: histogram.to_dict() for stage, histogram in self.histograms.items()}
+
+
+def merge_latency(exports):
+    """合并多个分片导出的阶段延迟，返回与StageLatency.to_dict()相同格式的字典"""
+    merged = {stage: LatencyHistogram() for stage in STAGES}
+    for export in exports:
+        for stage, data in export.items():
+            merged.setdefault(stage, LatencyHistogram()).merge(data)
+    return {stage: histogram.to_dict() for stage, histogram in merged.items()}
@@ -0,0 +1,203 @@
+# 多接口抓包模块
+# 每个网卡由独立线程抓包与计数，帧按接口分批放入各自的有界队列，由合并线程轮询送入同一分析路径
+
+import queue
+import threading
+import time
+
+from .fast_capture import RawSocketCapture
+
+try:
+    from scapy.all import sniff
+except ImportError:
+    sniff = None
+
+
+class InterfaceCapture:
+    """单个网卡的抓包线程
+
+    抓包线程只负责收包、计数与分批，解析与统计都在合并线程中进行。
+    队列已满时丢弃整批并计入queue_dropped，不会阻塞本接口的收包，也不影响其他接口。
+    """
+
+    def __init__(self, name, mode, bpf_filter=None, batch_size=64, queue_size=256, flush_interval=0.1,
+                 notify=None):
+        self.name = name
+        # 'raw' 或 'scapy'
+        self.mode = mode
+        self.bpf_filter = bpf_filter
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(queue_size)
+        # 有新批次时通知合并线程
+        self.notify = notify
+        self.packets = 0
+        self.bytes = 0
+        self.queue_dropped = 0
+        self.error = None
+        self.capture = None
+        self.thread = None
+        self.is_running = False
+        self._batch = []
+        self._last_flush = 0.0
+
+    def start(self):
+        self.is_running = True
+        target = self._raw_loop if self.mode == 'raw' else self._scapy_loop
+        self.thread = threading.Thread(target=target, name=f"capture-{self.name}", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=2):
+        self.is_running = False
+        if self.thread:
+            self.thread.join(timeout=timeout)
+
+    def _raw_loop(self):
+        self.capture = RawSocketCapture(self.name, self.bpf_filter)
+        try:
+            self.capture.run(self._handle_frame, self._should_continue)
+        except Exception as e:
+            self.error = str(e)
+            print(f"接口 {self.name} 抓包失败: {e}")
+        finally:
+            self._flush()
+            self.is_running = False
+
+    def _scapy_loop(self):
+        # scapy只在收到数据包时回调，逐包投递，避免空闲时批次滞留
+        self.batch_size = 1
+        kwargs = {
+            'prn': lambda packet: self._handle_frame(bytes(packet), time.time()),
+            'iface': self.name,
+            'store': 0,
+            'stop_filter': lambda packet: not self.is_running
+        }
+        if isinstance(self.bpf_filter, str):
+            kwargs['filter'] = self.bpf_filter
+        try:
+            sniff(**kwargs)
+        except Exception as e:
+            self.error = str(e)
+            print(f"接口 {self.name} 抓包失败: {e}")
+        finally:
+            self.is_running = False
+
+    def _handle_frame(self, frame, timestamp):
+        self.packets += 1
+        self.bytes += len(frame)
+        # 原始套接字的帧只在回调期间有效，需要复制
+        self._batch.append((bytes(frame), timestamp))
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+
+    def _should_continue(self):
+        if self._batch and time.monotonic() - self._last_flush >= self.flush_interval:
+            self._flush()
+        return self.is_running
+
+    def _flush(self):
+        self._last_flush = time.monotonic()
+        if not self._batch:
+            return
+        try:
+            self.queue.put_nowait(self._batch)
+        except queue.Full:
+            self.queue_dropped += len(self._batch)
+        self._batch = []
+        if self.notify is not None:
+            self.notify.set()
+
+    def get_statistics(self):
+        """本接口的计数：收到的包数与字节数、队列丢弃数、内核收包与丢包（仅原始套接字）"""
+        kernel_received = kernel_dropped = None
+        if self.capture is not None:
+            kernel_received, kernel_dropped = self.capture.read_statistics()
+        return {
+            'mode': self.mode,
+            'packet_count': self.packets,
+            'total_bytes': self.bytes,
+            'queue_dropped': self.queue_dropped,
+            'queue_batches': self.queue.qsize(),
+            'kernel_received': kernel_received,
+            'kernel_dropped': kernel_dropped,
+            'running': self.is_running,
+            'error': self.error
+        }
+
+
+class MultiInterfaceCapture:
+    """多接口并发抓包
+
+    每个接口一个抓包线程；合并线程每轮从每个接口的队列各取至多一批，
+    依次调用 handler(frame, timestamp, interface)，因此处理路径始终是单线程的，
+    某个接口流量暴涨也只会挤占它自己的队列。
+    """
+
+    def __init__(self, interfaces, mode, handler, bpf_filter=None, batch_size=64, queue_size=256,
+                 flush_interval=0.1, idle=None):
+        self.handler = handler
+        # 合并线程每轮调用的回调（如空闲时发布快照）
+        self.idle = idle
+        self.flush_interval = flush_interval
+        self._ready = threading.Event()
+        self.interfaces = [
+            InterfaceCapture(name, mode, bpf_filter, batch_size, queue_size, flush_interval, self._ready)
+            for name in interfaces
+        ]
+        self.merge_thread = None
+        self.is_running = False
+
+    def start(self):
+        self.is_running = True
+        for capture in self.interfaces:
+            capture.start()
+        self.merge_thread = threading.Thread(target=self._merge_loop, name='capture-merge', daemon=True)
+        self.merge_thread.start()
+
+    def stop(self, timeout=2):
+        """停止各接口的抓包线程，合并线程处理完队列中剩余的批次后退出"""
+        for capture in self.interfaces:
+            capture.is_running = False
+        for capture in self.interfaces:
+            capture.stop(timeout)
+        self.is_running = False
+        self._ready.set()
+        if self.merge_thread:
+            self.merge_thread.join(timeout=timeout)
+
+    def _merge_loop(self):
+        handler = self.handler
+        while True:
+            # 先清除再检查队列，避免漏掉检查之后才到达的通知
+            self._ready.clear()
+            handled = False
+            for capture in self.interfaces:
+                try:
+                    batch = capture.queue.get_nowait()
+                except queue.Empty:
+                    continue
+                handled = True
+                name = capture.name
+                for frame, timestamp in batch:
+                    try:
+                        handler(frame, timestamp, name)
+                    except Exception as e:
+                        print(f"处理接口 {name} 的数据包失败: {e}")
+            if self.idle is not None:
+                self.idle()
+            if not handled:
+                if not self.is_running:
+                    break
+                self._ready.wait(self.flush_interval)
+
+    def queue_fill(self):
+        """各接口队列中最满的一个的填充率（0~1）"""
+        return max((capture.queue.qsize() / capture.queue.maxsize for capture in self.interfaces), default=0.0)
+
+    def queue_dropped(self):
+        """各接口队列已满而丢弃的包数之和"""
+        return sum(capture.queue_dropped for capture in self.interfaces)
+
+    def get_statistics(self):
+        """按接口名称返回各接口的计数"""
+        return {capture.name: capture.get_statistics() for capture in self.interfaces}
@@ -0,0 +1,177 @@
+# 数据包历史环形缓冲区
+# 预分配的列式存储，写入为O(1)且内存占用固定
+
+from array import array
+from collections.abc import Mapping
+
+from .packet_utils import (
+    PROTO_CODES, PROTO_NAMES, PROTO_UNKNOWN,
+    ip_to_int, int_to_ip, flags_to_bits, bits_to_flags
+)
+
+# 列名与array类型码
+COLUMNS = (
+    ('timestamp', 'd'),
+    ('length', 'I'),
+    ('protocol', 'B'),
+    ('src', 'I'),
+    ('dst', 'I'),
+    ('sport', 'H'),
+    ('dport', 'H'),
+    ('flags', 'H'),
+    ('type', 'B'),
+    ('code', 'B'),
+)
+
+
+def _column(typecode, size):
+    """创建指定长度、全零初始化的列"""
+    return array(typecode, bytes(array(typecode).itemsize * size))
+
+
+class PacketView(Mapping):
+    """环形缓冲区中单条记录的只读视图，字段在访问时才解码
+
+    记录被新数据覆盖后视图失效，表现为空映射。
+    """
+    __slots__ = ('_ring', '_seq')
+
+    def __init__(self, ring, seq):
+        self._ring = ring
+        self._seq = seq
+
+    def _keys(self):
+        index = self._ring._index_of(self._seq)
+        if index is None:
+            return ()
+        return _KEYS_BY_PROTO[self._ring.protocol[index]]
+
+    def __getitem__(self, key):
+        if key not in self._keys():
+            raise KeyError(key)
+        return self._ring._field(self._ring._index_of(self._seq), key)
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def to_dict(self):
+        """物化为普通字典"""
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"PacketView({self.to_dict()!r})"
+
+
+_BASE_KEYS = ('timestamp', 'length', 'protocol')
+_IP_KEYS = _BASE_KEYS + ('src', 'dst')
+_KEYS_BY_PROTO = (
+    _BASE_KEYS,
+    _IP_KEYS,
+    _IP_KEYS + ('sport', 'dport', 'flags'),
+    _IP_KEYS + ('sport', 'dport'),
+    _IP_KEYS + ('type', 'code'),
+)
+
+
+class PacketRing:
+    """定长列式环形缓冲区
+
+    每个字段一列预分配的array，写满后覆盖最旧的记录。
+    IP地址以整数存储，TCP标志以位掩码存储，读取时再还原。
+    """
+
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        for name, typecode in COLUMNS:
+            setattr(self, name, _column(typecode, capacity))
+        # 累计写入的记录数，写入位置为 cursor % capacity
+        self.cursor = 0
+
+    def __len__(self):
+        return min(self.cursor, self.capacity)
+
+    def clear(self):
+        """清空缓冲区（不释放已分配的内存）"""
+        self.cursor = 0
+
+    def append(self, packet_info):
+        """追加一条analyze_packet生成的数据包信息"""
+        protocol = PROTO_CODES.get(packet_info.get('protocol'), PROTO_UNKNOWN)
+        src = packet_info.get('src')
+        dst = packet_info.get('dst')
+        flags = packet_info.get('flags')
+        self.append_fields(
+            packet_info['timestamp'],
+            packet_info['length'],
+            protocol,
+            ip_to_int(src) if src else 0,
+            ip_to_int(dst) if dst else 0,
+            packet_info.get('sport', 0),
+            packet_info.get('dport', 0),
+            flags_to_bits(flags) if flags else 0,
+            packet_info.get('type', 0),
+            packet_info.get('code', 0)
+        )
+
+    def append_fields(self, timestamp, length, protocol, src=0, dst=0,
+                      sport=0, dport=0, flags=0, icmp_type=0, icmp_code=0):
+        """按列直接写入一条记录（已编码的字段）"""
+        index = self.cursor % self.capacity
+        self.timestamp[index] = timestamp
+        self.length[index] = length
+        self.protocol[index] = protocol
+        self.src[index] = src
+        self.dst[index] = dst
+        self.sport[index] = sport
+        self.dport[index] = dport
+        self.flags[index] = flags
+        self.type[index] = icmp_type
+        self.code[index] = icmp_code
+        self.cursor += 1
+
+    def _index_of(self, seq):
+        """序号对应的列下标，记录已被覆盖时返回None"""
+        if seq < 0 or seq >= self.cursor or self.cursor - seq > self.capacity:
+            return None
+        return seq % self.capacity
+
+    def _field(self, index, key):
+        """解码指定下标的单个字段"""
+        if key == 'protocol':
+            return PROTO_NAMES[self.protocol[index]]
+        if key == 'src' or key == 'dst':
+            return int_to_ip(getattr(self, key)[index])
+        if key == 'flags':
+            return bits_to_flags(self.flags[index])
+        return getattr(self, key)[index]
+
+    def _seq_range(self, limit):
+        start = max(self.cursor - min(limit, self.capacity), 0)
+        return range(start, self.cursor)
+
+    def get_recent(self, limit=100):
+        """获取最近的记录视图，按时间从旧到新排列"""
+        return [PacketView(self, seq) for seq in self._seq_range(limit)]
+
+    def get_recent_dicts(self, limit=100):
+        """获取最近的记录并物化为字典"""
+        return [view.to_dict() for view in self.get_recent(limit)]
+
+    def get_columns(self, limit=None):
+        """获取最近记录的原始列副本，按时间从旧到新排列"""
+        count = len(self) if limit is None else min(limit, len(self))
+        end = self.cursor % self.capacity
+        start = (self.cursor - count) % self.capacity
+        columns = {}
+        for name, typecode in COLUMNS:
+            column = getattr(self, name)
+            if count == 0:
+                columns[name] = array(typecode)
+            elif start < end:
+                columns[name] = column[start:end]
+            else:
+                columns[name] = column[start:] + column[:end]
+        return columns
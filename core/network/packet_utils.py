@@ -0,0 +1,65 @@
+# 数据包字段编码工具
+# 提供协议编号、IPv4地址与TCP标志位的紧凑编码转换
+
+import socket
+import struct
+
+# 协议编号（列式存储与流表使用的紧凑编码）
+PROTO_UNKNOWN = 0
+PROTO_IP = 1
+PROTO_TCP = 2
+PROTO_UDP = 3
+PROTO_ICMP = 4
+
+PROTO_NAMES = ('Unknown', 'IP', 'TCP', 'UDP', 'ICMP')
+PROTO_CODES = {name: code for code, name in enumerate(PROTO_NAMES)}
+
+# TCP标志位，顺序与scapy的字符串表示一致（如 'SA' 表示SYN+ACK）
+TCP_FLAG_LETTERS = 'FSRPAUECN'
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_PSH = 0x08
+TCP_ACK = 0x10
+
+_ip_struct = struct.Struct('!I')
+_flag_bits_cache = {}
+_flag_str_cache = {}
+
+
+def ip_to_int(ip):
+    """将点分十进制IPv4地址转换为整数，无法转换时返回0"""
+    try:
+        return _ip_struct.unpack(socket.inet_aton(ip))[0]
+    except (OSError, TypeError):
+        return 0
+
+
+def int_to_ip(value):
+    """将整数转换为点分十进制IPv4地址"""
+    return socket.inet_ntoa(_ip_struct.pack(value))
+
+
+def flags_to_bits(flags):
+    """将TCP标志字符串（如 'SA'）转换为位掩码"""
+    bits = _flag_bits_cache.get(flags)
+    if bits is None:
+        bits = 0
+        for letter in str(flags):
+            position = TCP_FLAG_LETTERS.find(letter)
+            if position >= 0:
+                bits |= 1 << position
+        _flag_bits_cache[flags] = bits
+    return bits
+
+
+def bits_to_flags(bits):
+    """将TCP标志位掩码转换为字符串（如 'SA'）"""
+    flags = _flag_str_cache.get(bits)
+    if flags is None:
+        flags = ''.join(
+            letter for position, letter in enumerate(TCP_FLAG_LETTERS)
+            if bits & (1 << position)
+        )
+        _flag_str_cache[bits] = flags
+    return flags
@@ -0,0 +1,327 @@
+# 离线抓包回放模块
+# 通过内存映射读取pcap/pcapng文件，驱动与实时抓包相同的分析路径并统计吞吐与各阶段耗时
+
+import mmap
+import os
+import re
+import struct
+import time
+
+from .fast_capture import decode_frame, decode_ipv4, ETH_P_IP
+from .traffic_state import initiates_connection
+
+# 链路层类型
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+# 部分平台上LINKTYPE_RAW的旧编号
+_RAW_LINKTYPES = (LINKTYPE_RAW, 12, 14)
+
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 0x00000001
+PCAPNG_PB = 0x00000002
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+
+CAPTURE_EXTENSIONS = ('.pcap', '.pcapng', '.cap')
+# 每批交给入侵防御的连接数
+CONNECTION_BATCH_SIZE = 256
+
+# pcap文件头魔数（按小端读取）-> (字节序, 时间戳分辨率)
+_PCAP_MAGICS = {
+    0xA1B2C3D4: ('<', 1e-6),
+    0xD4C3B2A1: ('>', 1e-6),
+    0xA1B23C4D: ('<', 1e-9),
+    0x4D3CB2A1: ('>', 1e-9),
+}
+
+
+def decode_link_frame(frame, linktype, timestamp):
+    """按链路层类型解析一帧，返回与analyze_packet相同格式的数据包信息"""
+    if linktype == LINKTYPE_ETHERNET:
+        return decode_frame(frame, timestamp)
+
+    packet_info = {
+        'timestamp': timestamp,
+        'length': len(frame),
+        'protocol': 'Unknown'
+    }
+    if linktype in _RAW_LINKTYPES:
+        decode_ipv4(frame, 0, packet_info)
+    elif linktype == LINKTYPE_LINUX_SLL and len(frame) >= 16:
+        if struct.unpack_from('!H', frame, 14)[0] == ETH_P_IP:
+            decode_ipv4(frame, 16, packet_info)
+    elif linktype == LINKTYPE_LINUX_SLL2 and len(frame) >= 20:
+        if struct.unpack_from('!H', frame, 0)[0] == ETH_P_IP:
+            decode_ipv4(frame, 20, packet_info)
+    return packet_info
+
+
+class CaptureFileReader:
+    """基于mmap的pcap/pcapng读取器
+
+    packets()逐个产出 (帧, 时间戳, 链路层类型)，帧为文件映射的memoryview切片，
+    无需复制，但只在读取器关闭前有效。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件无法映射
+            self._mmap = None
+        self._view = memoryview(self._mmap) if self._mmap is not None else memoryview(b'')
+        self.format = self._detect_format()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """关闭文件映射"""
+        try:
+            self._view.release()
+            if self._mmap is not None:
+                self._mmap.close()
+        except BufferError:
+            # 仍有外部引用的帧切片时交由垃圾回收释放
+            pass
+        self._file.close()
+
+    def _detect_format(self):
+        if len(self._view) < 4:
+            return None
+        magic = struct.unpack_from('<I', self._view, 0)[0]
+        if magic == PCAPNG_SHB:
+            return 'pcapng'
+        if magic in _PCAP_MAGICS:
+            return 'pcap'
+        raise ValueError(f"不支持的抓包文件格式: {self.path}")
+
+    def packets(self):
+        """逐个产出 (帧, 时间戳, 链路层类型)"""
+        if self.format == 'pcap':
+            return self._pcap_packets()
+        if self.format == 'pcapng':
+            return self._pcapng_packets()
+        return iter(())
+
+    def first_timestamp(self):
+        """文件中第一个数据包的时间戳，没有数据包时返回None"""
+        for _, timestamp, _ in self.packets():
+            return timestamp
+        return None
+
+    def _pcap_packets(self):
+        view = self._view
+        size = len(view)
+        order, resolution = _PCAP_MAGICS[struct.unpack_from('<I', view, 0)[0]]
+        linktype = struct.unpack_from(order + 'I', view, 20)[0] & 0x0FFFFFFF
+        record = struct.Struct(order + 'IIII')
+
+        offset = 24
+        while offset + 16 <= size:
+            ts_sec, ts_frac, caplen, _ = record.unpack_from(view, offset)
+            offset += 16
+            if offset + caplen > size:
+                break
+            yield view[offset:offset + caplen], ts_sec + ts_frac * resolution, linktype
+            offset += caplen
+
+    def _pcapng_packets(self):
+        view = self._view
+        size = len(view)
+        order = '<'
+        interfaces = []
+
+        offset = 0
+        while offset + 12 <= size:
+            block_type = struct.unpack_from(order + 'I', view, offset)[0]
+            if block_type == PCAPNG_SHB:
+                # 每个段头块重新确定字节序，接口编号也从零开始
+                if struct.unpack_from('<I', view, offset + 8)[0] == PCAPNG_BYTE_ORDER_MAGIC:
+                    order = '<'
+                else:
+                    order = '>'
+                interfaces = []
+            block_length = struct.unpack_from(order + 'I', view, offset + 4)[0]
+            if block_length < 12 or offset + block_length > size:
+                break
+            body = offset + 8
+
+            if block_type == PCAPNG_IDB:
+                linktype, _, snaplen = struct.unpack_from(order + 'HHI', view, body)
+                resolution = self._pcapng_tsresol(view, order, body + 8, offset + block_length - 4)
+                interfaces.append((linktype, snaplen, resolution))
+            elif block_type == PCAPNG_EPB:
+                interface_id, ts_high, ts_low, caplen, _ = struct.unpack_from(order + 'IIIII', view, body)
+                if interface_id < len(interfaces):
+                    linktype, _, resolution = interfaces[interface_id]
+                    data = body + 20
+                    yield view[data:data + caplen], ((ts_high << 32) | ts_low) * resolution, linktype
+            elif block_type == PCAPNG_SPB:
+                if interfaces:
+                    linktype, snaplen, _ = interfaces[0]
+                    orig_len = struct.unpack_from(order + 'I', view, body)[0]
+                    caplen = min(orig_len, block_length - 16)
+                    if snaplen:
+                        caplen = min(caplen, snaplen)
+                    data = body + 4
+                    # 简单数据包块不含时间戳
+                    yield view[data:data + caplen], 0.0, linktype
+            elif block_type == PCAPNG_PB:
+                interface_id, _, ts_high, ts_low, caplen, _ = struct.unpack_from(order + 'HHIIII', view, body)
+                if interface_id < len(interfaces):
+                    linktype, _, resolution = interfaces[interface_id]
+                    data = body + 20
+                    yield view[data:data + caplen], ((ts_high << 32) | ts_low) * resolution, linktype
+
+            offset += block_length
+
+    @staticmethod
+    def _pcapng_tsresol(view, order, offset, end):
+        """从接口描述块的选项中读取if_tsresol，默认微秒"""
+        while offset + 4 <= end:
+            code, length = struct.unpack_from(order + 'HH', view, offset)
+            if code == 0:
+                break
+            if code == 9 and length >= 1:
+                value = view[offset + 4]
+                if value & 0x80:
+                    return 2.0 ** -(value & 0x7F)
+                return 10.0 ** -value
+            offset += 4 + ((length + 3) & ~3)
+        return 1e-6
+
+
+def _natural_key(name):
+    """自然排序键，使 capture2.pcap 排在 capture10.pcap 之前"""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
+def list_capture_files(path):
+    """列出待回放的抓包文件
+
+    path为目录时，按首个数据包时间排序目录中的抓包文件（含轮转文件如 capture.pcap1），
+    时间相同或无法读取时按文件名自然排序。
+    """
+    if not os.path.isdir(path):
+        return [path]
+
+    candidates = []
+    for name in os.listdir(path):
+        full_path = os.path.join(path, name)
+        stem = name.rstrip('0123456789')
+        if os.path.isfile(full_path) and stem.lower().endswith(CAPTURE_EXTENSIONS):
+            try:
+                with CaptureFileReader(full_path) as reader:
+                    first = reader.first_timestamp()
+            except (OSError, ValueError):
+                continue
+            candidates.append((first if first is not None else float('inf'), _natural_key(name), full_path))
+    candidates.sort()
+    return [full_path for _, _, full_path in candidates]
+
+
+class PcapReplay:
+    """离线回放器
+
+    将抓包文件中的帧解析后送入NetworkMonitor的分析路径（以及可选的IntrusionPrevention），
+    speed为None时尽可能快地回放，为1.0时按记录速度回放，2.0为两倍速，依此类推。
+    """
+
+    STAGES = ('read', 'decode', 'analyze', 'intrusion')
+
+    def __init__(self, monitor, intrusion_prevention=None, speed=None):
+        self.monitor = monitor
+        self.intrusion_prevention = intrusion_prevention
+        self.speed = speed
+        self.stop_requested = False
+
+    def stop(self):
+        """请求中止回放"""
+        self.stop_requested = True
+
+    def run(self, path):
+        """回放文件或目录，返回吞吐与各阶段耗时报告"""
+        self.stop_requested = False
+        stage_seconds = dict.fromkeys(self.STAGES, 0.0)
+        packets = 0
+        total_bytes = 0
+        files = list_capture_files(path)
+        process = self.monitor.process_packet_info
+        ips = self.intrusion_prevention
+        # 交给入侵防御的连接按批评估，与实时抓包的交接方式一致
+        connections = []
+        clock = time.perf_counter
+
+        started = clock()
+        first_timestamp = None
+        frame = None
+        for file_path in files:
+            with CaptureFileReader(file_path) as reader:
+                iterator = reader.packets()
+                while not self.stop_requested:
+                    t0 = clock()
+                    try:
+                        frame, timestamp, linktype = next(iterator)
+                    except StopIteration:
+                        break
+                    t1 = clock()
+                    packet_info = decode_link_frame(frame, linktype, timestamp)
+                    t2 = clock()
+                    stage_seconds['read'] += t1 - t0
+                    stage_seconds['decode'] += t2 - t1
+
+                    if self.speed:
+                        # 按记录的时间间隔回放
+                        if first_timestamp is None:
+                            first_timestamp = timestamp
+                        delay = (timestamp - first_timestamp) / self.speed - (t2 - started)
+                        if delay > 0:
+                            time.sleep(delay)
+                            t2 = clock()
+
+                    record = process(packet_info, 1, frame)
+                    t3 = clock()
+                    stage_seconds['analyze'] += t3 - t2
+                    if ips is not None and 'src' in packet_info and initiates_connection(packet_info, record):
+                        connections.append(packet_info)
+                        if len(connections) >= CONNECTION_BATCH_SIZE:
+                            ips.add_connections(connections)
+                            connections = []
+                            stage_seconds['intrusion'] += clock() - t3
+                    packets += 1
+                    total_bytes += packet_info['length']
+                # 释放对映射内存的引用后才能关闭文件
+                frame = None
+                iterator.close()
+        if connections:
+            t0 = clock()
+            ips.add_connections(connections)
+            stage_seconds['intrusion'] += clock() - t0
+
+        elapsed = clock() - started
+        report = {
+            'files': len(files),
+            'packets': packets,
+            'bytes': total_bytes,
+            'elapsed': elapsed,
+            'packets_per_second': packets / elapsed if elapsed > 0 else 0.0,
+            'stage_seconds': stage_seconds,
+            'stage_us_per_packet': {
+                stage: seconds * 1e6 / packets if packets else 0.0
+                for stage, seconds in stage_seconds.items()
+            }
+        }
+        if ips is not None:
+            # 回放数据产生的告警与被阻止的源
+            report['alerts'] = ips.get_alert_history(0)
+            report['blocked_ips'] = sorted(ips.blocked_ips)
+        return report
@@ -0,0 +1,317 @@
+# 告警触发的抓包环形缓冲模块
+# 将原始帧按大小轮转写入磁盘上的pcap分段，告警发生时保留覆盖告警前后时间窗口的分段
+
+import os
+import re
+import shutil
+import struct
+import threading
+import time
+from collections import deque
+
+from core.config import PlatformConfig
+
+RING_DIRECTORY = 'ring'
+ALERT_DIRECTORY = 'alerts'
+SEGMENT_PREFIX = 'segment_'
+SEGMENT_SUFFIX = '.pcap'
+
+# pcap文件头：微秒时间戳、版本2.4、以太网链路层
+PCAP_MAGIC = 0xA1B2C3D4
+LINKTYPE_ETHERNET = 1
+_file_header = struct.Struct('<IHHiIII')
+_record_header = struct.Struct('<IIII')
+
+
+class RingSegment:
+    """环中的一个pcap分段文件"""
+    __slots__ = ('path', 'first_seen', 'last_seen', 'size', 'frozen')
+
+    def __init__(self, path, size):
+        self.path = path
+        self.first_seen = None
+        self.last_seen = None
+        self.size = size
+        # 已被保留到告警目录
+        self.frozen = False
+
+    def overlaps(self, start, end):
+        return self.first_seen is not None and self.first_seen <= end and self.last_seen >= start
+
+
+class PcapRing:
+    """按大小轮转的原始帧pcap环形缓冲
+
+    submit()只把帧的副本追加到内存队列，不做任何IO，可直接挂在抓包路径上；
+    后台线程每flush_interval秒把队列中的帧编码为pcap记录，攒成一次大块写入当前分段。
+    分段达到segment_bytes时轮转，环内分段总大小超过max_bytes时删除最旧的分段。
+
+    freeze()在告警发生时调用：覆盖 [告警时间 - pre_seconds, 告警时间 + post_seconds] 的分段
+    在窗口结束后移动到告警目录（alerts/<时间>_<IP>/）永久保留，窗口结束前不会被环淘汰；
+    告警目录的总大小超过max_frozen_bytes时删除最旧的告警。
+    """
+
+    def __init__(self, directory=None, segment_bytes=16 * 1024 * 1024, max_bytes=256 * 1024 * 1024,
+                 pre_seconds=30, post_seconds=30, max_frozen_bytes=1024 * 1024 * 1024, snaplen=65535,
+                 flush_interval=0.5, max_pending=100000):
+        self.directory = directory or os.path.join(PlatformConfig.get_cache_dir(), 'pcap')
+        self.ring_directory = os.path.join(self.directory, RING_DIRECTORY)
+        self.alert_directory = os.path.join(self.directory, ALERT_DIRECTORY)
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.max_frozen_bytes = max_frozen_bytes
+        self.snaplen = snaplen
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        # 抓包线程追加、写入线程取出的 (时间戳, 帧)；deque的两端操作是线程安全的
+        self.pending = deque()
+        # 待处理的告警：freeze()追加，写入线程取出
+        self.alert_requests = deque()
+        self.alerts = []
+        self.segments = []
+        self.frames_written = 0
+        self.bytes_written = 0
+        self.dropped_frames = 0
+        self.is_running = False
+        self.writer_thread = None
+        self._wakeup = threading.Event()
+        self._file = None
+        self._sequence = 0
+
+    def start(self):
+        """启动后台写入线程"""
+        if self.is_running:
+            return
+        os.makedirs(self.ring_directory, exist_ok=True)
+        os.makedirs(self.alert_directory, exist_ok=True)
+        # 上次运行遗留的环分段不再被跟踪，直接删除（已保留的告警抓包不受影响）
+        for name in os.listdir(self.ring_directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                self._remove(os.path.join(self.ring_directory, name))
+        self.segments = []
+        self.pending.clear()
+        self.is_running = True
+        self._wakeup.clear()
+        self.writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer_thread.start()
+
+    def stop(self, timeout=5):
+        """停止写入线程：写完队列中剩余的帧，关闭当前分段并处理尚未结束的告警窗口"""
+        if not self.is_running:
+            return
+        self.is_running = False
+        self._wakeup.set()
+        if self.writer_thread:
+            self.writer_thread.join(timeout=timeout)
+
+    def submit(self, frame, timestamp):
+        """记录一帧原始数据（抓包线程调用），只复制帧并入队"""
+        pending = self.pending
+        if len(pending) >= self.max_pending:
+            self.dropped_frames += 1
+            return
+        pending.append((timestamp, bytes(frame)))
+
+    def wrap(self, handler):
+        """包装帧处理函数 handler(frame, timestamp, interface)，先记录原始帧再交给它"""
+        submit = self.submit
+
+        def handle(frame, timestamp, interface=None):
+            submit(frame, timestamp)
+            handler(frame, timestamp, interface)
+        return handle
+
+    def freeze(self, timestamp=None, ip=None, reason=None):
+        """保留告警时间前后窗口内的抓包，返回告警目录路径（窗口结束后才写入完整）"""
+        if timestamp is None:
+            timestamp = time.time()
+        name = time.strftime('%Y%m%d-%H%M%S', time.localtime(timestamp))
+        if ip:
+            name += '_' + re.sub(r'[^0-9A-Za-z.]', '_', str(ip))
+        path = os.path.join(self.alert_directory, name)
+        self.alert_requests.append({
+            'timestamp': timestamp,
+            'ip': ip,
+            'reason': reason,
+            'start': timestamp - self.pre_seconds,
+            'end': timestamp + self.post_seconds,
+            'path': path,
+            'files': []
+        })
+        self._wakeup.set()
+        return path
+
+    def _writer_loop(self):
+        try:
+            while self.is_running:
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                self._write_pending()
+                self._process_alerts(time.time())
+            self._write_pending()
+            self._close_segment()
+            self._process_alerts(None)
+        except OSError as e:
+            print(f"抓包环写入失败: {e}")
+            self.is_running = False
+            self._close_segment()
+
+    def _write_pending(self):
+        """把队列中的帧编码为pcap记录，按分段攒成大块写入"""
+        pending = self.pending
+        snaplen = self.snaplen
+        pack = _record_header.pack
+        buffer = bytearray()
+        segment = self.segments[-1] if self._file is not None else None
+        while pending:
+            timestamp, frame = pending.popleft()
+            length = len(frame)
+            captured = min(length, snaplen)
+            record_size = _record_header.size + captured
+            if segment is None or segment.size + len(buffer) + record_size > self.segment_bytes:
+                if buffer:
+                    self._file.write(buffer)
+                    segment.size += len(buffer)
+                    buffer = bytearray()
+                segment = self._open_segment()
+            if segment.first_seen is None:
+                segment.first_seen = timestamp
+            segment.last_seen = timestamp
+            seconds = int(timestamp)
+            buffer += pack(seconds, int((timestamp - seconds) * 1000000), captured, length)
+            buffer += frame[:captured] if captured < length else frame
+            self.frames_written += 1
+            self.bytes_written += record_size
+        if buffer:
+            self._file.write(buffer)
+            self._file.flush()
+            segment.size += len(buffer)
+
+    def _open_segment(self):
+        """关闭当前分段，开始新分段，并按max_bytes淘汰最旧的分段"""
+        self._close_segment()
+        self._sequence += 1
+        name = f"{SEGMENT_PREFIX}{int(time.time())}_{self._sequence:06d}{SEGMENT_SUFFIX}"
+        path = os.path.join(self.ring_directory, name)
+        self._file = open(path, 'wb')
+        self._file.write(_file_header.pack(PCAP_MAGIC, 2, 4, 0, 0, self.snaplen, LINKTYPE_ETHERNET))
+        segment = RingSegment(path, _file_header.size)
+        self.segments.append(segment)
+        self._enforce_ring_size()
+        return segment
+
+    def _close_segment(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _enforce_ring_size(self):
+        """环内分段总大小超过max_bytes时删除最旧的分段，告警窗口内的分段除外"""
+        total = sum(segment.size for segment in self.segments if not segment.frozen)
+        index = 0
+        while total > self.max_bytes and index < len(self.segments) - 1:
+            segment = self.segments[index]
+            if segment.frozen or any(segment.overlaps(alert['start'], alert['end']) for alert in self.alerts):
+                index += 1
+                continue
+            del self.segments[index]
+            total -= segment.size
+            self._remove(segment.path)
+
+    def _process_alerts(self, now):
+        """接收新的告警；窗口已结束（或正在停止，now为None）的告警保留其覆盖的分段"""
+        while self.alert_requests:
+            self.alerts.append(self.alert_requests.popleft())
+        if not self.alerts:
+            return
+        finished = [alert for alert in self.alerts if now is None or alert['end'] < now]
+        if not finished:
+            return
+        current = self.segments[-1] if self._file is not None else None
+        if current is not None and any(current.overlaps(alert['start'], alert['end']) for alert in finished):
+            # 当前分段包含窗口内的帧，提前轮转以便保留
+            self._close_segment()
+        for alert in finished:
+            self.alerts.remove(alert)
+            self._freeze_alert(alert)
+        # 已保留的分段在不再与未结束的告警窗口重叠后移出环
+        self.segments = [
+            segment for segment in self.segments
+            if not segment.frozen or any(segment.overlaps(alert['start'], alert['end']) for alert in self.alerts)
+        ]
+        self._enforce_frozen_size()
+
+    def _freeze_alert(self, alert):
+        """把告警窗口覆盖的已关闭分段移入（或链接到）告警目录"""
+        os.makedirs(alert['path'], exist_ok=True)
+        open_segment = self.segments[-1] if self._file is not None else None
+        for segment in self.segments:
+            if segment is open_segment or not segment.overlaps(alert['start'], alert['end']):
+                continue
+            target = os.path.join(alert['path'], os.path.basename(segment.path))
+            if not segment.frozen:
+                os.replace(segment.path, target)
+                segment.path = target
+                segment.frozen = True
+            else:
+                # 同一分段覆盖了多个告警
+                try:
+                    os.link(segment.path, target)
+                except OSError:
+                    try:
+                        shutil.copyfile(segment.path, target)
+                    except OSError:
+                        # 先前的告警已被max_frozen_bytes删除
+                        continue
+            alert['files'].append(target)
+
+    def _enforce_frozen_size(self):
+        """告警目录总大小超过max_frozen_bytes时删除最旧的告警"""
+        captures = self.get_frozen_captures()
+        total = sum(capture['bytes'] for capture in captures)
+        for capture in captures:
+            if total <= self.max_frozen_bytes:
+                break
+            shutil.rmtree(capture['path'], ignore_errors=True)
+            total -= capture['bytes']
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def get_frozen_captures(self):
+        """列出保留的告警抓包 [{'name', 'path', 'files', 'bytes'}]，按时间从旧到新"""
+        captures = []
+        if not os.path.isdir(self.alert_directory):
+            return captures
+        for name in sorted(os.listdir(self.alert_directory)):
+            path = os.path.join(self.alert_directory, name)
+            if not os.path.isdir(path):
+                continue
+            files = sorted(
+                os.path.join(path, file_name) for file_name in os.listdir(path) if file_name.endswith(SEGMENT_SUFFIX)
+            )
+            captures.append({
+                'name': name,
+                'path': path,
+                'files': files,
+                'bytes': sum(os.path.getsize(file_path) for file_path in files)
+            })
+        return captures
+
+    def get_statistics(self):
+        """写入计数、环内分段数与大小、待写入的帧数与未结束的告警数"""
+        return {
+            'frames_written': self.frames_written,
+            'bytes_written': self.bytes_written,
+            'dropped_frames': self.dropped_frames,
+            'pending_frames': len(self.pending),
+            'segments': len(self.segments),
+            'ring_bytes': sum(segment.size for segment in self.segments),
+            'pending_alerts': len(self.alerts) + len(self.alert_requests)
+        }
@@ -0,0 +1,354 @@
+# 数据包分析流水线
+# 抓包线程按批次将原始帧投递到有界队列，由按流哈希分片的多个分析工作单元完成解析与流统计
+
+import multiprocessing
+import queue
+import threading
+import time
+
+from .fast_capture import decode_frame, ETH_P_IP, IPPROTO_UDP
+from .dns_table import DnsTable, DNS_PORT
+from .flow_table import FlowRecord
+from .metrics import STAGE_DISSECT
+from .sketches import TrafficSketches
+from .endpoint_table import EndpointTable
+from .traffic_state import TrafficState, TrafficTimeSeries, merge_summaries, initiates_connection
+
+# 工作单元输出队列中的消息类型
+MESSAGE_SUMMARY = 'summary'
+MESSAGE_FLOWS = 'flows'
+MESSAGE_CONNECTIONS = 'connections'
+
+
+def flow_shard(frame, num_shards):
+    """根据源/目的IP计算对称的分片编号，同一流的两个方向落在同一分片"""
+    if num_shards <= 1 or len(frame) < 34 or frame[12] != ETH_P_IP >> 8 or frame[13] != ETH_P_IP & 0xFF:
+        return 0
+    src = int.from_bytes(frame[26:30], 'big')
+    dst = int.from_bytes(frame[30:34], 'big')
+    return (src ^ dst) % num_shards
+
+
+def is_dns_response(frame):
+    """是否为未带VLAN标签、源端口为53的IPv4 UDP帧"""
+    if len(frame) < 42 or frame[12] != ETH_P_IP >> 8 or frame[13] != ETH_P_IP & 0xFF or frame[23] != IPPROTO_UDP:
+        return False
+    offset = 14 + (frame[14] & 0x0F) * 4
+    return len(frame) >= offset + 2 and frame[offset] == DNS_PORT >> 8 and frame[offset + 1] == DNS_PORT & 0xFF
+
+
+def _shard_worker(shard_id, in_queue, out_queue, state_options, publish_interval, forward_flows=False,
+                  connection_sink=None, forward_connections=False, limits=(50, 100)):
+    """分片工作循环：解析批次中的帧、更新本分片状态并定期发布摘要
+
+    limits为共享的 [Top-K条数, 最近数据包条数]，每次发布摘要时读取，由主进程按读取方的需要调大。
+
+    forward_flows为True时（进程模式），被淘汰的流以元组形式随输出队列送回主进程交给sink。
+    每个输入批次中发起连接的数据包信息（即分析时生成的字典本身，见initiates_connection）组成一批连接事件：
+    线程模式下直接交给connection_sink，进程模式下（forward_connections）随输出队列送回主进程。
+    """
+    evicted = []
+    state_options = dict(state_options, export_timeseries=True, export_sketches=True, export_endpoints=True,
+                         export_dns=True)
+    if forward_flows:
+        state_options = dict(state_options, flow_sink=lambda record: evicted.append(record.to_row()))
+    state = TrafficState(**state_options)
+    latency = state.latency
+    clock = latency.clock
+    last_publish = 0.0
+    while True:
+        try:
+            batch = in_queue.get(timeout=publish_interval)
+        except queue.Empty:
+            batch = ()
+        if batch is None:
+            break
+
+        connections = [] if connection_sink is not None or forward_connections else None
+        for frame, timestamp, interface, weight in batch:
+            if not weight:
+                # 其他分片的DNS响应副本，只用于本分片的反查缓存
+                state.observe_dns(decode_frame(frame, timestamp), frame, 0)
+                continue
+            if latency.sample():
+                started = clock()
+                packet_info = decode_frame(frame, timestamp)
+                latency.record(STAGE_DISSECT, clock() - started)
+            else:
+                packet_info = decode_frame(frame, timestamp)
+            if interface is not None:
+                packet_info['interface'] = interface
+            record = state.update(packet_info, weight, frame)
+            if connections is not None and 'src' in packet_info and initiates_connection(packet_info, record):
+                connections.append(packet_info)
+
+        if connections:
+            if connection_sink is not None:
+                connection_sink(connections)
+            else:
+                out_queue.put((MESSAGE_CONNECTIONS, shard_id, connections))
+
+        now = time.time()
+        if now - last_publish >= publish_interval:
+            out_queue.put((MESSAGE_SUMMARY, shard_id, state.summary(limits[0], limits[1])))
+            last_publish = now
+        if evicted:
+            out_queue.put((MESSAGE_FLOWS, shard_id, evicted))
+            evicted = []
+
+    # 先导出最终摘要，再把仍在流表中的流交给sink归档
+    out_queue.put((MESSAGE_SUMMARY, shard_id, state.summary(limits[0], limits[1])))
+    state.flow_table.flush(keep=True)
+    if evicted:
+        out_queue.put((MESSAGE_FLOWS, shard_id, evicted))
+
+
+class AnalysisPipeline:
+    """分批、分片的数据包分析流水线
+
+    use_processes为True时工作单元以独立进程运行，绕开GIL；
+    各分片定期发布统计摘要，由get_summary()合并。
+    """
+
+    def __init__(self, num_workers=2, use_processes=False, batch_size=64, queue_size=256,
+                 flush_interval=0.1, publish_interval=1.0, state_options=None):
+        self.num_workers = max(1, num_workers)
+        self.use_processes = use_processes
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.flush_interval = flush_interval
+        self.publish_interval = publish_interval
+        self.state_options = dict(state_options or {})
+        # 进程模式下sink无法跨进程调用，由主进程的收集线程代为调用
+        self.flow_sink = None
+        if use_processes:
+            self.flow_sink = self.state_options.pop('flow_sink', None)
+        self.queues = []
+        self.workers = []
+        self.out_queue = None
+        self.summaries = {}
+        # 由各分片导出的每秒数据合并而成的时间序列
+        self.timeseries = TrafficTimeSeries() if TrafficTimeSeries is not None else None
+        # 由各分片导出的窗口增量合并而成的频率与扩散草图
+        self.sketches = None
+        if self.state_options.get('sketch_window', 60):
+            self.sketches = TrafficSketches(self.state_options.get('sketch_window', 60),
+                                            self.state_options.get('sketch_windows', 5))
+        # 由各分片导出的主机增量合并而成的端点表
+        self.endpoints = EndpointTable(self.state_options.get('max_hosts', 100000),
+                                       self.state_options.get('topk_capacity', 1000))
+        # 由各分片导出的域名增量合并而成的DNS统计
+        self.dns = DnsTable(self.state_options.get('max_domains', 10000))
+        # 可选的SnapshotPublisher，由收集线程在合并摘要后按节奏发布快照
+        self.snapshots = None
+        # 可选的连接事件接收函数 sink(数据包信息列表)，如IntrusionPrevention.submit_connections；
+        # 线程模式下由工作线程直接调用，进程模式下由收集线程调用
+        self.connection_sink = None
+        self.submitted_packets = 0
+        self.dropped_packets = 0
+        self.is_running = False
+        # 分片发布摘要时导出的 [Top-K条数, 最近数据包条数]，get_summary()按请求调大
+        self.summary_limits = [50, 100]
+        self._limits = self.summary_limits
+        self._pending = []
+        # 未满批次的投递时间（单调时钟），抓包线程与空闲定时器都可能投递，由_lock保护
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+        self._collector = None
+
+    def start(self):
+        """启动分析工作单元与摘要收集线程"""
+        if self.use_processes:
+            make_queue = multiprocessing.Queue
+            make_worker = multiprocessing.Process
+        else:
+            make_queue = queue.Queue
+            make_worker = threading.Thread
+
+        self.queues = [make_queue(self.queue_size) for _ in range(self.num_workers)]
+        self.out_queue = make_queue()
+        self.summaries = {}
+        if self.timeseries is not None:
+            self.timeseries.clear()
+        if self.sketches is not None:
+            self.sketches.clear()
+        self.endpoints.clear()
+        self.dns.clear()
+        self.submitted_packets = 0
+        self.dropped_packets = 0
+        self._pending = [[] for _ in range(self.num_workers)]
+        self._last_flush = time.monotonic()
+        if self.use_processes:
+            self._limits = multiprocessing.Array('i', self.summary_limits, lock=False)
+        else:
+            self._limits = self.summary_limits
+        self.is_running = True
+
+        self.workers = []
+        for shard_id, in_queue in enumerate(self.queues):
+            worker = make_worker(
+                target=_shard_worker,
+                args=(shard_id, in_queue, self.out_queue, self.state_options, self.publish_interval,
+                      self.flow_sink is not None,
+                      None if self.use_processes else self.connection_sink,
+                      self.use_processes and self.connection_sink is not None,
+                      self._limits),
+                daemon=True
+            )
+            worker.start()
+            self.workers.append(worker)
+
+        self._collector = threading.Thread(target=self._collect_summaries, daemon=True)
+        self._collector.start()
+
+    def submit(self, frame, timestamp, interface=None, weight=1):
+        """投递一帧原始数据（由抓包线程或多接口的合并线程调用）
+
+        weight为抽样时这一帧代表的包数。未满批次的投递节奏按单调时钟计算，与帧的时间戳无关。
+        """
+        shard = flow_shard(frame, self.num_workers)
+        frame = bytes(frame)
+        with self._lock:
+            pending = self._pending[shard]
+            pending.append((frame, timestamp, interface, weight))
+            self.submitted_packets += 1
+            if self.num_workers > 1 and is_dns_response(frame):
+                # 后续的连接可能落在任何分片，DNS响应同时发给其他分片以便标注主机名（weight为0，不计数）
+                for other, other_pending in enumerate(self._pending):
+                    if other != shard:
+                        other_pending.append((frame, timestamp, interface, 0))
+
+            if len(pending) >= self.batch_size:
+                self._put(shard, pending)
+                self._pending[shard] = []
+            now = time.monotonic()
+            if now - self._last_flush >= self.flush_interval:
+                self._flush(now)
+
+    def maybe_flush(self):
+        """距上次投递已满flush_interval时投递未满的批次（抓包空闲时由抓包线程或空闲定时器调用）"""
+        now = time.monotonic()
+        if now - self._last_flush >= self.flush_interval:
+            with self._lock:
+                self._flush(now)
+
+    def flush(self):
+        """将所有未满的批次投递出去"""
+        with self._lock:
+            self._flush(time.monotonic())
+
+    def _flush(self, now):
+        self._last_flush = now
+        for shard, pending in enumerate(self._pending):
+            if pending:
+                self._put(shard, pending)
+                self._pending[shard] = []
+
+    def _put(self, shard, batch):
+        try:
+            self.queues[shard].put_nowait(batch)
+        except queue.Full:
+            # 队列已满时丢弃整批，避免阻塞抓包线程；其他分片的DNS响应副本不是丢失的包
+            self.dropped_packets += sum(1 for item in batch if item[3])
+
+    def stop(self, timeout=5):
+        """停止流水线，等待各分片发布最终摘要"""
+        if not self.is_running:
+            return
+        self.flush()
+        for in_queue in self.queues:
+            try:
+                in_queue.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+        self.is_running = False
+        if self._collector:
+            self._collector.join(timeout=timeout)
+
+        # 先取走各分片的最终摘要，再等待其退出（进程在队列数据被取走前不会结束）
+        deadline = time.time() + timeout
+        while any(worker.is_alive() for worker in self.workers) and time.time() < deadline:
+            self._drain(0.1)
+        self._drain(0)
+        for worker in self.workers:
+            worker.join(timeout=max(0, deadline - time.time()))
+        self.workers = []
+
+    def queue_fill(self):
+        """各分片输入队列中最满的一个的填充率（0~1），队列不支持qsize时为0"""
+        fill = 0.0
+        for in_queue in self.queues:
+            try:
+                fill = max(fill, in_queue.qsize() / self.queue_size)
+            except NotImplementedError:
+                break
+        return fill
+
+    def queue_depths(self):
+        """队列深度：各分片输入队列中待处理的批次数、尚未成批的包数与输出队列中的消息数"""
+        def size(q):
+            try:
+                return q.qsize()
+            except NotImplementedError:
+                # 部分平台的multiprocessing队列不支持qsize
+                return None
+        return {
+            'shard_batches': [size(q) for q in self.queues],
+            'pending_packets': sum(len(pending) for pending in self._pending),
+            'result_messages': size(self.out_queue) if self.out_queue is not None else 0
+        }
+
+    def _collect_summaries(self):
+        """收集各分片发布的摘要，只保留每个分片最新的一份"""
+        while self.is_running:
+            self._drain(self.publish_interval)
+            if self.snapshots is not None:
+                self.snapshots.maybe_publish()
+
+    def _drain(self, wait):
+        """取出输出队列中已有的消息，wait为等待首条消息的秒数"""
+        try:
+            while True:
+                if wait:
+                    kind, shard_id, payload = self.out_queue.get(timeout=wait)
+                    wait = 0
+                else:
+                    kind, shard_id, payload = self.out_queue.get_nowait()
+                if kind == MESSAGE_SUMMARY:
+                    rows = payload.pop('timeseries_rows', None)
+                    if rows and self.timeseries is not None:
+                        self.timeseries.merge_rows(rows)
+                    exports = payload.pop('sketch_exports', None)
+                    if exports and self.sketches is not None:
+                        self.sketches.merge_export(exports)
+                    exports = payload.pop('endpoint_exports', None)
+                    if exports:
+                        self.endpoints.merge_export(exports)
+                    exports = payload.pop('dns_exports', None)
+                    if exports:
+                        self.dns.merge_export(exports)
+                    self.summaries[shard_id] = payload
+                elif kind == MESSAGE_FLOWS:
+                    for row in payload:
+                        self.flow_sink(FlowRecord.from_row(row))
+                elif kind == MESSAGE_CONNECTIONS:
+                    if self.connection_sink is not None:
+                        self.connection_sink(payload)
+        except queue.Empty:
+            pass
+
+    def request_limits(self, top_limit, recent_limit):
+        """让各分片此后发布的摘要至少包含top_limit条Top-K与recent_limit个最近的数据包"""
+        limits = self._limits
+        if top_limit > limits[0]:
+            limits[0] = top_limit
+        if recent_limit > limits[1]:
+            limits[1] = recent_limit
+
+    def get_summary(self, top_limit=50, recent_limit=100):
+        """合并各分片最新的摘要
+
+        超过分片当前发布条数的请求会调大发布条数，在各分片下一次发布（publish_interval内）后生效。
+        """
+        self.request_limits(top_limit, recent_limit)
+        return merge_summaries(list(self.summaries.values()), top_limit, recent_limit)
@@ -0,0 +1,137 @@
+# 自适应抽样模块
+# 处理速度跟不上流量时按1/N抽样分析，N根据队列深度与CPU占用自动升降，计数按N加权为无偏估计
+
+import time
+
+from .fast_capture import ETH_P_IP, IPPROTO_TCP, IPPROTO_UDP
+from .sketches import mix_hash
+
+# 抽样方式
+SAMPLE_COUNT = 'count'  # 确定性的每N个包取一个
+SAMPLE_FLOW = 'flow'    # 按流哈希取1/N的流，被选中的流保留全部数据包
+
+
+def frame_flow_hash(frame):
+    """未带VLAN标签的IPv4帧的对称流哈希，同一流的两个方向结果相同；其他帧返回None"""
+    if len(frame) < 34 or frame[12] != ETH_P_IP >> 8 or frame[13] != ETH_P_IP & 0xFF:
+        return None
+    key = int.from_bytes(frame[26:30], 'big') ^ int.from_bytes(frame[30:34], 'big')
+    protocol = frame[23]
+    if protocol == IPPROTO_TCP or protocol == IPPROTO_UDP:
+        offset = 14 + (frame[14] & 0x0F) * 4
+        if len(frame) >= offset + 4:
+            ports = int.from_bytes(frame[offset:offset + 2], 'big') ^ int.from_bytes(frame[offset + 2:offset + 4], 'big')
+            key = (key << 16) | ports
+    return mix_hash((key << 8) | protocol)
+
+
+class AdaptiveSampler:
+    """自适应抽样器
+
+    抓包线程对每一帧调用admit()，返回0表示跳过，否则返回该帧代表的包数（当前的N），
+    后续各项计数按此加权，因此包数、字节数、时间序列与Top-K都是无偏估计。
+    N始终为2的幂：流哈希模式下N翻倍时保留的流是原来的子集，不会换成另一批流。
+
+    每隔adjust_interval秒评估一次负载：调用线程的CPU占用超过cpu_budget、队列填充率超过
+    queue_high或出现新的丢包时N翻倍；CPU占用低于预算的40%且队列接近空时N减半。
+    队列填充率与丢包数由load回调提供，返回 (填充率0~1, 累计丢包数)。
+    """
+
+    def __init__(self, mode=SAMPLE_COUNT, max_rate=1024, adjust_interval=1.0, cpu_budget=0.8,
+                 queue_high=0.5, load=None):
+        if mode not in (SAMPLE_COUNT, SAMPLE_FLOW):
+            raise ValueError(f"未知的抽样方式: {mode}")
+        self.mode = mode
+        # 取不超过max_rate的2的幂
+        self.max_rate = 1 << (max(1, max_rate).bit_length() - 1)
+        self.adjust_interval = adjust_interval
+        self.cpu_budget = cpu_budget
+        self.queue_high = queue_high
+        self.load = load
+        self.reset()
+
+    def reset(self):
+        self.rate = 1
+        self._mask = 0
+        self._counter = 0
+        # 本次运行中是否有包以N > 1抽样，此时计数为估计值
+        self.sampled = False
+        self.offered_packets = 0
+        self.kept_packets = 0
+        self.adjustments = 0
+        self._next_adjust = 0.0
+        self._last_wall = None
+        self._last_cpu = 0.0
+        self._last_dropped = 0
+
+    def admit(self, frame, timestamp):
+        """决定是否分析这一帧，返回加权系数（0表示跳过）"""
+        if timestamp >= self._next_adjust:
+            self._next_adjust = timestamp + self.adjust_interval
+            self.adjust()
+        self.offered_packets += 1
+        rate = self.rate
+        if rate == 1:
+            self.kept_packets += 1
+            return 1
+        if self.mode == SAMPLE_FLOW:
+            flow_hash = frame_flow_hash(frame)
+            if flow_hash is not None:
+                if flow_hash & self._mask:
+                    return 0
+                self.kept_packets += 1
+                return rate
+        # 计数模式，以及流哈希模式下无法取流键的帧
+        self._counter += 1
+        if self._counter < rate:
+            return 0
+        self._counter = 0
+        self.kept_packets += 1
+        return rate
+
+    def wrap(self, handler):
+        """包装帧处理函数 handler(frame, timestamp, interface, weight)，只把抽中的帧交给它"""
+        admit = self.admit
+
+        def handle(frame, timestamp, interface=None):
+            weight = admit(frame, timestamp)
+            if weight:
+                handler(frame, timestamp, interface, weight)
+        return handle
+
+    def adjust(self):
+        """根据调用线程的CPU占用、队列填充率与丢包升降N"""
+        wall = time.monotonic()
+        cpu = time.thread_time()
+        fill, dropped = self.load() if self.load is not None else (0.0, 0)
+        new_drops = dropped > self._last_dropped
+        self._last_dropped = dropped
+        if self._last_wall is None or wall <= self._last_wall:
+            self._last_wall, self._last_cpu = wall, cpu
+            return
+        busy = (cpu - self._last_cpu) / (wall - self._last_wall)
+        self._last_wall, self._last_cpu = wall, cpu
+
+        if new_drops or busy > self.cpu_budget or fill > self.queue_high:
+            self._set_rate(min(self.rate * 2, self.max_rate))
+        elif busy < self.cpu_budget * 0.4 and fill < self.queue_high / 4:
+            self._set_rate(max(self.rate // 2, 1))
+
+    def _set_rate(self, rate):
+        if rate != self.rate:
+            self.rate = rate
+            self._mask = rate - 1
+            self._counter = 0
+            self.adjustments += 1
+            if rate > 1:
+                self.sampled = True
+
+    def get_statistics(self):
+        return {
+            'mode': self.mode,
+            'rate': self.rate,
+            'sampled': self.sampled,
+            'offered_packets': self.offered_packets,
+            'kept_packets': self.kept_packets,
+            'adjustments': self.adjustments
+        }
@@ -0,0 +1,441 @@
+# 基数与频率估计模块
+# 提供HyperLogLog、虚拟HyperLogLog与Count-Min草图，按时间窗口统计主机与端口的流量及扩散程度
+
+import math
+
+from .packet_utils import ip_to_int
+
+_MASK64 = (1 << 64) - 1
+# MurmurHash3的64位终结函数常数
+_FMIX1 = 0xFF51AFD7ED558CCD
+_FMIX2 = 0xC4CEB9FE1A85EC53
+
+# 键类型：频率统计按源、目的与目的端口；扩散统计另有"源访问的主机"
+KEY_SOURCE = 0
+KEY_DESTINATION = 1
+KEY_PORT = 2
+KEY_SOURCE_HOSTS = 3
+
+
+def mix_hash(value):
+    """64位哈希
+
+    内置hash对整数及整数元组的结果与进程无关，可用于跨进程合并，但对连续整数分布很规则，
+    这里再用MurmurHash3的终结函数打散。字符串的内置hash每个进程不同，应先转换为整数。
+    """
+    x = hash(value) & _MASK64
+    x = ((x ^ (x >> 33)) * _FMIX1) & _MASK64
+    x = ((x ^ (x >> 33)) * _FMIX2) & _MASK64
+    return x ^ (x >> 33)
+
+
+def _alpha(m):
+    if m == 16:
+        return 0.673
+    if m == 32:
+        return 0.697
+    if m == 64:
+        return 0.709
+    return 0.7213 / (1 + 1.079 / m)
+
+
+def _estimate(registers, m):
+    """HyperLogLog基数估计，小基数时使用线性计数"""
+    # 寄存器取值种类很少，按值计数比逐个累加快得多
+    total = 0.0
+    zeros = 0
+    for rank in set(registers):
+        count = registers.count(rank)
+        total += count * 2.0 ** -rank
+        if rank == 0:
+            zeros = count
+    estimate = _alpha(m) * m * m / total
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)
+    return estimate
+
+
+class HyperLogLog:
+    """HyperLogLog基数估计器，2**precision个寄存器，相对误差约 1.04/sqrt(2**precision)"""
+
+    def __init__(self, precision=12, track_changes=False):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+        # 记录自上次导出以来变化的寄存器，用于流水线分片的增量合并
+        self.changes = {} if track_changes else None
+
+    def clear(self):
+        self.registers = bytearray(self.m)
+        if self.changes is not None:
+            self.changes = {}
+
+    def add(self, value):
+        """加入一个值（整数或整数元组）"""
+        self.add_hash(mix_hash(value))
+
+    def add_hash(self, x):
+        """加入一个已由mix_hash打散的64位哈希"""
+        bits = 64 - self.precision
+        index = x >> bits
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            if self.changes is not None:
+                self.changes[index] = rank
+
+    def count(self):
+        return _estimate(self.registers, self.m)
+
+    def drain_changes(self):
+        changes, self.changes = self.changes, {}
+        return changes
+
+    def merge_changes(self, changes):
+        registers = self.registers
+        for index, rank in changes.items():
+            if rank > registers[index]:
+                registers[index] = rank
+
+
+class VirtualHyperLogLog:
+    """虚拟HyperLogLog（vHLL），所有键共享一个寄存器数组
+
+    每个键从共享数组中伪随机地选取virtual个寄存器组成自己的HLL，
+    估计时减去其他键带来的噪声。内存只取决于寄存器数量而与键数无关，
+    适合统计数十万主机各自访问的端口数或主机数。
+    """
+
+    def __init__(self, registers=1 << 18, virtual_bits=7, track_changes=False):
+        self.m = registers
+        self.virtual_bits = virtual_bits
+        self.s = 1 << virtual_bits
+        self.registers = bytearray(registers)
+        self.changes = {} if track_changes else None
+        self._total = None
+
+    def clear(self):
+        self.registers = bytearray(self.m)
+        if self.changes is not None:
+            self.changes = {}
+        self._total = None
+
+    def _position(self, key_hash, j):
+        # 双重哈希：键哈希的低32位为起点，高32位为步长（寄存器数为2的幂时步长为奇数即可遍历）
+        return ((key_hash & 0xFFFFFFFF) + j * ((key_hash >> 32) | 1)) % self.m
+
+    def add(self, key_hash, element_hash):
+        """在键下加入一个值，两者都是mix_hash得到的哈希（键哈希可与Count-Min共用）"""
+        # 两个输入都已充分打散，组合时只需一轮乘法与移位
+        x = ((key_hash ^ (element_hash >> 1)) * _FMIX1) & _MASK64
+        x ^= x >> 33
+        bits = 64 - self.virtual_bits
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+        position = self._position(key_hash, x >> bits)
+        if rank > self.registers[position]:
+            self.registers[position] = rank
+            self._total = None
+            if self.changes is not None:
+                self.changes[position] = rank
+
+    def total(self):
+        """所有键的不同值总数估计（缓存至下次更新）"""
+        if self._total is None:
+            self._total = _estimate(self.registers, self.m)
+        return self._total
+
+    def estimate(self, key_hash):
+        """估计某个键下不同值的数量"""
+        registers = self.registers
+        s, m = self.s, self.m
+        virtual = bytes(registers[self._position(key_hash, j)] for j in range(s))
+        if not any(virtual):
+            return 0.0
+        value = s * m / (m - s) * (_estimate(virtual, s) / s - self.total() / m)
+        return max(0.0, value)
+
+    def drain_changes(self):
+        changes, self.changes = self.changes, {}
+        return changes
+
+    def merge_changes(self, changes):
+        registers = self.registers
+        for position, rank in changes.items():
+            if rank > registers[position]:
+                registers[position] = rank
+        if changes:
+            self._total = None
+
+
+class CountMinSketch:
+    """Count-Min草图，每个单元同时累计次数与权重（如包数与字节数）
+
+    估计值不低于真实值，超出部分以高概率不超过总量的 e/width。
+    深度最多4行，每行的列号取自同一个64位哈希的不同16位。
+    单元使用列表而非array，避免每次累加时的装箱转换。
+    """
+
+    def __init__(self, width=2048, depth=4):
+        if width & (width - 1) or width > 1 << 16:
+            raise ValueError("width必须是不超过65536的2的幂")
+        self.width = width
+        self.depth = min(depth, 4)
+        self._rows = tuple((row * width, 16 * row) for row in range(self.depth))
+        self.clear()
+
+    def clear(self):
+        size = self.width * self.depth
+        self.counts = [0] * size
+        self.weights = [0] * size
+
+    def add(self, key_hash, count=1, weight=0):
+        counts = self.counts
+        weights = self.weights
+        mask = self.width - 1
+        for base, shift in self._rows:
+            cell = base + ((key_hash >> shift) & mask)
+            counts[cell] += count
+            weights[cell] += weight
+
+    def estimate(self, key_hash):
+        """返回 (次数, 权重) 估计"""
+        mask = self.width - 1
+        cells = [base + ((key_hash >> shift) & mask) for base, shift in self._rows]
+        return min(self.counts[cell] for cell in cells), min(self.weights[cell] for cell in cells)
+
+    def merge(self, counts, weights):
+        """累加另一个同尺寸草图的单元列表"""
+        own_counts = self.counts
+        own_weights = self.weights
+        for cell, value in enumerate(counts):
+            if value:
+                own_counts[cell] += value
+                own_weights[cell] += weights[cell]
+
+
+class _SketchWindow:
+    """单个时间窗口内的全部草图"""
+
+    def __init__(self, start, options, track_changes):
+        self.start = start
+        self.packets = 0
+        self.bytes = 0
+        self.volume = CountMinSketch(options['cms_width'], options['cms_depth'])
+        self.spread = VirtualHyperLogLog(options['spread_registers'], options['spread_virtual_bits'],
+                                         track_changes)
+        self.sources = HyperLogLog(options['hll_precision'], track_changes)
+        self.destinations = HyperLogLog(options['hll_precision'], track_changes)
+
+    def add(self, src, dst, dport, packets, total_bytes):
+        """登记一组 (源, 目的, 目的端口) 在本窗口内的包数与字节数"""
+        self.packets += packets
+        self.bytes += total_bytes
+        volume = self.volume
+        spread = self.spread
+
+        source = mix_hash((KEY_SOURCE, src))
+        destination = mix_hash((KEY_DESTINATION, dst))
+        volume.add(source, packets, total_bytes)
+        volume.add(destination, packets, total_bytes)
+        spread.add(mix_hash((KEY_SOURCE_HOSTS, src)), destination)
+        spread.add(destination, source)
+        self.sources.add_hash(source)
+        self.destinations.add_hash(destination)
+        if dport is not None:
+            port = mix_hash((KEY_PORT, dport))
+            volume.add(port, packets, total_bytes)
+            spread.add(source, port)
+            spread.add(port, source)
+
+    def export(self):
+        """导出并清空本窗口的增量（Count-Min单元与变化的寄存器）"""
+        data = {
+            'start': self.start,
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'counts': self.volume.counts,
+            'weights': self.volume.weights,
+            'spread': self.spread.drain_changes(),
+            'sources': self.sources.drain_changes(),
+            'destinations': self.destinations.drain_changes()
+        }
+        self.packets = 0
+        self.bytes = 0
+        self.volume.clear()
+        return data
+
+    def merge(self, data):
+        self.packets += data['packets']
+        self.bytes += data['bytes']
+        self.volume.merge(data['counts'], data['weights'])
+        self.spread.merge_changes(data['spread'])
+        self.sources.merge_changes(data['sources'])
+        self.destinations.merge_changes(data['destinations'])
+
+
+class TrafficSketches:
+    """按时间窗口维护的主机/端口频率与扩散草图
+
+    每个窗口包含：按源、目的与目的端口的包数/字节数（Count-Min），
+    每个源访问的不同端口与不同主机、每个目的与端口的不同来源（vHLL），
+    以及窗口内不同源与不同目的的总数（HLL）。保留最近windows个窗口，
+    内存固定，与主机数量无关。
+
+    数据包路径只在字典中按 (源, 目的, 目的端口) 累计当前这一秒，
+    秒切换（或导出）时每个不同的组合只更新一次草图。
+    """
+
+    def __init__(self, window=60, windows=5, cms_width=2048, cms_depth=4, spread_registers=1 << 18,
+                 spread_virtual_bits=7, hll_precision=12, max_pending=50000, export_changes=False):
+        self.window = window
+        self.max_windows = windows
+        self.max_pending = max_pending
+        self.options = {
+            'cms_width': cms_width,
+            'cms_depth': cms_depth,
+            'spread_registers': spread_registers,
+            'spread_virtual_bits': spread_virtual_bits,
+            'hll_precision': hll_precision
+        }
+        # export_changes为True时（流水线分片）窗口数据以增量形式随摘要导出
+        self.export_changes = export_changes
+        # 窗口起始时间 -> 窗口
+        self.windows = {}
+        self._dirty = set()
+        self.pending_second = None
+        self.pending = {}
+
+    def clear(self):
+        self.windows = {}
+        self._dirty = set()
+        self.pending_second = None
+        self.pending = {}
+
+    def add_packet(self, timestamp, length, src, dst, dport=None, weight=1):
+        """累计一个数据包，src/dst为整数形式的IPv4地址，weight为抽样时这个包代表的包数
+
+        包数与字节数按weight加权；不同主机与端口的数量只反映实际看到的包。
+        """
+        second = int(timestamp)
+        if second != self.pending_second or len(self.pending) >= self.max_pending:
+            self.commit()
+            self.pending_second = second
+        key = (src, dst, dport)
+        entry = self.pending.get(key)
+        if entry is None:
+            self.pending[key] = [weight, length * weight]
+        else:
+            entry[0] += weight
+            entry[1] += length * weight
+
+    def commit(self):
+        """把正在累计的这一秒写入草图
+
+        查询不会自动提交，以免与抓包线程并发修改；离线分析结束后可显式调用。
+        """
+        if not self.pending:
+            return
+        window = self._window(self.pending_second)
+        if window is not None:
+            if self.export_changes:
+                self._dirty.add(window.start)
+            for (src, dst, dport), (packets, total_bytes) in self.pending.items():
+                window.add(src, dst, dport, packets, total_bytes)
+        self.pending = {}
+
+    def _window(self, timestamp):
+        start = int(timestamp // self.window * self.window)
+        window = self.windows.get(start)
+        if window is None:
+            if len(self.windows) >= self.max_windows and start < min(self.windows):
+                # 早于保留范围的迟到数据
+                return None
+            window = _SketchWindow(start, self.options, self.export_changes)
+            self.windows[start] = window
+            while len(self.windows) > self.max_windows:
+                oldest = min(self.windows)
+                del self.windows[oldest]
+                self._dirty.discard(oldest)
+        return window
+
+    def drain_export(self):
+        """导出各窗口自上次导出以来的增量"""
+        self.commit()
+        exports = [self.windows[start].export() for start in sorted(self._dirty) if start in self.windows]
+        self._dirty = set()
+        return exports
+
+    def merge_export(self, exports):
+        """合并其他分片导出的窗口增量"""
+        for data in exports:
+            window = self._window(data['start'])
+            if window is not None:
+                window.merge(data)
+
+    def _get_window(self, start=None):
+        if not self.windows:
+            return None
+        if start is None:
+            return self.windows[max(self.windows)]
+        return self.windows.get(int(start // self.window * self.window))
+
+    def window_starts(self):
+        """保留的窗口起始时间，按时间排序"""
+        return sorted(self.windows)
+
+    def window_totals(self, start=None):
+        """窗口总量：包数、字节数、不同源与不同目的数量；start默认最近的窗口"""
+        window = self._get_window(start)
+        if window is None:
+            return None
+        return {
+            'window_start': window.start,
+            'packets': window.packets,
+            'bytes': window.bytes,
+            'distinct_sources': round(window.sources.count()),
+            'distinct_destinations': round(window.destinations.count())
+        }
+
+    def source_spread(self, ip, start=None):
+        """某个源在窗口内发送的包数/字节数（估计上界）及访问的不同端口数、不同主机数"""
+        window = self._get_window(start)
+        if window is None:
+            return None
+        src = ip_to_int(ip)
+        source = mix_hash((KEY_SOURCE, src))
+        packets, total_bytes = window.volume.estimate(source)
+        return {
+            'window_start': window.start,
+            'packets': packets,
+            'bytes': total_bytes,
+            'distinct_ports': round(window.spread.estimate(source)),
+            'distinct_hosts': round(window.spread.estimate(mix_hash((KEY_SOURCE_HOSTS, src))))
+        }
+
+    def destination_spread(self, ip, start=None):
+        """某个目的地址在窗口内收到的包数/字节数及不同来源数"""
+        window = self._get_window(start)
+        if window is None:
+            return None
+        destination = mix_hash((KEY_DESTINATION, ip_to_int(ip)))
+        packets, total_bytes = window.volume.estimate(destination)
+        return {
+            'window_start': window.start,
+            'packets': packets,
+            'bytes': total_bytes,
+            'distinct_sources': round(window.spread.estimate(destination))
+        }
+
+    def port_spread(self, port, start=None):
+        """某个目的端口在窗口内的包数/字节数及不同来源数"""
+        window = self._get_window(start)
+        if window is None:
+            return None
+        key = mix_hash((KEY_PORT, port))
+        packets, total_bytes = window.volume.estimate(key)
+        return {
+            'window_start': window.start,
+            'packets': packets,
+            'bytes': total_bytes,
+            'distinct_sources': round(window.spread.estimate(key))
+        }
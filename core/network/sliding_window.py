@@ -0,0 +1,157 @@
+# 滑动窗口计数模块
+# 为入侵检测提供按时间分桶的计数器与带过期的滚动去重集合，每次更新与查询均为摊还O(1)
+
+from collections import deque
+
+# 每个窗口划分的桶数，窗口边界的误差不超过一个桶宽
+WINDOW_BUCKETS = 10
+
+
+class WindowCounter:
+    """最近window秒内的事件计数
+
+    窗口被划分为WINDOW_BUCKETS个定宽的桶并循环复用，时间前进时只清空滑出窗口的桶，
+    总数随写入与清空增量维护。早于窗口的事件被忽略。
+    """
+    __slots__ = ('width', 'counts', 'current', 'total')
+
+    def __init__(self, window, buckets=WINDOW_BUCKETS):
+        self.width = window / buckets
+        self.counts = [0] * buckets
+        self.current = None
+        self.total = 0
+
+    def _advance(self, epoch):
+        current = self.current
+        if current is None:
+            self.current = epoch
+            return
+        if epoch <= current:
+            return
+        counts = self.counts
+        size = len(counts)
+        if epoch - current >= size:
+            counts[:] = [0] * size
+            self.total = 0
+        else:
+            for step in range(current + 1, epoch + 1):
+                slot = step % size
+                self.total -= counts[slot]
+                counts[slot] = 0
+        self.current = epoch
+
+    def add(self, timestamp, amount=1):
+        """记录timestamp时刻的amount个事件，返回窗口内的总数"""
+        epoch = int(timestamp // self.width)
+        self._advance(epoch)
+        if epoch > self.current - len(self.counts):
+            self.counts[epoch % len(self.counts)] += amount
+            self.total += amount
+        return self.total
+
+    def count(self, now):
+        """截至now的窗口内事件数"""
+        self._advance(int(now // self.width))
+        return self.total
+
+
+class DistinctWindow:
+    """最近window秒内出现过的不同值的数量（如不同目的端口）
+
+    last_seen记录每个值最近出现的时间，order按时间顺序保存 (时间, 值) 用于过期；
+    同一个值在一个桶宽内重复出现时不再追加，order的长度与不同值的数量而非事件数成正比。
+    """
+    __slots__ = ('window', 'resolution', 'last_seen', 'order')
+
+    def __init__(self, window, buckets=WINDOW_BUCKETS):
+        self.window = window
+        self.resolution = window / buckets
+        self.last_seen = {}
+        self.order = deque()
+
+    def expire(self, now):
+        deadline = now - self.window
+        order = self.order
+        last_seen = self.last_seen
+        while order and order[0][0] < deadline:
+            timestamp, value = order.popleft()
+            if last_seen.get(value) == timestamp:
+                del last_seen[value]
+
+    def add(self, value, timestamp):
+        """记录timestamp时刻出现的value，返回窗口内不同值的数量"""
+        order = self.order
+        if order and timestamp < order[-1][0]:
+            # 乱序到达的事件按最新时间计
+            timestamp = order[-1][0]
+        self.expire(timestamp)
+        previous = self.last_seen.get(value)
+        if previous is None or timestamp - previous >= self.resolution:
+            self.last_seen[value] = timestamp
+            order.append((timestamp, value))
+        return len(self.last_seen)
+
+    def count(self, now):
+        """截至now的窗口内不同值的数量"""
+        self.expire(now)
+        return len(self.last_seen)
+
+
+class TimingWheel:
+    """按时间分槽的定时轮，用于让空闲对象到期
+
+    schedule()把键放入到期时刻所在的槽，advance()只检查两次调用之间经过的槽，
+    返回到期的 (tick, 键)；到期时刻超出一圈的条目留在槽中等待下一圈。
+    条目不能取消，调用方用返回的tick识别过时的条目。
+    """
+
+    def __init__(self, resolution=1.0, size=64):
+        self.resolution = resolution
+        self.slots = [[] for _ in range(size)]
+        self.current = None
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.slots = [[] for _ in self.slots]
+        self.current = None
+        self.count = 0
+
+    def schedule(self, key, deadline):
+        """在deadline（秒）时让key到期，返回条目的tick"""
+        tick = int(deadline // self.resolution)
+        if self.current is not None and tick <= self.current:
+            tick = self.current + 1
+        self.slots[tick % len(self.slots)].append((tick, key))
+        self.count += 1
+        return tick
+
+    def advance(self, now):
+        """前进到now，返回到期的 [(tick, 键)]"""
+        target = int(now // self.resolution)
+        current = self.current
+        if current is None or target <= current:
+            if current is None:
+                self.current = target
+            return []
+        slots = self.slots
+        size = len(slots)
+        steps = range(current + 1, target + 1) if target - current < size else range(size)
+        due = []
+        for step in steps:
+            index = step % size
+            slot = slots[index]
+            if not slot:
+                continue
+            remaining = []
+            for entry in slot:
+                if entry[0] <= target:
+                    due.append(entry)
+                else:
+                    remaining.append(entry)
+            slots[index] = remaining
+        self.current = target
+        self.count -= len(due)
+        return due
@@ -0,0 +1,73 @@
+# 统计快照模块
+# 写入方按固定节奏发布不可变、带版本号的统计快照，界面线程无锁读取最新一份
+
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+StatsSnapshot = namedtuple('StatsSnapshot', [
+    'version',          # 内容变化时递增，读取方可据此跳过重绘
+    'timestamp',        # 发布时间
+    'statistics',       # 只读映射，格式同get_statistics()
+    'top_flows',        # ((流名称, 只读统计映射), ...)
+    'top_hosts',        # ((IP, 字节数, 误差上界), ...)
+    'top_ports',        # ((端口, 字节数, 误差上界), ...)
+    'recent_packets'    # (只读数据包映射, ...)，按时间从旧到新
+])
+
+EMPTY_SNAPSHOT = StatsSnapshot(
+    version=0,
+    timestamp=0.0,
+    statistics=MappingProxyType({'packet_count': 0, 'flow_count': 0, 'active_flows': 0, 'total_bytes': 0}),
+    top_flows=(),
+    top_hosts=(),
+    top_ports=(),
+    recent_packets=()
+)
+
+
+def _freeze(summary):
+    """把摘要转换为快照的各字段（不含版本与时间）"""
+    return (
+        MappingProxyType(dict(summary['statistics'])),
+        tuple((name, MappingProxyType(dict(data))) for name, data in summary['top_flows']),
+        tuple(tuple(entry) for entry in summary['top_hosts']),
+        tuple(tuple(entry) for entry in summary['top_ports']),
+        tuple(MappingProxyType(dict(packet)) for packet in summary['recent_packets'])
+    )
+
+
+class SnapshotPublisher:
+    """统计快照发布器
+
+    写入方（抓包线程或流水线收集线程）在处理数据时调用maybe_publish()，到期时由build
+    构建摘要并冻结为新快照，整体替换latest引用。引用赋值是原子的，读取方随时读取latest，
+    双方都不需要加锁，拿到的快照也不会再被修改。内容与上一份相同时沿用旧快照，版本号不变。
+    """
+
+    def __init__(self, build, interval=1.0, top_limit=10, recent_limit=100):
+        # build(top_limit, recent_limit) 返回TrafficState.summary()格式的摘要
+        self.build = build
+        self.interval = interval
+        self.top_limit = top_limit
+        self.recent_limit = recent_limit
+        self.latest = EMPTY_SNAPSHOT
+        self._next_publish = 0.0
+
+    def reset(self):
+        self.latest = EMPTY_SNAPSHOT
+        self._next_publish = 0.0
+
+    def maybe_publish(self):
+        """距上次发布已满interval秒时发布新快照"""
+        if time.monotonic() >= self._next_publish:
+            self.publish()
+
+    def publish(self):
+        """立即构建并发布快照，返回最新快照"""
+        self._next_publish = time.monotonic() + self.interval
+        fields = _freeze(self.build(self.top_limit, self.recent_limit))
+        latest = self.latest
+        if fields != latest[2:]:
+            self.latest = StatsSnapshot(latest.version + 1, time.time(), *fields)
+        return self.latest
@@ -0,0 +1,193 @@
+# TCP连接状态跟踪模块
+# 在流记录上维护精简的连接状态机，测量握手往返时间，并按目的地址统计半开连接
+
+import heapq
+from collections import OrderedDict
+
+from .metrics import LatencyHistogram
+from .packet_utils import TCP_ACK, TCP_FIN, TCP_RST, TCP_SYN, int_to_ip
+
+# 连接状态（保存在FlowRecord.tcp_state中）
+TCP_NONE = 0          # 尚未看到握手（如抓包开始时连接已存在）
+TCP_SYN_SENT = 1      # 看到发起方的SYN
+TCP_SYN_RECEIVED = 2  # 看到响应方的SYN-ACK
+TCP_ESTABLISHED = 3   # 握手完成，或中途看到不带SYN的数据包
+TCP_FIN_FORWARD = 4   # 发起方先发出FIN
+TCP_FIN_REVERSE = 5   # 响应方先发出FIN
+TCP_CLOSED = 6        # 双方都已发出FIN
+TCP_RESET = 7         # 看到RST
+TCP_STATE_NAMES = ('NONE', 'SYN_SENT', 'SYN_RECEIVED', 'ESTABLISHED', 'FIN_WAIT', 'FIN_WAIT', 'CLOSED', 'RESET')
+
+_HALF_OPEN = (TCP_SYN_SENT, TCP_SYN_RECEIVED)
+
+
+class TcpTracker:
+    """TCP连接状态与握手时延统计
+
+    状态、时间戳与往返时间直接保存在流记录的槽位上，不保存数据包历史。
+    rtt为SYN到SYN-ACK的时间（响应方的响应时延），ack_rtt为SYN-ACK到发起方ACK的时间；
+    处于SYN_SENT/SYN_RECEIVED的流按目的地址计入半开连接数，用于发现SYN洪泛。
+    服务器（目的地址）的握手时延按最近活动淘汰，最多保留max_servers个。
+    """
+
+    def __init__(self, max_servers=10000):
+        self.max_servers = max_servers
+        # 目的地址（整数） -> 当前半开连接数
+        self.half_open = {}
+        # 目的地址（整数） -> [样本数, rtt之和, 最大rtt]
+        self.servers = OrderedDict()
+        self.handshake_rtt = LatencyHistogram()
+        self.handshakes = 0
+        self.resets = 0
+
+    def clear(self):
+        self.half_open.clear()
+        self.servers.clear()
+        self.handshake_rtt.clear()
+        self.handshakes = 0
+        self.resets = 0
+
+    def update(self, record, bits, timestamp, src, sport):
+        """根据一个TCP数据包的标志位推进record的状态，src/sport为该包的源地址（整数）与源端口"""
+        state = record.tcp_state
+        if state == TCP_ESTABLISHED and not bits & (TCP_SYN | TCP_FIN | TCP_RST):
+            return
+
+        if bits & TCP_RST:
+            if state != TCP_RESET:
+                self._set_state(record, TCP_RESET)
+                self.resets += 1
+            return
+
+        if bits & TCP_SYN:
+            if bits & TCP_ACK:
+                if state == TCP_SYN_SENT:
+                    rtt = timestamp - record.tcp_time
+                    record.rtt = rtt
+                    self._add_server_rtt(record.dst, rtt)
+                    self.handshake_rtt.add(rtt)
+                    record.tcp_time = timestamp
+                    record.tcp_state = TCP_SYN_RECEIVED
+                elif state == TCP_NONE:
+                    # 没有看到SYN，不测量时延
+                    record.tcp_time = timestamp
+                    self._set_state(record, TCP_SYN_RECEIVED)
+            elif state not in _HALF_OPEN and state != TCP_ESTABLISHED:
+                # 新连接（或复用了已关闭连接的端口）；重传的SYN保留首次时间
+                record.tcp_time = timestamp
+                record.rtt = None
+                record.ack_rtt = None
+                self._set_state(record, TCP_SYN_SENT)
+            return
+
+        forward = src == record.src and sport == record.sport
+        if bits & TCP_FIN:
+            if state == TCP_FIN_FORWARD and not forward or state == TCP_FIN_REVERSE and forward:
+                self._set_state(record, TCP_CLOSED)
+            elif state not in (TCP_FIN_FORWARD, TCP_FIN_REVERSE, TCP_CLOSED):
+                self._set_state(record, TCP_FIN_FORWARD if forward else TCP_FIN_REVERSE)
+            return
+
+        if state == TCP_SYN_RECEIVED:
+            if forward and bits & TCP_ACK:
+                if record.rtt is not None:
+                    record.ack_rtt = timestamp - record.tcp_time
+                self.handshakes += 1
+                self._set_state(record, TCP_ESTABLISHED)
+        elif state == TCP_NONE:
+            self._set_state(record, TCP_ESTABLISHED)
+
+    def _set_state(self, record, state):
+        """切换状态，并随进入或离开半开状态增减目的地址的半开连接数"""
+        was_half_open = record.tcp_state in _HALF_OPEN
+        record.tcp_state = state
+        if (state in _HALF_OPEN) != was_half_open:
+            if was_half_open:
+                self._release_half_open(record.dst)
+            else:
+                self.half_open[record.dst] = self.half_open.get(record.dst, 0) + 1
+
+    def _release_half_open(self, dst):
+        half_open = self.half_open
+        count = half_open.get(dst, 0) - 1
+        if count > 0:
+            half_open[dst] = count
+        else:
+            half_open.pop(dst, None)
+
+    def release(self, record):
+        """流被淘汰时调用，仍处于半开状态的流不再计数（记录上的状态保留，随流归档）"""
+        if record.tcp_state in _HALF_OPEN:
+            self._release_half_open(record.dst)
+
+    def _add_server_rtt(self, server, rtt):
+        servers = self.servers
+        entry = servers.get(server)
+        if entry is None:
+            if len(servers) >= self.max_servers:
+                servers.popitem(last=False)
+            servers[server] = [1, rtt, rtt]
+            return
+        servers.move_to_end(server)
+        entry[0] += 1
+        entry[1] += rtt
+        if rtt > entry[2]:
+            entry[2] = rtt
+
+    def export(self, limit=100):
+        """导出可跨进程传递、可由merge_tcp()合并的摘要
+
+        只包含半开连接最多的limit个目的地址与平均握手时延最大的limit个服务器。
+        """
+        half_open = heapq.nlargest(limit, self.half_open.items(), key=lambda item: item[1])
+        servers = heapq.nlargest(limit, self.servers.items(), key=lambda item: item[1][1] / item[1][0])
+        return {
+            'handshakes': self.handshakes,
+            'resets': self.resets,
+            'half_open_total': sum(self.half_open.values()),
+            'half_open': [(int_to_ip(dst), count) for dst, count in half_open],
+            'servers': [(int_to_ip(server), samples, total, maximum) for server, (samples, total, maximum) in servers],
+            'handshake_rtt': self.handshake_rtt.export()
+        }
+
+
+def merge_tcp(exports, limit=10):
+    """合并多个TcpTracker.export()，返回半开连接与慢速服务器的统计
+
+    {'handshakes', 'resets', 'half_open_connections',
+     'half_open_by_destination': [(IP, 半开连接数)],
+     'slow_servers': [(IP, {'samples', 'mean_ms', 'max_ms'})]（按平均握手时延从大到小）,
+     'handshake_rtt': 握手时延直方图（微秒，格式同LatencyHistogram.to_dict()）}
+    """
+    handshakes = resets = half_open_total = 0
+    half_open = {}
+    servers = {}
+    histogram = LatencyHistogram()
+    for export in exports:
+        handshakes += export['handshakes']
+        resets += export['resets']
+        half_open_total += export['half_open_total']
+        for dst, count in export['half_open']:
+            half_open[dst] = half_open.get(dst, 0) + count
+        for server, samples, total, maximum in export['servers']:
+            entry = servers.get(server)
+            if entry is None:
+                servers[server] = [samples, total, maximum]
+            else:
+                entry[0] += samples
+                entry[1] += total
+                entry[2] = max(entry[2], maximum)
+        histogram.merge(export['handshake_rtt'])
+
+    slow = heapq.nlargest(limit, servers.items(), key=lambda item: item[1][1] / item[1][0])
+    return {
+        'handshakes': handshakes,
+        'resets': resets,
+        'half_open_connections': half_open_total,
+        'half_open_by_destination': heapq.nlargest(limit, half_open.items(), key=lambda item: item[1]),
+        'slow_servers': [
+            (server, {'samples': samples, 'mean_ms': total / samples * 1000, 'max_ms': maximum * 1000})
+            for server, (samples, total, maximum) in slow
+        ],
+        'handshake_rtt': histogram.to_dict()
+    }
@@ -0,0 +1,156 @@
+# 流量时间序列模块
+# 按秒累计数据包与字节数，自动汇总到10秒、1分钟与1小时分辨率，使用固定大小的numpy循环数组
+
+import numpy as np
+
+from .packet_utils import PROTO_NAMES
+
+# (分辨率秒数, 保留的桶数)：1秒保留1小时，10秒保留1天，1分钟保留1周，1小时保留90天
+RESOLUTIONS = ((1, 3600), (10, 8640), (60, 10080), (3600, 2160))
+
+# 单独统计的目的端口，其余端口计入 'other'
+DEFAULT_PORTS = (20, 21, 22, 23, 25, 53, 67, 80, 110, 123, 143, 161, 443, 445, 3306, 3389, 8080)
+
+
+class _RollupLevel:
+    """单个分辨率的循环数组"""
+
+    def __init__(self, resolution, bins, width):
+        self.resolution = resolution
+        self.bins = bins
+        self.data = np.zeros((bins, width), dtype=np.int64)
+        # 每个桶当前对应的起始时间，-1表示未使用
+        self.bin_times = np.full(bins, -1, dtype=np.int64)
+
+    def add(self, second, row):
+        bin_time = second - second % self.resolution
+        slot = (bin_time // self.resolution) % self.bins
+        current = self.bin_times[slot]
+        if current > bin_time:
+            # 桶已被更新的时间段复用，迟到的数据丢弃
+            return
+        if current != bin_time:
+            self.data[slot] = 0
+            self.bin_times[slot] = bin_time
+        self.data[slot] += row
+
+    def series(self, column, end, count):
+        """返回以end所在桶结尾的count个桶的 (时间, 值)"""
+        last = end - end % self.resolution
+        times = last - self.resolution * np.arange(count - 1, -1, -1, dtype=np.int64)
+        slots = (times // self.resolution) % self.bins
+        values = np.where(self.bin_times[slots] == times, self.data[slots, column], 0)
+        return times, values
+
+
+class TrafficTimeSeries:
+    """多分辨率流量时间序列
+
+    数据包路径只在Python列表中累计当前这一秒，秒切换时整行写入各分辨率的循环数组，
+    因此内存占用固定，与运行时长无关。
+    export_rows为True时（流水线分片）只累计当前这一秒并导出完成的行，不分配各分辨率的数组，
+    汇总由合并这些行的主进程完成。
+    """
+
+    def __init__(self, ports=DEFAULT_PORTS, resolutions=RESOLUTIONS, export_rows=False):
+        self.metrics = ['packets', 'bytes']
+        for name in PROTO_NAMES:
+            self.metrics += [f'packets:{name}', f'bytes:{name}']
+        self.port_columns = {}
+        for port in ports:
+            self.port_columns[port] = len(self.metrics)
+            self.metrics += [f'packets:port:{port}', f'bytes:port:{port}']
+        self.other_port_column = len(self.metrics)
+        self.metrics += ['packets:port:other', 'bytes:port:other']
+        self.columns = {name: index for index, name in enumerate(self.metrics)}
+        self._protocol_columns = {name: 2 + 2 * index for index, name in enumerate(PROTO_NAMES)}
+
+        self.levels = []
+        if not export_rows:
+            self.levels = [_RollupLevel(resolution, bins, len(self.metrics)) for resolution, bins in resolutions]
+        self.current_second = None
+        self.current = [0] * len(self.metrics)
+        # 流水线分片中导出已完成的每秒数据，由主进程合并
+        self.export_rows = export_rows
+        self.pending_rows = []
+
+    def clear(self):
+        for level in self.levels:
+            level.data[:] = 0
+            level.bin_times[:] = -1
+        self.current_second = None
+        self.current = [0] * len(self.metrics)
+        self.pending_rows = []
+
+    def add_packet(self, timestamp, length, protocol, dport=None, weight=1):
+        """累计一个数据包，weight为抽样时这个包代表的包数"""
+        second = int(timestamp)
+        if second != self.current_second:
+            self._commit()
+            self.current_second = second
+
+        length *= weight
+        current = self.current
+        current[0] += weight
+        current[1] += length
+        column = self._protocol_columns.get(protocol)
+        if column is not None:
+            current[column] += weight
+            current[column + 1] += length
+        if dport is not None:
+            column = self.port_columns.get(dport, self.other_port_column)
+            current[column] += weight
+            current[column + 1] += length
+
+    def advance(self, now):
+        """当前秒已经过去时提交它（空闲期间由摘要发布等周期任务调用）"""
+        if self.current_second is not None and int(now) > self.current_second:
+            self._commit()
+            self.current_second = None
+
+    def _commit(self):
+        if self.current_second is None or not self.current[0]:
+            return
+        if self.levels:
+            row = np.array(self.current, dtype=np.int64)
+            for level in self.levels:
+                level.add(self.current_second, row)
+        if self.export_rows:
+            self.pending_rows.append((self.current_second, self.current))
+        self.current = [0] * len(self.metrics)
+
+    def drain_rows(self):
+        """取出待导出的 [(秒, 行)]"""
+        rows, self.pending_rows = self.pending_rows, []
+        return rows
+
+    def merge_rows(self, rows):
+        """合并其他分片导出的每秒数据"""
+        for second, values in rows:
+            row = np.array(values, dtype=np.int64)
+            for level in self.levels:
+                level.add(second, row)
+
+    def _level(self, resolution):
+        for level in self.levels:
+            if level.resolution == resolution:
+                return level
+        raise ValueError(f"不支持的分辨率: {resolution}")
+
+    def get_series(self, metric='bytes', resolution=1, count=60, end=None):
+        """获取指定指标的时间序列，返回 (时间数组, 数值数组)
+
+        end默认为最近一个已完成的秒；正在累计的当前秒不包含在内。
+        """
+        if metric not in self.columns:
+            raise ValueError(f"未知的指标: {metric}")
+        level = self._level(resolution)
+        if end is None:
+            end = int(level.bin_times.max()) if (level.bin_times >= 0).any() else 0
+        count = min(count, level.bins)
+        return level.series(self.columns[metric], int(end), count)
+
+    def get_rate(self, metric='bytes', resolution=1, window=10, end=None):
+        """最近window个桶内指标的平均每秒速率"""
+        _, values = self.get_series(metric, resolution, window, end)
+        return float(values.sum()) / (window * resolution)
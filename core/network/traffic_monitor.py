@@ -1,62 +1,474 @@
 # 网络流量监控模块
-# 基于scapy库实现数据包捕获与分析
+# 基于scapy库实现数据包捕获与分析，支持AF_PACKET原始套接字快速抓包
 
+import socket
 import threading
 import time
-from scapy.all import sniff, IP, TCP, UDP, ICMP
+from .traffic_state import TrafficState, initiates_connection
+from .fast_capture import RawSocketCapture, decode_frame, raw_capture_available
+from .pipeline import AnalysisPipeline
+from .pcap_replay import PcapReplay
+from .snapshot import SnapshotPublisher
+from .metrics import STAGE_DISSECT
+from .multi_capture import MultiInterfaceCapture
+from .sampling import AdaptiveSampler, SAMPLE_FLOW
+
+try:
+    from scapy.all import sniff, IP, TCP, UDP, ICMP
+except ImportError:
+    sniff = None
+
+# 抓包模式
+CAPTURE_AUTO = 'auto'      # 原始套接字可用时使用快速路径，否则使用scapy
+CAPTURE_RAW = 'raw'        # AF_PACKET原始套接字 + 内核BPF过滤 + struct解码
+CAPTURE_SCAPY = 'scapy'    # scapy sniff完整解析
+CAPTURE_OFFLINE = 'offline'  # 回放pcap/pcapng文件
 
 class NetworkMonitor:
-    def __init__(self):
+    def __init__(self, max_history=100000, max_flows=100000, flow_idle_timeout=120, flow_sink=None,
+                 capture_mode=CAPTURE_AUTO, bpf_filter=None, workers=0, worker_processes=False,
+                 topk_exact=False, topk_capacity=1000, flow_archive=None, sketch_window=60, sketch_windows=5,
+                 snapshot_interval=1.0, sampling=None, sampling_max_rate=1024, max_hosts=100000,
+                 max_domains=10000, pcap_ring=None, enricher=None, intrusion_prevention=None,
+                 connection_batch_size=256):
         self.is_monitoring = False
-        self.packet_count = 0
-        self.flow_data = {}
-        self.packet_history = []
-        self.max_history = 1000
+        self.max_history = max_history
+        # 结束或被淘汰的流写入时间分段的磁盘归档
+        self.flow_archive = flow_archive
+        if flow_archive is not None and flow_sink is None:
+            flow_sink = flow_archive.submit
+        # 可选的原始帧pcap环形缓冲（PcapRing），告警时由freeze_capture()保留前后的抓包
+        self.pcap_ring = pcap_ring
+        # 可选的IP信息补充（IpEnricher），只在通过查询接口读取流与主机时查找，不进入数据包路径
+        self.enricher = enricher
+        self.state_options = {
+            'max_history': max_history,
+            'max_flows': max_flows,
+            'flow_idle_timeout': flow_idle_timeout,
+            'flow_sink': flow_sink,
+            'topk_exact': topk_exact,
+            'topk_capacity': topk_capacity,
+            'sketch_window': sketch_window,
+            'sketch_windows': sketch_windows,
+            'max_hosts': max_hosts,
+            'max_domains': max_domains
+        }
+        # 内联模式下的流量状态（数据包历史、流表、计数与Top-K）；数据包环形缓冲与时间序列会预分配内存，
+        # 因此推迟到首次使用或开始监控时创建
+        self._state = None
+        self.capture_mode = capture_mode
+        # BPF过滤表达式或已编译的指令列表
+        self.bpf_filter = bpf_filter
+        self.active_capture_mode = None
         self.monitor_thread = None
+        # scapy模式下sniff只在收到包时回调，由空闲定时线程按节奏投递未满的批次
+        self.idle_thread = None
+        # 当前（或最近一次）的原始套接字抓包器，用于读取内核收包与丢包计数
+        self.capture = None
+        # 同时监听多个网卡时的抓包器；单网卡时记录网卡名称
+        self.multi_capture = None
+        self.interface = None
+        
+        # workers > 0 时启用分片分析流水线，抓包线程只负责分批投递原始帧；
+        # 进程模式下flow_sink会在工作进程中调用，必须可被pickle
+        self.pipeline = None
+        if workers > 0:
+            self.pipeline = AnalysisPipeline(
+                num_workers=workers,
+                use_processes=worker_processes,
+                state_options=dict(self.state_options, max_history=max(1, max_history // workers))
+            )
+        
+        # 可选的过载抽样：'count'为每N个包取一个，'flow'为按流哈希取1/N的流；
+        # N根据队列深度、丢包与抓包线程CPU占用自动升降，未过载时N为1
+        self.sampler = None
+        if sampling:
+            self.sampler = AdaptiveSampler(sampling, sampling_max_rate, load=self._sampling_load)
+        
+        # 实时抓包时把发起连接的数据包信息（不复制，见initiates_connection）按批投递给入侵防御；
+        # 被阻止的源（4字节地址）在解析前即被跳过，阻止与解除阻止通过回调同步
+        self.intrusion_prevention = intrusion_prevention
+        self.connection_batch_size = connection_batch_size
+        self.blocked_sources = set()
+        self.blocked_packets = 0
+        self._connections = None
+        self._connections_flushed = 0.0
+        # 未满的连接批次按connection_flush_interval秒在各抓包路径的空闲回调中投递；
+        # scapy模式下空闲定时线程与抓包线程并发访问，由锁保护
+        self.connection_flush_interval = 0.1
+        self._connections_lock = threading.Lock()
+        if intrusion_prevention is not None:
+            intrusion_prevention.block_listeners.append(self._on_block)
+            intrusion_prevention.unblock_listeners.append(self._on_unblock)
+            if self.pipeline:
+                self.pipeline.connection_sink = intrusion_prevention.submit_connections
+        
+        # 由写入方（抓包线程或流水线收集线程）定期发布的不可变统计快照，供界面线程无锁读取
+        self.snapshots = SnapshotPublisher(self._build_summary, snapshot_interval)
+        if self.pipeline:
+            self.pipeline.snapshots = self.snapshots
+    
+    def _uses_pipeline(self):
+        """统计结果是否来自分析流水线（离线回放总是内联分析）"""
+        return self.pipeline is not None and self.active_capture_mode != CAPTURE_OFFLINE
+    
+    @property
+    def state(self):
+        if self._state is None:
+            self._state = TrafficState(**self.state_options)
+        return self._state
+    
+    def _reset_state(self):
+        if self._state is None:
+            self._state = TrafficState(**self.state_options)
+        else:
+            self._state.reset()
+    
+    def set_flow_archive(self, flow_archive):
+        """设置流归档（须在开始监控或回放之前调用），结束或被淘汰的流改为写入flow_archive"""
+        self.flow_archive = flow_archive
+        flow_sink = flow_archive.submit if flow_archive is not None else None
+        self.state_options['flow_sink'] = flow_sink
+        if self._state is not None:
+            self._state.flow_table.sink = flow_sink
+        if self.pipeline:
+            if self.pipeline.use_processes:
+                self.pipeline.flow_sink = flow_sink
+            else:
+                self.pipeline.state_options['flow_sink'] = flow_sink
+    
+    @property
+    def packet_count(self):
+        if self._uses_pipeline():
+            return self.pipeline.get_summary(0, 0)['statistics']['packet_count']
+        return self.state.packet_count
+    
+    @property
+    def flow_table(self):
+        return self.state.flow_table
+    
+    @property
+    def packet_history(self):
+        return self.state.packet_history
     
     def start_monitoring(self, interface=None):
-        """开始网络流量监控"""
+        """开始网络流量监控
+        
+        interface可以是单个网卡名称，也可以是网卡名称列表；多个网卡时各自独立抓包，
+        结果合并到同一个流表中，每个流记录首次看到它的网卡。
+        """
+        interfaces = None
+        if isinstance(interface, (list, tuple)):
+            if len(interface) > 1:
+                interfaces = list(interface)
+            else:
+                interface = interface[0] if interface else None
+        
         self.is_monitoring = True
-        self.packet_count = 0
-        self.flow_data = {}
-        self.packet_history = []
+        self._reset_state()
+        self.state.offline = False
+        self.snapshots.reset()
+        self.capture = None
+        self.multi_capture = None
+        self.interface = interface
+        if self.sampler:
+            self.sampler.reset()
+        self.blocked_packets = 0
+        if self.intrusion_prevention is not None:
+            self.blocked_sources = set()
+            for ip in list(self.intrusion_prevention.blocked_ips):
+                self._on_block(ip)
+            if not self.pipeline:
+                self._connections = []
         
-        def packet_handler(packet):
-            if not self.is_monitoring:
-                return
-            
-            self.packet_count += 1
-            
-            # 分析数据包
-            packet_info = self.analyze_packet(packet)
-            
-            # 存储数据包信息
-            if packet_info:
-                self.packet_history.append(packet_info)
-                if len(self.packet_history) > self.max_history:
-                    self.packet_history.pop(0)
-                
-                # 更新流量数据
-                self.update_flow_data(packet_info)
+        mode = self._resolve_capture_mode()
+        self.active_capture_mode = mode
+        if self.flow_archive:
+            self.flow_archive.start()
+        if self.pcap_ring:
+            self.pcap_ring.start()
+        if self.pipeline:
+            self.pipeline.start()
+        
+        if interfaces:
+            self.monitor_thread = None
+            self.multi_capture = MultiInterfaceCapture(
+                interfaces, mode, self._frame_handler(), self.bpf_filter,
+                idle=self._capture_idle
+            )
+            self.multi_capture.start()
+            return
         
         # 启动监控线程
-        self.monitor_thread = threading.Thread(
-            target=sniff,
-            kwargs={
+        if mode == CAPTURE_RAW:
+            self.monitor_thread = threading.Thread(
+                target=self._raw_capture_loop,
+                args=(interface,),
+                daemon=True
+            )
+        else:
+            sampler = self.sampler
+            pcap_ring = self.pcap_ring
+            blocked_ips = self.intrusion_prevention.blocked_ips if self.intrusion_prevention is not None else None
+            
+            def packet_handler(packet):
+                if not self.is_monitoring:
+                    return
+                
+                if blocked_ips and IP in packet and packet[IP].src in blocked_ips:
+                    # 在解析与抽样之前跳过被阻止的源（仍然写入pcap环形缓冲）
+                    if pcap_ring:
+                        pcap_ring.submit(getattr(packet, 'original', None) or bytes(packet), time.time())
+                    self.blocked_packets += 1
+                    return
+                if pcap_ring:
+                    pcap_ring.submit(getattr(packet, 'original', None) or bytes(packet), time.time())
+                weight = 1
+                if sampler:
+                    # 抓到的包保留了原始字节，流哈希抽样无需重新序列化
+                    weight = sampler.admit(getattr(packet, 'original', None) or b'', time.time())
+                    if not weight:
+                        return
+                
+                if self.pipeline:
+                    self.pipeline.submit(bytes(packet), time.time(), None, weight)
+                    return
+                
+                # 分析数据包（抽样计时）
+                latency = self.state.latency
+                if latency.sample():
+                    started = latency.clock()
+                    packet_info = self.analyze_packet(packet)
+                    latency.record(STAGE_DISSECT, latency.clock() - started)
+                else:
+                    packet_info = self.analyze_packet(packet)
+                if packet_info:
+                    self.process_packet_info(packet_info, weight, getattr(packet, 'original', None))
+            
+            kwargs = {
                 'prn': packet_handler,
                 'iface': interface,
-                'store': 0
-            },
-            daemon=True
-        )
+                'store': 0,
+                'stop_filter': lambda packet: not self.is_monitoring
+            }
+            if isinstance(self.bpf_filter, str):
+                kwargs['filter'] = self.bpf_filter
+            self.monitor_thread = threading.Thread(target=sniff, kwargs=kwargs, daemon=True)
+            if self.pipeline or self._connections is not None:
+                self.idle_thread = threading.Thread(target=self._idle_loop, daemon=True)
+                self.idle_thread.start()
         self.monitor_thread.start()
     
+    def _resolve_capture_mode(self):
+        """根据配置与运行环境确定实际使用的抓包模式"""
+        if self.capture_mode == CAPTURE_SCAPY:
+            mode = CAPTURE_SCAPY
+        elif self.capture_mode == CAPTURE_RAW or raw_capture_available():
+            mode = CAPTURE_RAW
+        else:
+            mode = CAPTURE_SCAPY
+        
+        if mode == CAPTURE_SCAPY and sniff is None:
+            raise RuntimeError("scapy未安装且原始套接字不可用，无法抓包")
+        return mode
+    
+    def _raw_capture_loop(self, interface):
+        """原始套接字抓包循环"""
+        capture = RawSocketCapture(interface, self.bpf_filter)
+        self.capture = capture
+        try:
+            capture.run(self._frame_handler(), self._capture_should_continue)
+        except Exception as e:
+            print(f"原始套接字抓包失败: {e}")
+            self.is_monitoring = False
+    
+    def _frame_handler(self):
+        """原始帧的处理函数 handler(frame, timestamp, interface=None)
+        
+        启用抽样时先经过抽样器；启用pcap环形缓冲时所有帧（包括未被抽中的）都先交给它记录。
+        """
+        handler = self.pipeline.submit if self.pipeline else self._handle_raw_frame
+        if self.sampler:
+            handler = self.sampler.wrap(handler)
+        if self.intrusion_prevention is not None:
+            handler = self._skip_blocked(handler)
+        if self.pcap_ring:
+            handler = self.pcap_ring.wrap(handler)
+        return handler
+    
+    def _skip_blocked(self, handler):
+        """包装帧处理函数，源地址已被阻止的IPv4帧在解析前直接丢弃"""
+        blocked = self.blocked_sources
+        
+        def handle(frame, timestamp, interface=None):
+            if blocked and frame[12] == 0x08 and frame[13] == 0x00 and bytes(frame[26:30]) in blocked:
+                self.blocked_packets += 1
+                return
+            handler(frame, timestamp, interface)
+        return handle
+    
+    def _on_block(self, ip, reason=None, timestamp=None):
+        try:
+            self.blocked_sources.add(socket.inet_aton(ip))
+        except (OSError, TypeError):
+            # 非IPv4地址
+            pass
+    
+    def _on_unblock(self, ip):
+        try:
+            self.blocked_sources.discard(socket.inet_aton(ip))
+        except (OSError, TypeError):
+            pass
+    
+    def _flush_connections(self):
+        """把内联模式下累积的连接批次交给入侵防御"""
+        with self._connections_lock:
+            connections = self._connections
+            if connections:
+                self._connections = []
+        self._connections_flushed = time.time()
+        if connections:
+            self.intrusion_prevention.submit_connections(connections)
+    
+    def _maybe_flush_connections(self):
+        """距上次投递已满connection_flush_interval时投递未满的连接批次，慢速扫描也能及时评估"""
+        if self._connections and time.time() - self._connections_flushed >= self.connection_flush_interval:
+            self._flush_connections()
+    
+    def _sampling_load(self):
+        """抽样器的负载输入：(队列填充率, 累计丢包数)，在抓包线程中调用"""
+        fill = 0.0
+        dropped = 0
+        if self.pipeline:
+            fill = self.pipeline.queue_fill()
+            dropped += self.pipeline.dropped_packets
+        if self.multi_capture is not None:
+            fill = max(fill, self.multi_capture.queue_fill())
+            dropped += self.multi_capture.queue_dropped()
+        elif self.capture is not None:
+            kernel_dropped = self.capture.read_statistics()[1]
+            dropped += kernel_dropped or 0
+        return fill, dropped
+    
+    def _capture_should_continue(self):
+        """原始套接字循环在每帧及每次超时后调用"""
+        self._capture_idle()
+        return self.is_monitoring
+    
+    def _capture_idle(self):
+        """抓包线程（多接口时为合并线程）的空闲回调：按节奏投递未满的批次与连接批次或发布快照"""
+        if self.pipeline:
+            self.pipeline.maybe_flush()
+        else:
+            self.snapshots.maybe_publish()
+            self._maybe_flush_connections()
+    
+    def _idle_loop(self):
+        """scapy抓包的空闲定时器：sniff只在收到包时回调，流量停顿时由这里投递未满的批次与连接批次
+        
+        与抓包线程并发运行，只做加锁的投递，不发布快照。
+        """
+        if self.pipeline:
+            interval = self.pipeline.flush_interval
+        else:
+            interval = self.connection_flush_interval
+        while self.is_monitoring:
+            time.sleep(interval)
+            if self.pipeline:
+                self.pipeline.maybe_flush()
+            else:
+                self._maybe_flush_connections()
+    
+    def _handle_raw_frame(self, frame, timestamp, interface=None, weight=1):
+        """处理原始套接字收到的一帧，interface为多接口抓包时的来源网卡，weight为抽样加权系数"""
+        latency = self.state.latency
+        if latency.sample():
+            started = latency.clock()
+            packet_info = decode_frame(frame, timestamp)
+            latency.record(STAGE_DISSECT, latency.clock() - started)
+        else:
+            packet_info = decode_frame(frame, timestamp)
+        if interface is not None:
+            packet_info['interface'] = interface
+        self.process_packet_info(packet_info, weight, frame)
+    
+    def process_packet_info(self, packet_info, weight=1, frame=None):
+        """记录一条已解析的数据包信息：计数、历史与流量数据
+        
+        提供原始帧frame时，对每个TCP流的前几个数据包识别应用层协议（HTTP Host、TLS SNI、SSH标识）。
+        """
+        record = self.state.update(packet_info, weight, frame)
+        if self._connections is not None and 'src' in packet_info and initiates_connection(packet_info, record):
+            with self._connections_lock:
+                connections = self._connections
+                full = False
+                if connections is not None:
+                    connections.append(packet_info)
+                    full = len(connections) >= self.connection_batch_size
+            if full:
+                self._flush_connections()
+        self.snapshots.maybe_publish()
+        return record
+    
     def stop_monitoring(self):
         """停止网络流量监控"""
         self.is_monitoring = False
         if self.monitor_thread:
             # 等待线程结束
             self.monitor_thread.join(timeout=2)
+        if self.idle_thread:
+            self.idle_thread.join(timeout=2)
+            self.idle_thread = None
+        if self.multi_capture:
+            self.multi_capture.stop()
+        if self.pipeline:
+            self.pipeline.stop()
+        else:
+            # 归档仍在流表中的流，但保留在内存中供界面展示
+            self.state.flow_table.flush(keep=True)
+        if self._connections is not None:
+            self._flush_connections()
+            with self._connections_lock:
+                self._connections = None
+        if self.flow_archive:
+            self.flow_archive.stop()
+        if self.pcap_ring:
+            self.pcap_ring.stop()
+        self.snapshots.publish()
+    
+    def freeze_capture(self, ip=None, reason=None, timestamp=None):
+        """保留告警前后时间窗口内的原始抓包，返回保存目录；未启用pcap环形缓冲或未在抓包时返回None"""
+        if self.pcap_ring is None or not self.pcap_ring.is_running:
+            return None
+        return self.pcap_ring.freeze(timestamp, ip, reason)
+    
+    def get_frozen_captures(self):
+        """列出因告警保留的抓包 [{'name', 'path', 'files', 'bytes'}]"""
+        if self.pcap_ring is None:
+            return []
+        return self.pcap_ring.get_frozen_captures()
+    
+    def replay(self, path, speed=None, intrusion_prevention=None):
+        """离线回放抓包文件或目录，返回吞吐与各阶段耗时报告
+        
+        回放总是在调用线程中内联分析，speed为None时尽可能快，1.0为按记录速度。
+        intrusion_prevention应为回放专用的实例，其阻止会按正常流程写入防火墙并触发回调。
+        """
+        if self.is_monitoring:
+            raise RuntimeError("实时监控进行中，无法回放")
+        self._reset_state()
+        self.state.offline = True
+        self.snapshots.reset()
+        self.active_capture_mode = CAPTURE_OFFLINE
+        if self.flow_archive:
+            self.flow_archive.start()
+        try:
+            return PcapReplay(self, intrusion_prevention, speed).run(path)
+        finally:
+            self.state.flow_table.flush(keep=True)
+            if self.flow_archive:
+                self.flow_archive.stop()
+            self.snapshots.publish()
     
     def analyze_packet(self, packet):
         """分析数据包并提取信息"""
@@ -76,6 +488,10 @@ class NetworkMonitor:
                 packet_info['sport'] = packet[TCP].sport
                 packet_info['dport'] = packet[TCP].dport
                 packet_info['flags'] = str(packet[TCP].flags)
+                # 载荷在原始帧中的起始位置，供应用层协议识别使用
+                payload_length = len(packet[TCP].payload)
+                if payload_length:
+                    packet_info['payload_offset'] = len(packet) - payload_length
             elif UDP in packet:
                 packet_info['protocol'] = 'UDP'
                 packet_info['sport'] = packet[UDP].sport
@@ -89,58 +505,312 @@ class NetworkMonitor:
     
     def update_flow_data(self, packet_info):
         """更新流量数据"""
-        flow_key = None
+        return self.state.flow_table.update(packet_info)
+    
+    def _build_summary(self, top_limit, recent_limit):
+        if self._uses_pipeline():
+            summary = self.pipeline.get_summary(top_limit, recent_limit)
+        else:
+            summary = self.state.summary(top_limit, recent_limit)
+        summary['statistics'] = self._sampled_statistics(summary['statistics'])
+        return summary
+    
+    def _sampled_statistics(self, statistics):
+        """为实时抓包的统计加上抽样标记
         
-        if 'src' in packet_info and 'dst' in packet_info:
-            if 'sport' in packet_info and 'dport' in packet_info:
-                flow_key = f"{packet_info['src']}:{packet_info['sport']}->{packet_info['dst']}:{packet_info['dport']}"
-            else:
-                flow_key = f"{packet_info['src']}->{packet_info['dst']}"
-        
-        if flow_key:
-            if flow_key not in self.flow_data:
-                self.flow_data[flow_key] = {
-                    'count': 0,
-                    'bytes': 0,
-                    'protocol': packet_info['protocol'],
-                    'first_seen': packet_info['timestamp'],
-                    'last_seen': packet_info['timestamp']
-                }
-            
-            self.flow_data[flow_key]['count'] += 1
-            self.flow_data[flow_key]['bytes'] += packet_info['length']
-            self.flow_data[flow_key]['last_seen'] = packet_info['timestamp']
+        包数与字节数已在分析时按加权系数累计；流哈希抽样只保留1/N的流，
+        流数按当前的N放大。未启用抽样或离线回放时原样返回。
+        """
+        sampler = self.sampler
+        if sampler is None or self.active_capture_mode in (None, CAPTURE_OFFLINE):
+            return statistics
+        statistics = dict(statistics)
+        if sampler.mode == SAMPLE_FLOW and sampler.rate > 1:
+            statistics['flow_count'] *= sampler.rate
+            statistics['active_flows'] *= sampler.rate
+        statistics['sampled'] = sampler.sampled
+        statistics['sample_mode'] = sampler.mode
+        statistics['sample_rate'] = sampler.rate
+        return statistics
     
-    def get_statistics(self):
-        """获取网络流量统计信息"""
-        stats = {
-            'packet_count': self.packet_count,
-            'flow_count': len(self.flow_data),
-            'active_flows': 0,
-            'total_bytes': 0
+    def get_snapshot(self):
+        """获取最新发布的不可变统计快照（StatsSnapshot），不阻塞抓包
+        
+        快照的version在内容变化时递增，界面可在版本未变时跳过重绘。
+        """
+        return self.snapshots.latest
+    
+    def get_pipeline_metrics(self):
+        """抓包与处理路径的健康指标，用于区分"流量确实少"与"处理不过来而丢包"
+        
+        kernel_received/kernel_dropped: 内核收到（含丢弃）与丢弃的包数，仅原始套接字模式可用，否则为None
+        handler_packets: 交给处理函数的包数；processed_packets: 完成分析的包数
+        queue_dropped: 流水线队列（及多接口的接口队列）已满而丢弃的包数
+        latency: 各阶段抽样延迟（微秒）的均值、百分位与最大值
+        sampling: 启用过载抽样时抽样器的当前N、提交与保留的包数，否则为None
+        blocked_packets: 源地址已被入侵防御阻止、在解析前被跳过的包数
+        queue_depths: 流水线各队列与流归档写入队列的深度
+        多接口抓包时内核与接口队列计数为各接口之和，分接口的数据见get_interface_statistics()
+        """
+        kernel_received = kernel_dropped = None
+        interfaces = {}
+        if self.multi_capture is not None:
+            interfaces = self.multi_capture.get_statistics()
+            for stats in interfaces.values():
+                if stats['kernel_received'] is not None:
+                    kernel_received = (kernel_received or 0) + stats['kernel_received']
+                    kernel_dropped = (kernel_dropped or 0) + stats['kernel_dropped']
+        elif self.capture is not None and self.active_capture_mode == CAPTURE_RAW:
+            kernel_received, kernel_dropped = self.capture.read_statistics()
+        
+        queue_depths = {}
+        if self._uses_pipeline():
+            summary = self.pipeline.get_summary(0, 0)
+            statistics = summary['statistics']
+            processed = statistics.get('observed_packets', statistics['packet_count'])
+            latency = summary['latency']
+            handler_packets = self.pipeline.submitted_packets
+            queue_dropped = self.pipeline.dropped_packets
+            queue_depths.update(self.pipeline.queue_depths())
+        else:
+            processed = handler_packets = self.state.observed_packets
+            latency = self.state.latency.to_dict()
+            queue_dropped = 0
+        if self.sampler and self.active_capture_mode != CAPTURE_OFFLINE:
+            # 被抽样跳过的包不算丢失
+            handler_packets = self.sampler.offered_packets
+        if interfaces:
+            handler_packets = sum(stats['packet_count'] for stats in interfaces.values())
+            queue_dropped += sum(stats['queue_dropped'] for stats in interfaces.values())
+            queue_depths['interface_batches'] = {
+                name: stats['queue_batches'] for name, stats in interfaces.items()
+            }
+        if self.flow_archive is not None:
+            queue_depths['archive_rows'] = self.flow_archive.queue.qsize()
+        if self.pcap_ring is not None:
+            queue_depths['pcap_frames'] = len(self.pcap_ring.pending)
+        if self.intrusion_prevention is not None:
+            queue_depths['ids_batches'] = self.intrusion_prevention.batch_queue.qsize()
+        
+        lost = queue_dropped + (kernel_dropped or 0)
+        offered = handler_packets + (kernel_dropped or 0)
+        return {
+            'capture_mode': self.active_capture_mode,
+            'kernel_received': kernel_received,
+            'kernel_dropped': kernel_dropped,
+            'handler_packets': handler_packets,
+            'processed_packets': processed,
+            'queue_dropped': queue_dropped,
+            'loss_ratio': lost / offered if offered else 0.0,
+            'latency': latency,
+            'queue_depths': queue_depths,
+            'sampling': self.sampler.get_statistics() if self.sampler else None,
+            'blocked_packets': self.blocked_packets
         }
+    
+    def get_interface_statistics(self):
+        """按网卡返回抓包计数 {网卡: {packet_count, total_bytes, queue_dropped, kernel_received, ...}}
         
-        current_time = time.time()
-        for flow, data in self.flow_data.items():
-            stats['total_bytes'] += data['bytes']
-            # 检查是否为活跃流（最近10秒内有活动）
-            if current_time - data['last_seen'] < 10:
-                stats['active_flows'] += 1
+        单网卡抓包时只有一项，键为网卡名称（未指定时为 'default'）。
+        """
+        if self.multi_capture is not None:
+            return self.multi_capture.get_statistics()
+        if self.active_capture_mode in (None, CAPTURE_OFFLINE):
+            return {}
+        kernel_received = kernel_dropped = None
+        if self.capture is not None and self.active_capture_mode == CAPTURE_RAW:
+            kernel_received, kernel_dropped = self.capture.read_statistics()
+        statistics = self.get_statistics()
+        return {
+            self.interface or 'default': {
+                'mode': self.active_capture_mode,
+                'packet_count': statistics['packet_count'],
+                'total_bytes': statistics['total_bytes'],
+                'queue_dropped': self.pipeline.dropped_packets if self._uses_pipeline() else 0,
+                'kernel_received': kernel_received,
+                'kernel_dropped': kernel_dropped,
+                'running': self.is_monitoring,
+                'error': None
+            }
+        }
+    
+    def get_statistics(self):
+        """获取网络流量统计信息
         
-        return stats
+        启用抽样时包含sampled（本次抓包是否发生过抽样，为True时计数为无偏估计）、
+        sample_mode与sample_rate（当前的N），以及实际分析的observed_packets/observed_bytes。
+        """
+        if self._uses_pipeline():
+            statistics = self.pipeline.get_summary(0, 0)['statistics']
+        else:
+            statistics = self.state.get_statistics()
+        return self._sampled_statistics(statistics)
     
     def get_recent_packets(self, limit=100):
         """获取最近的数据包"""
-        return self.packet_history[-limit:]
+        if self._uses_pipeline():
+            return self.pipeline.get_summary(0, limit)['recent_packets']
+        return self.state.get_recent_packets(limit)
     
     def get_top_flows(self, limit=10):
-        """获取流量最大的前N个流"""
-        sorted_flows = sorted(
-            self.flow_data.items(),
-            key=lambda x: x[1]['bytes'],
-            reverse=True
-        )
-        return sorted_flows[:limit]
+        """获取流量最大的前N个流；配置了enricher时统计字典另含src_info/dst_info（见enrich_ip）"""
+        if self._uses_pipeline():
+            flows = self.pipeline.get_summary(limit, 0)['top_flows']
+        else:
+            flows = self.state.get_top_flows(limit)
+        if self.enricher is None:
+            return flows
+        return [(label, self._enrich_flow(data)) for label, data in flows]
+    
+    def enrich_ip(self, ip):
+        """IP所属的 {'asn', 'organisation', 'country'}，未配置enricher或查不到时返回None"""
+        if self.enricher is None:
+            return None
+        return self.enricher.lookup(ip)
+    
+    def describe_ip(self, ip):
+        """IP的简短描述（如 'AS15169 Google LLC, US'），没有信息时返回空字符串"""
+        if self.enricher is None:
+            return ''
+        return self.enricher.describe(ip)
+    
+    def _enrich_flow(self, data):
+        # 复制后再补充，流水线摘要中的字典可能被其他读取方共享
+        return dict(data, src_info=self.enricher.lookup(data['src']), dst_info=self.enricher.lookup(data['dst']))
+    
+    def _enrich_host(self, data):
+        return dict(data, info=self.enricher.lookup(data['ip']))
+    
+    def get_top_hosts(self, limit=10):
+        """获取发送字节数最多的前N个源主机"""
+        if self._uses_pipeline():
+            return self.pipeline.get_summary(limit, 0)['top_hosts']
+        return self.state.get_top_hosts(limit)
+    
+    def get_top_ports(self, limit=10):
+        """获取字节数最多的前N个目的端口"""
+        if self._uses_pipeline():
+            return self.pipeline.get_summary(limit, 0)['top_ports']
+        return self.state.get_top_ports(limit)
+
+    def _timeseries(self):
+        if self._uses_pipeline():
+            return self.pipeline.timeseries
+        return self.state.timeseries
+    
+    def get_timeseries(self, metric='bytes', resolution=1, count=60):
+        """获取流量时间序列 (时间数组, 数值数组)，用于绘图
+        
+        metric: 'packets'、'bytes'、'packets:TCP'、'bytes:port:443'、'bytes:port:other' 等
+        resolution: 1、10、60或3600秒
+        未安装numpy时返回None
+        """
+        timeseries = self._timeseries()
+        if timeseries is None:
+            return None
+        # 实时监控时以当前时间为终点，空闲期显示为零；离线回放以最后记录的时间为终点
+        end = int(time.time()) - 1 if self.is_monitoring else None
+        return timeseries.get_series(metric, resolution, count, end)
+    
+    def get_rate(self, metric='bytes', resolution=1, window=10):
+        """最近window个桶内指标的平均每秒速率"""
+        timeseries = self._timeseries()
+        if timeseries is None:
+            return 0.0
+        end = int(time.time()) - 1 if self.is_monitoring else None
+        return timeseries.get_rate(metric, resolution, window, end)
+    
+    def _endpoints(self):
+        return self.pipeline.endpoints if self._uses_pipeline() else self.state.endpoints
+    
+    def get_top_talkers(self, limit=10):
+        """获取收发总字节数最多的前N个主机 [(IP, 统计字典)]
+        
+        统计字典含packets_out/bytes_out、packets_in/bytes_in、不同对端数peers、first_seen/last_seen，
+        以及排名依据的估计总字节数estimated_bytes与误差上界error；配置了enricher时另含info（见enrich_ip）
+        """
+        talkers = self._endpoints().top_talkers(limit)
+        if self.enricher is None:
+            return talkers
+        return [(ip, self._enrich_host(data)) for ip, data in talkers]
+    
+    def get_host(self, ip):
+        """获取单个主机的收发统计（格式同get_top_talkers的统计字典），不在端点表中时返回None"""
+        data = self._endpoints().get_host(ip)
+        if data is None or self.enricher is None:
+            return data
+        return self._enrich_host(data)
+    
+    def _dns(self):
+        return self.pipeline.dns if self._uses_pipeline() else self.state.dns
+    
+    def get_top_domains(self, limit=10):
+        """获取查询次数最多的前N个域名 [统计字典]
+        
+        统计字典含queries、responses、nxdomain、failures、qtypes、最近一次应答的addresses与首末时间
+        """
+        return self._dns().top_domains(limit)
+    
+    def get_domain(self, name):
+        """获取单个域名的DNS统计，没有记录时返回None"""
+        return self._dns().get_domain(name)
+    
+    def resolve_ip(self, ip):
+        """根据观察到的DNS应答反查IP对应的域名，没有记录时返回None"""
+        return self._dns().lookup(ip)
+    
+    def get_tcp_statistics(self, limit=10):
+        """获取TCP连接状态统计
+        
+        返回完成的握手数handshakes、RST数resets、当前半开连接总数half_open_connections、
+        半开连接最多的目的地址half_open_by_destination [(IP, 数量)]、
+        平均握手时延最大的服务器slow_servers [(IP, {'samples', 'mean_ms', 'max_ms'})]
+        以及SYN到SYN-ACK时延的直方图handshake_rtt
+        """
+        if self._uses_pipeline():
+            return self.pipeline.get_summary(limit, 0)['tcp']
+        return self.state.get_tcp_statistics(limit)
+    
+    def _sketches(self):
+        if self._uses_pipeline():
+            return self.pipeline.sketches
+        sketches = self.state.sketches
+        if sketches is not None and not self.is_monitoring:
+            # 实时抓包时由抓包线程在秒切换时提交，这里只在离线分析后补提交
+            sketches.commit()
+        return sketches
+    
+    def get_source_spread(self, ip, window_start=None):
+        """某个源在时间窗口内的包数、字节数及访问的不同端口数与不同主机数（草图估计）
+        
+        window_start默认为最近的窗口；未启用草图或窗口不存在时返回None
+        """
+        sketches = self._sketches()
+        return sketches.source_spread(ip, window_start) if sketches is not None else None
+    
+    def get_destination_spread(self, ip, window_start=None):
+        """某个目的地址在时间窗口内的包数、字节数及不同来源数（草图估计）"""
+        sketches = self._sketches()
+        return sketches.destination_spread(ip, window_start) if sketches is not None else None
+    
+    def get_port_spread(self, port, window_start=None):
+        """某个目的端口在时间窗口内的包数、字节数及不同来源数（草图估计）"""
+        sketches = self._sketches()
+        return sketches.port_spread(port, window_start) if sketches is not None else None
+    
+    def get_window_totals(self, window_start=None):
+        """时间窗口内的总包数、字节数及不同源与不同目的数量"""
+        sketches = self._sketches()
+        return sketches.window_totals(window_start) if sketches is not None else None
+    
+    def query_flows(self, start=None, end=None, ip=None, port=None, protocol=None, limit=1000, interface=None):
+        """查询已归档的流记录（需要配置flow_archive）"""
+        if self.flow_archive is None:
+            return []
+        flows = self.flow_archive.query(start, end, ip, port, protocol, limit, interface)
+        if self.enricher is None:
+            return flows
+        return [self._enrich_flow(flow) for flow in flows]
 
 # 示例用法
 if __name__ == "__main__":
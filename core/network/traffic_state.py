@@ -0,0 +1,310 @@
+# 流量统计状态模块
+# 汇集单个分析单元（监控器本身或流水线分片）的数据包历史、流表与计数
+
+import heapq
+import time
+
+from .packet_ring import PacketRing
+from .flow_table import FlowTable
+from .heavy_hitters import make_counter, merge_top
+from .metrics import StageLatency, STAGE_FLOW_UPDATE, STAGE_HISTORY_APPEND, merge_latency
+from .packet_utils import ip_to_int, flags_to_bits, TCP_ACK, TCP_SYN
+from .app_classifier import inspect_payload
+from .sketches import TrafficSketches
+from .endpoint_table import EndpointTable
+from .dns_table import DnsTable, DNS_PORT
+from .tcp_state import TcpTracker, merge_tcp
+
+try:
+    from .timeseries import TrafficTimeSeries
+except ImportError:
+    # 未安装numpy时不记录时间序列
+    TrafficTimeSeries = None
+
+
+ICMP_ECHO_REQUEST = 8
+
+
+def initiates_connection(packet_info, record):
+    """数据包是否为发起连接的事件：新建流的第一个包、不带ACK的TCP SYN或ICMP回显请求
+
+    只有这些事件交给入侵检测；应答方向的包（如DNS服务器回到客户端临时端口的响应）
+    会被按不同目的端口计数而误判为扫描。record为流表update()返回的流记录。
+    """
+    if record is not None and record.count == 1:
+        return True
+    protocol = packet_info['protocol']
+    if protocol == 'TCP':
+        return flags_to_bits(packet_info.get('flags')) & (TCP_SYN | TCP_ACK) == TCP_SYN
+    return protocol == 'ICMP' and packet_info.get('type') == ICMP_ECHO_REQUEST
+
+
+class TrafficState:
+    """一个分析单元的流量状态
+
+    NetworkMonitor在内联模式下直接持有一个实例；流水线模式下每个分片各持有一个，
+    通过summary()导出可序列化的摘要，再由merge_summaries()合并。
+    """
+
+    def __init__(self, max_history=100000, max_flows=100000, flow_idle_timeout=120, flow_sink=None,
+                 topk_exact=False, topk_capacity=1000, export_timeseries=False,
+                 sketch_window=60, sketch_windows=5, export_sketches=False, latency_sample_every=64,
+                 max_hosts=100000, export_endpoints=False, max_domains=10000, export_dns=False):
+        # 在数据包路径上增量维护的累计计数；抽样时按加权系数累计，为估计值
+        self.packet_count = 0
+        self.total_bytes = 0
+        # 实际分析的包数与字节数，以及是否有加权系数大于1的包
+        self.observed_packets = 0
+        self.observed_bytes = 0
+        self.weighted = False
+        # TCP连接状态机：握手时延与按目的地址的半开连接数，被淘汰的流不再计入半开连接
+        self.tcp = TcpTracker()
+        # 双向合并的有界流表，空闲或超量的流被淘汰并交给flow_sink
+        self.flow_table = FlowTable(max_flows, flow_idle_timeout, flow_sink, on_evict=self.tcp.release)
+        # 预分配的列式环形缓冲区，内存占用与流量无关
+        self.packet_history = PacketRing(max_history)
+        # 流式Top-K：按字节数统计的流、源主机与目的端口；
+        # 精确模式下流排名直接取自流表，主机与端口使用不淘汰的精确计数
+        self.topk_exact = topk_exact
+        self.top_flows = None if topk_exact else make_counter(False, topk_capacity)
+        self.top_hosts = make_counter(topk_exact, topk_capacity)
+        self.top_ports = make_counter(topk_exact, topk_capacity)
+        # 各处理阶段的抽样延迟直方图（解析阶段由调用方计时）
+        self.latency = StageLatency(latency_sample_every)
+        # 多分辨率时间序列；export_timeseries为True时（流水线分片）随摘要导出每秒数据
+        self.timeseries = None
+        if TrafficTimeSeries is not None:
+            self.timeseries = TrafficTimeSeries(export_rows=export_timeseries)
+        # 按时间窗口的主机/端口频率与扩散草图，sketch_window为None时关闭
+        self.sketches = None
+        if sketch_window:
+            self.sketches = TrafficSketches(sketch_window, sketch_windows, export_changes=export_sketches)
+        # 按主机的收发统计；export_endpoints为True时（流水线分片）只累计增量随摘要导出
+        self.endpoints = EndpointTable(max_hosts, topk_capacity, export_changes=export_endpoints)
+        # UDP/53上的按域名统计与IP到域名的反查缓存，新建的流用后者标注主机名
+        self.dns = DnsTable(max_domains, export_changes=export_dns)
+        # 离线回放时数据包时间戳与当前时间无关，活跃流按最近一个数据包的时间统计
+        self.offline = False
+
+    def reset(self):
+        """清空所有状态"""
+        self.packet_count = 0
+        self.total_bytes = 0
+        self.observed_packets = 0
+        self.observed_bytes = 0
+        self.weighted = False
+        self.flow_table.clear()
+        self.packet_history.clear()
+        self.latency.clear()
+        if self.top_flows is not None:
+            self.top_flows.clear()
+        self.top_hosts.clear()
+        self.top_ports.clear()
+        if self.timeseries is not None:
+            self.timeseries.clear()
+        if self.sketches is not None:
+            self.sketches.clear()
+        self.endpoints.clear()
+        self.dns.clear()
+        self.tcp.clear()
+
+    def update(self, packet_info, weight=1, frame=None):
+        """记录一条已解析的数据包信息
+
+        weight为抽样时这个包代表的包数：累计计数、时间序列、Top-K与草图按weight加权，
+        数据包历史与流表只记录实际看到的包。
+        frame为数据包的原始字节（载荷位置见packet_info['payload_offset']），
+        用于在流的前几个数据包上识别应用层协议以及解析DNS报文，不提供时两者都不做。
+        """
+        length = packet_info['length']
+        self.observed_packets += 1
+        self.observed_bytes += length
+        if weight != 1:
+            self.weighted = True
+        self.packet_count += weight
+        self.total_bytes += length * weight
+        latency = self.latency
+        if self.observed_packets & latency.sample_mask:
+            self.packet_history.append(packet_info)
+            record = self.flow_table.update(packet_info)
+        else:
+            clock = latency.clock
+            started = clock()
+            self.packet_history.append(packet_info)
+            appended = clock()
+            record = self.flow_table.update(packet_info)
+            latency.record(STAGE_FLOW_UPDATE, clock() - appended)
+            latency.record(STAGE_HISTORY_APPEND, appended - started)
+        if self.timeseries is not None:
+            self.timeseries.add_packet(
+                packet_info['timestamp'], length, packet_info['protocol'], packet_info.get('dport'), weight
+            )
+
+        if record is not None:
+            src = ip_to_int(packet_info['src'])
+            dst = ip_to_int(packet_info['dst'])
+            if record.count == 1:
+                record.hostname = self.dns.lookup(record.dst)
+            if record.inspect and frame is not None:
+                forward = src == record.src and packet_info.get('sport') == record.sport
+                inspect_payload(record, frame, packet_info.get('payload_offset'), forward)
+            if packet_info['protocol'] == 'TCP':
+                self.tcp.update(
+                    record, flags_to_bits(packet_info.get('flags')), packet_info['timestamp'], src,
+                    packet_info.get('sport')
+                )
+            self.endpoints.add_packet(packet_info['timestamp'], packet_info['length'], src, dst, weight)
+            length *= weight
+            if self.top_flows is not None:
+                self.top_flows.update(record.key, length, record)
+            self.top_hosts.update(packet_info['src'], length)
+            dport = packet_info.get('dport')
+            if dport is not None:
+                self.top_ports.update(dport, length)
+            if self.sketches is not None:
+                self.sketches.add_packet(
+                    packet_info['timestamp'], packet_info['length'], src, dst, dport, weight
+                )
+            if frame is not None and packet_info['protocol'] == 'UDP' and (
+                    dport == DNS_PORT or packet_info['sport'] == DNS_PORT):
+                self.observe_dns(packet_info, frame, weight)
+        return record
+
+    def observe_dns(self, packet_info, frame, weight=1):
+        """解析一个UDP/53报文；weight为0时只更新反查缓存（流水线中其他分片广播来的响应）"""
+        offset = packet_info.get('payload_offset')
+        if offset is not None:
+            self.dns.add_packet(packet_info['timestamp'], frame, offset, weight)
+
+    def get_statistics(self):
+        """获取网络流量统计信息，复杂度与流数量无关
+
+        有抽样加权的包时另外给出实际分析的包数与字节数（observed_packets/observed_bytes）。
+        """
+        statistics = {
+            'packet_count': self.packet_count,
+            'flow_count': len(self.flow_table),
+            # 最近10秒内有活动的流
+            'active_flows': self.flow_table.active_flows(self.flow_table.latest if self.offline else None),
+            'total_bytes': self.total_bytes
+        }
+        if self.weighted:
+            statistics['observed_packets'] = self.observed_packets
+            statistics['observed_bytes'] = self.observed_bytes
+        return statistics
+
+    def get_recent_packets(self, limit=100):
+        """获取最近的数据包（按需解码的只读记录视图）"""
+        return self.packet_history.get_recent(limit)
+
+    def get_top_flows(self, limit=10):
+        """获取流量最大的前N个流，返回 [(流名称, 统计字典)]"""
+        if self.top_flows is None:
+            return self.flow_table.get_top_flows(limit)
+
+        flows = []
+        payloads = self.top_flows.payloads
+        for key, estimate, error in self.top_flows.top(limit):
+            record = payloads[key]
+            data = record.to_dict()
+            # 近似模式下排名依据的估计字节数及其误差上界
+            data['estimated_bytes'] = estimate
+            data['error'] = error
+            flows.append((record.label, data))
+        return flows
+
+    def get_top_hosts(self, limit=10):
+        """获取发送字节数最多的前N个源主机 [(IP, 字节数, 误差上界)]"""
+        return self.top_hosts.top(limit)
+
+    def get_top_ports(self, limit=10):
+        """获取字节数最多的前N个目的端口 [(端口, 字节数, 误差上界)]"""
+        return self.top_ports.top(limit)
+
+    def get_top_talkers(self, limit=10):
+        """获取收发总字节数最多的前N个主机 [(IP, 统计字典)]"""
+        return self.endpoints.top_talkers(limit)
+
+    def get_host(self, ip):
+        """获取单个主机的收发统计"""
+        return self.endpoints.get_host(ip)
+
+    def get_top_domains(self, limit=10):
+        """获取查询次数最多的前N个域名"""
+        return self.dns.top_domains(limit)
+
+    def get_tcp_statistics(self, limit=10):
+        """获取TCP握手时延、半开连接最多的目的地址与握手最慢的服务器"""
+        return merge_tcp([self.tcp.export(limit)], limit)
+
+    def summary(self, top_limit=50, recent_limit=100):
+        """导出可跨进程传递的统计摘要"""
+        timeseries_rows = []
+        if self.timeseries is not None and self.timeseries.export_rows:
+            self.timeseries.advance(time.time())
+            timeseries_rows = self.timeseries.drain_rows()
+        sketch_exports = []
+        if self.sketches is not None and self.sketches.export_changes:
+            sketch_exports = self.sketches.drain_export()
+        endpoint_exports = []
+        if self.endpoints.export_changes:
+            endpoint_exports = self.endpoints.drain_export()
+        dns_exports = []
+        if self.dns.export_changes:
+            dns_exports = self.dns.drain_export()
+        return {
+            'timeseries_rows': timeseries_rows,
+            'sketch_exports': sketch_exports,
+            'endpoint_exports': endpoint_exports,
+            'dns_exports': dns_exports,
+            'statistics': self.get_statistics(),
+            'latency': self.latency.export(),
+            'tcp': self.tcp.export(top_limit),
+            'top_flows': self.get_top_flows(top_limit),
+            'top_hosts': self.get_top_hosts(top_limit),
+            'top_ports': self.get_top_ports(top_limit),
+            'recent_packets': self.packet_history.get_recent_dicts(recent_limit)
+        }
+
+
+def merge_summaries(summaries, top_limit=50, recent_limit=100):
+    """合并多个分片的统计摘要
+
+    分片按流哈希划分，各分片的流互不重叠，计数可直接相加。
+    """
+    statistics = {
+        'packet_count': 0,
+        'flow_count': 0,
+        'active_flows': 0,
+        'total_bytes': 0
+    }
+    latency = []
+    tcp = []
+    top_flows = []
+    top_hosts = []
+    top_ports = []
+    recent_packets = []
+
+    for summary in summaries:
+        for key, value in summary['statistics'].items():
+            statistics[key] = statistics.get(key, 0) + value
+        if 'latency' in summary:
+            latency.append(summary['latency'])
+        if 'tcp' in summary:
+            tcp.append(summary['tcp'])
+        top_flows.extend(summary['top_flows'])
+        top_hosts.append(summary['top_hosts'])
+        top_ports.append(summary['top_ports'])
+        recent_packets.extend(summary['recent_packets'])
+
+    recent_packets.sort(key=lambda packet: packet['timestamp'])
+    return {
+        'statistics': statistics,
+        'latency': merge_latency(latency),
+        'tcp': merge_tcp(tcp, top_limit),
+        'top_flows': heapq.nlargest(top_limit, top_flows, key=lambda flow: flow[1]['bytes']),
+        # 同一主机或端口可能出现在多个分片中，按键合并
+        'top_hosts': merge_top(top_hosts, top_limit),
+        'top_ports': merge_top(top_ports, top_limit),
+        'recent_packets': recent_packets[-recent_limit:] if recent_limit else []
+    }
@@ -295,6 +295,10 @@ class MatrixKaliApp:
         # Initialize security module
         network_security.initialize()
         self.log_security_message("Network security module initialized")
+        # Last rendered traffic snapshot version; unchanged snapshots skip redrawing
+        self.rendered_snapshot_version = None
+        self.snapshot_stats_text = ""
+        self.rendered_stats_text = None
         self.update_security_status()
 
     def start_security_monitoring(self):
@@ -340,38 +344,57 @@ class MatrixKaliApp:
             status_text = status['status'].upper()
             self.security_status_var.set(f"STATUS: {status_text}")
             
-            # Update network statistics
-            stats = status['network']
-            stats_text = f"Packet Count: {stats['packet_count']}\n"
-            stats_text += f"Flow Count: {stats['flow_count']}\n"
-            stats_text += f"Active Flows: {stats['active_flows']}\n\n"
+            # Update network statistics from the latest published snapshot
+            snapshot = network_security.get_traffic_snapshot()
+            snapshot_changed = snapshot.version != self.rendered_snapshot_version
+            if snapshot_changed:
+                self.rendered_snapshot_version = snapshot.version
+                stats = snapshot.statistics
+                stats_text = f"Packet Count: {stats['packet_count']}\n"
+                stats_text += f"Flow Count: {stats['flow_count']}\n"
+                stats_text += f"Active Flows: {stats['active_flows']}\n\n"
+                
+                # Update top flows
+                stats_text += "Top 5 Flows:\n"
+                for flow, data in snapshot.top_flows[:5]:
+                    app = data.get('app')
+                    if app:
+                        detail = data.get('app_detail')
+                        flow += f" [{app} {detail}]" if detail else f" [{app}]"
+                    description = network_security.describe_ip(data['dst']) if 'dst' in data else ''
+                    if description:
+                        flow += f" ({description})"
+                    stats_text += f"{flow}: {data['bytes']} bytes\n"
+                self.snapshot_stats_text = stats_text
             
-            # Update top flows
-            top_flows = network_security.get_top_flows(5)
-            stats_text += "Top 5 Flows:\n"
-            for flow, data in top_flows:
-                stats_text += f"{flow}: {data['bytes']} bytes\n"
+            # Capture loss and processing latency change even while the snapshot does not
+            stats_text = self.snapshot_stats_text + self.format_pipeline_metrics(network_security.get_pipeline_metrics())
+            if stats_text != self.rendered_stats_text:
+                self.rendered_stats_text = stats_text
+                self.stats_text.config(state="normal")
+                self.stats_text.delete("1.0", tk.END)
+                self.stats_text.insert("1.0", stats_text)
+                self.stats_text.config(state="disabled")
             
-            self.stats_text.config(state="normal")
-            self.stats_text.delete("1.0", tk.END)
-            self.stats_text.insert("1.0", stats_text)
-            self.stats_text.config(state="disabled")
-            
-            # Update recent packets
-            recent_packets = network_security.get_recent_packets(10)
-            packets_text = ""
-            for packet in recent_packets:
-                packets_text += f"{packet.get('timestamp', 'N/A')} - {packet.get('src', 'N/A')} -> {packet.get('dst', 'N/A')} ({packet.get('protocol', 'N/A')})\n"
-            
-            if packets_text:
-                self.packets_text.config(state="normal")
-                self.packets_text.delete("1.0", tk.END)
-                self.packets_text.insert("1.0", packets_text)
-                self.packets_text.config(state="disabled")
+            if snapshot_changed:
+                # Update recent packets
+                packets_text = ""
+                for packet in snapshot.recent_packets[-10:]:
+                    packets_text += f"{packet.get('timestamp', 'N/A')} - {packet.get('src', 'N/A')} -> {packet.get('dst', 'N/A')} ({packet.get('protocol', 'N/A')})\n"
+                
+                if packets_text:
+                    self.packets_text.config(state="normal")
+                    self.packets_text.delete("1.0", tk.END)
+                    self.packets_text.insert("1.0", packets_text)
+                    self.packets_text.config(state="disabled")
             
             # Update blocked IPs
             blocked_ips = network_security.get_blocked_ips()
-            blocked_text = "\n".join(blocked_ips) if blocked_ips else "No blocked IPs"
+            blocked_lines = []
+            for ip in blocked_ips:
+                description = network_security.describe_ip(ip)
+                blocked_lines.append(f"{ip} ({description})" if description else ip)
+            blocked_text = "\n".join(blocked_lines) if blocked_lines else "No blocked IPs"
             
             self.blocked_ips_text.config(state="normal")
             self.blocked_ips_text.delete("1.0", tk.END)
@@ -381,6 +404,27 @@ class MatrixKaliApp:
         except Exception as e:
             self.log_security_message(f"Error updating status: {str(e)}")
 
+    def format_pipeline_metrics(self, metrics):
+        """格式化抓包丢包与处理延迟指标"""
+        text = "\nCapture:\n"
+        if metrics['kernel_received'] is not None:
+            text += f"Kernel Received: {metrics['kernel_received']}  Dropped: {metrics['kernel_dropped']}\n"
+        text += f"Handled: {metrics['handler_packets']}  Processed: {metrics['processed_packets']}  "
+        text += f"Queue Dropped: {metrics['queue_dropped']}\n"
+        text += f"Loss: {metrics['loss_ratio'] * 100:.2f}%\n"
+        sampling = metrics.get('sampling')
+        if sampling and sampling['sampled']:
+            text += f"Sampling ({sampling['mode']}): 1 in {sampling['rate']}, counts are estimates\n"
+        if metrics.get('blocked_packets'):
+            text += f"Blocked Sources Skipped: {metrics['blocked_packets']}\n"
+        for stage, latency in metrics['latency'].items():
+            if latency['samples']:
+                text += f"{stage}: p50 {latency['p50_us']:.0f}us  p99 {latency['p99_us']:.0f}us  max {latency['max_us']:.0f}us\n"
+        depths = metrics['queue_depths']
+        if depths:
+            text += "Queues: " + ", ".join(f"{name}={value}" for name, value in depths.items()) + "\n"
+        return text
+
     def scan_file(self):
         """扫描文件"""
         file_path = self.scan_path_entry.get()
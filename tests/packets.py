@@ -0,0 +1,117 @@
+# 测试用的数据包构造函数
+
+import socket
+import struct
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_PSH = 0x08
+TCP_ACK = 0x10
+
+
+def tcp_segment(sport, dport, flags=TCP_ACK, payload=b'', seq=0, ack=0):
+    return struct.pack('!HHIIBBHHH', sport, dport, seq, ack, 0x50, flags, 65535, 0, 0) + payload
+
+
+def udp_datagram(sport, dport, payload=b''):
+    return struct.pack('!HHHH', sport, dport, 8 + len(payload), 0) + payload
+
+
+def ipv4_packet(src, dst, proto, body, fragment=0):
+    header = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(body), 1, fragment, 64, proto, 0,
+                         socket.inet_aton(src), socket.inet_aton(dst))
+    return header + body
+
+
+def ethernet_frame(ip_packet, vlan=None):
+    header = b'\x02' * 6 + b'\x04' * 6
+    if vlan is not None:
+        header += struct.pack('!HH', 0x8100, vlan)
+    return header + b'\x08\x00' + ip_packet
+
+
+def tcp_frame(src, dst, sport, dport, flags=TCP_ACK, payload=b'', seq=0, ack=0):
+    return ethernet_frame(ipv4_packet(src, dst, 6, tcp_segment(sport, dport, flags, payload, seq, ack)))
+
+
+def udp_frame(src, dst, sport, dport, payload=b''):
+    return ethernet_frame(ipv4_packet(src, dst, 17, udp_datagram(sport, dport, payload)))
+
+
+def icmp_frame(src, dst, icmp_type=8, code=0):
+    return ethernet_frame(ipv4_packet(src, dst, 1, struct.pack('!BBHHH', icmp_type, code, 0, 1, 1)))
+
+
+def pcap_file(path, packets, linktype=1, byte_order='<', nanoseconds=False):
+    """写入pcap文件，packets为 [(时间戳, 帧)]"""
+    magic = 0xA1B23C4D if nanoseconds else 0xA1B2C3D4
+    scale = 1e9 if nanoseconds else 1e6
+    with open(path, 'wb') as f:
+        f.write(struct.pack(byte_order + 'IHHiIII', magic, 2, 4, 0, 0, 65535, linktype))
+        for timestamp, frame in packets:
+            seconds = int(timestamp)
+            fraction = int(round((timestamp - seconds) * scale))
+            f.write(struct.pack(byte_order + 'IIII', seconds, fraction, len(frame), len(frame)) + frame)
+    return path
+
+
+def _pcapng_block(byte_order, block_type, body):
+    body += b'\x00' * (-len(body) % 4)
+    length = 12 + len(body)
+    return struct.pack(byte_order + 'II', block_type, length) + body + struct.pack(byte_order + 'I', length)
+
+
+def pcapng_section(byte_order='<'):
+    return _pcapng_block(byte_order, 0x0A0D0D0A, struct.pack(byte_order + 'IHHq', 0x1A2B3C4D, 1, 0, -1))
+
+
+def pcapng_interface(linktype=1, byte_order='<', tsresol=None, snaplen=0):
+    body = struct.pack(byte_order + 'HHI', linktype, 0, snaplen)
+    if tsresol is not None:
+        body += struct.pack(byte_order + 'HH', 9, 1) + bytes((tsresol,)) + b'\x00' * 3
+        body += struct.pack(byte_order + 'HH', 0, 0)
+    return _pcapng_block(byte_order, 0x00000001, body)
+
+
+def pcapng_enhanced_packet(frame, ticks, interface=0, byte_order='<'):
+    body = struct.pack(byte_order + 'IIIII', interface, ticks >> 32, ticks & 0xFFFFFFFF, len(frame), len(frame))
+    return _pcapng_block(byte_order, 0x00000006, body + frame)
+
+
+def pcapng_simple_packet(frame, byte_order='<'):
+    return _pcapng_block(byte_order, 0x00000003, struct.pack(byte_order + 'I', len(frame)) + frame)
+
+
+def pcapng_packet(frame, ticks, interface=0, byte_order='<'):
+    body = struct.pack(byte_order + 'HHIIII', interface, 0, ticks >> 32, ticks & 0xFFFFFFFF, len(frame), len(frame))
+    return _pcapng_block(byte_order, 0x00000002, body + frame)
+
+
+def tls_client_hello(server_name=None, session_id=b'', padding=0):
+    """以TLS记录开头的ClientHello，server_name为None时不带SNI扩展；padding为放在SNI之前的填充扩展长度"""
+    extensions = b''
+    if padding:
+        extensions += struct.pack('!HH', 21, padding) + b'\x00' * padding
+    if server_name is not None:
+        name = server_name.encode('ascii')
+        entry = b'\x00' + struct.pack('!H', len(name)) + name
+        extensions += struct.pack('!HHH', 0, len(entry) + 2, len(entry)) + entry
+    body = (b'\x03\x03' + b'\x11' * 32 + bytes((len(session_id),)) + session_id
+            + struct.pack('!H', 2) + b'\x13\x01' + b'\x01\x00' + struct.pack('!H', len(extensions)) + extensions)
+    handshake = b'\x01' + len(body).to_bytes(3, 'big') + body
+    return b'\x16\x03\x01' + struct.pack('!H', len(handshake)) + handshake
+
+
+def dns_name(name):
+    return b''.join(bytes((len(label),)) + label.encode('ascii') for label in name.split('.') if label) + b'\x00'
+
+
+def dns_message(name, qtype=1, response=False, rcode=0, addresses=(), ident=0x1234):
+    """单个问题的DNS报文；addresses为应答中的IPv4地址，名称用指向问题的压缩指针"""
+    flags = (0x8180 if response else 0x0100) | rcode
+    message = struct.pack('!HHHHHH', ident, flags, 1, len(addresses), 0, 0)
+    message += dns_name(name) + struct.pack('!HH', qtype, 1)
+    for address in addresses:
+        message += struct.pack('!HHHIH', 0xC00C, 1, 1, 300, 4) + socket.inet_aton(address)
+    return message
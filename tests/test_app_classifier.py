@@ -0,0 +1,164 @@
+import random
+import unittest
+
+from core.network.app_classifier import (
+    APP_HTTP, APP_SSH, APP_TLS, INSPECT_PACKETS, http_host, ssh_banner, tls_client_hello_sni
+)
+from core.network.fast_capture import decode_frame
+from core.network.traffic_state import TrafficState
+from tests.packets import TCP_ACK, TCP_PSH, TCP_SYN, tcp_frame, tls_client_hello, udp_frame
+
+CLIENT = '10.0.0.1'
+SERVER = '93.184.216.34'
+
+
+class Connection:
+    """按TrafficState.update的方式投递一个TCP连接两个方向的数据包"""
+
+    def __init__(self, dport=443):
+        self.state = TrafficState(max_history=100, sketch_window=0)
+        self.dport = dport
+        self.timestamp = 100.0
+        self.record = None
+
+    def send(self, payload=b'', flags=TCP_ACK | TCP_PSH, reply=False):
+        if reply:
+            frame = tcp_frame(SERVER, CLIENT, self.dport, 40000, flags, payload)
+        else:
+            frame = tcp_frame(CLIENT, SERVER, 40000, self.dport, flags, payload)
+        self.timestamp += 0.01
+        self.record = self.state.update(decode_frame(frame, self.timestamp), 1, frame)
+        return self.record
+
+    def handshake(self):
+        self.send(flags=TCP_SYN)
+        self.send(flags=TCP_SYN | TCP_ACK, reply=True)
+        self.send(flags=TCP_ACK)
+
+
+class TlsClientHelloTest(unittest.TestCase):
+    def test_server_name(self):
+        self.assertEqual(tls_client_hello_sni(tls_client_hello('example.com')), (True, 'example.com'))
+        hello = tls_client_hello('www.example.org', session_id=b'\x42' * 32, padding=100)
+        self.assertEqual(tls_client_hello_sni(hello), (True, 'www.example.org'))
+
+    def test_without_server_name(self):
+        self.assertEqual(tls_client_hello_sni(tls_client_hello()), (True, None))
+
+    def test_every_truncation_asks_for_more_data(self):
+        hello = tls_client_hello('example.com', padding=20)
+        for length in range(len(hello)):
+            self.assertEqual(tls_client_hello_sni(hello[:length]), (False, None))
+
+    def test_malformed_lengths(self):
+        hello = bytearray(tls_client_hello('example.com'))
+        # 扩展总长度（在记录头、握手头、版本、随机数、空session_id、一个密码套件与一个压缩方法之后）
+        # 声明为0：视为不带SNI
+        extensions = 5 + 4 + 2 + 32 + 1 + 4 + 2
+        hello[extensions:extensions + 2] = b'\x00\x00'
+        self.assertEqual(tls_client_hello_sni(bytes(hello)), (True, None))
+        # session_id长度越界
+        hello = bytearray(tls_client_hello('example.com'))
+        hello[43] = 0xFF
+        self.assertEqual(tls_client_hello_sni(bytes(hello)), (False, None))
+
+    def test_random_bytes_never_raise(self):
+        rng = random.Random(3)
+        for _ in range(500):
+            data = b'\x16\x03\x01' + bytes(rng.randrange(256) for _ in range(rng.randrange(200)))
+            complete, name = tls_client_hello_sni(data)
+            self.assertIsInstance(complete, bool)
+
+
+class HeaderParsingTest(unittest.TestCase):
+    def test_http_host(self):
+        self.assertEqual(http_host(b'GET / HTTP/1.1\r\nHost: example.com\r\n\r\n'), 'example.com')
+        self.assertEqual(http_host(b'GET / HTTP/1.1\r\nhOsT:example.com:8080\r\nAccept: */*\r\n\r\n'), 'example.com')
+        self.assertEqual(http_host(b'GET / HTTP/1.1\r\nHost: [2001:db8::1]:8080\r\n\r\n'), '[2001:db8::1]')
+        self.assertEqual(http_host(b'GET / HTTP/1.1\r\nHost: [2001:db8::1]\r\n\r\n'), '[2001:db8::1]')
+        # 请求头结束后的Host不算
+        self.assertEqual(http_host(b'POST / HTTP/1.1\r\nAccept: */*\r\n\r\nHost: body.example'), '')
+        self.assertEqual(http_host(b'GET / HTTP/1.1\r\n' + b'X: y\r\n' * 500 + b'Host: late.example\r\n'), '')
+
+    def test_ssh_banner(self):
+        self.assertEqual(ssh_banner(b'SSH-2.0-OpenSSH_9.6\r\n\x00\x00\x01'), 'SSH-2.0-OpenSSH_9.6')
+        self.assertEqual(ssh_banner(b'SSH-2.0-dropbear\n'), 'SSH-2.0-dropbear')
+        self.assertEqual(ssh_banner(b'SSH-2.0-' + b'x' * 400), 'SSH-2.0-' + 'x' * 247)
+
+
+class InspectPayloadTest(unittest.TestCase):
+    def test_tls_client_hello(self):
+        connection = Connection()
+        connection.handshake()
+        record = connection.send(tls_client_hello('example.com'))
+        self.assertEqual((record.app, record.app_detail, record.inspect), (APP_TLS, 'example.com', 0))
+        self.assertEqual(record.to_dict()['app_detail'], 'example.com')
+
+    def test_segmented_client_hello_is_buffered(self):
+        hello = tls_client_hello('segmented.example', padding=2000)
+        connection = Connection()
+        connection.handshake()
+        record = connection.send(hello[:1400])
+        self.assertIsNone(record.app)
+        self.assertEqual(record.app_buffer, hello[:1400])
+        # 缓存期间响应方向的数据包不拼接
+        connection.send(flags=TCP_ACK, reply=True)
+        record = connection.send(hello[1400:])
+        self.assertEqual((record.app, record.app_detail), (APP_TLS, 'segmented.example'))
+        self.assertIsNone(record.app_buffer)
+
+    def test_unfinished_client_hello_is_still_tls(self):
+        hello = tls_client_hello('never.example', padding=4000)
+        connection = Connection()
+        connection.handshake()
+        for _ in range(INSPECT_PACKETS - 3):
+            record = connection.send(hello[:100])
+        self.assertEqual((record.app, record.app_detail, record.inspect), (APP_TLS, None, 0))
+        self.assertIsNone(record.app_buffer)
+
+    def test_server_hello_without_client_hello(self):
+        connection = Connection()
+        record = connection.send(b'\x16\x03\x03\x00\x04\x02\x00\x00\x00', reply=True)
+        self.assertEqual((record.app, record.app_detail), (APP_TLS, None))
+
+    def test_http_request(self):
+        connection = Connection(80)
+        connection.handshake()
+        record = connection.send(b'GET /index.html HTTP/1.1\r\nHost: example.com:80\r\n\r\n')
+        self.assertEqual((record.app, record.app_detail), (APP_HTTP, 'example.com'))
+
+    def test_http_response_first_waits_for_the_request(self):
+        connection = Connection(80)
+        record = connection.send(b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n', reply=True)
+        self.assertEqual((record.app, record.app_detail), (APP_HTTP, None))
+        self.assertGreater(record.inspect, 0)
+        record = connection.send(b'GET / HTTP/1.1\r\nHost: example.com\r\n\r\n')
+        self.assertEqual((record.app, record.app_detail, record.inspect), (APP_HTTP, 'example.com', 0))
+
+    def test_ssh_banner_from_either_side(self):
+        connection = Connection(22)
+        connection.handshake()
+        record = connection.send(b'SSH-2.0-OpenSSH_9.6 Ubuntu\r\n', reply=True)
+        self.assertEqual((record.app, record.app_detail), (APP_SSH, 'SSH-2.0-OpenSSH_9.6 Ubuntu'))
+
+    def test_unknown_payload_stops_after_the_packet_limit(self):
+        connection = Connection(9000)
+        for _ in range(INSPECT_PACKETS + 2):
+            record = connection.send(b'\x00\x01binary protocol')
+        self.assertEqual((record.app, record.inspect), (None, 0))
+
+    def test_classification_is_not_overwritten(self):
+        connection = Connection(80)
+        connection.send(b'GET / HTTP/1.1\r\nHost: first.example\r\n\r\n')
+        record = connection.send(b'SSH-2.0-OpenSSH_9.6\r\n')
+        self.assertEqual((record.app, record.app_detail), (APP_HTTP, 'first.example'))
+
+    def test_udp_flows_are_not_inspected(self):
+        state = TrafficState(max_history=10, sketch_window=0)
+        frame = udp_frame(CLIENT, SERVER, 40000, 443, b'GET / HTTP/1.1\r\nHost: quic.example\r\n\r\n')
+        record = state.update(decode_frame(frame, 100.0), 1, frame)
+        self.assertEqual((record.app, record.inspect), (None, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import socket
+import struct
+import unittest
+
+from core.network.dns_table import MAX_POINTERS, QTYPE_AAAA, RCODE_NXDOMAIN, DnsTable, parse_dns
+from core.network.fast_capture import decode_frame
+from core.network.traffic_state import TrafficState
+from tests.packets import TCP_SYN, dns_message, dns_name, tcp_frame, udp_frame
+
+HEADER = struct.Struct('!HHHHHH')
+
+
+def response_header(answers):
+    return HEADER.pack(0x1234, 0x8180, 1, answers, 0, 0)
+
+
+def a_record(name, address):
+    """name为压缩后的名称字节"""
+    return name + struct.pack('!HHIH', 1, 1, 300, 4) + socket.inet_aton(address)
+
+
+class ParseDnsTest(unittest.TestCase):
+    def test_query(self):
+        self.assertEqual(parse_dns(dns_message('WWW.Example.com')), (False, 'www.example.com', 1, 0, []))
+
+    def test_response_with_a_and_aaaa_records(self):
+        message = dns_message('example.com', response=True, addresses=['93.184.216.34', '93.184.216.35'])
+        aaaa = struct.pack('!HHHIH', 0xC00C, QTYPE_AAAA, 1, 300, 16) + socket.inet_pton(socket.AF_INET6, '2001:db8::1')
+        message = message[:6] + struct.pack('!H', 3) + message[8:] + aaaa
+        self.assertEqual(parse_dns(message),
+                         (True, 'example.com', 1, 0, ['93.184.216.34', '93.184.216.35', '2001:db8::1']))
+
+    def test_cname_chain_answers_belong_to_the_query_name(self):
+        # www.example.com CNAME cdn.example.net，cdn.example.net A 192.0.2.1
+        question = dns_name('www.example.com') + struct.pack('!HH', 1, 1)
+        cname = dns_name('cdn.example.net')
+        body = question + struct.pack('!HHHIH', 0xC00C, 5, 1, 300, len(cname)) + cname
+        cname_offset = 12 + len(question) + 12
+        body += a_record(struct.pack('!H', 0xC000 | cname_offset), '192.0.2.1')
+        self.assertEqual(parse_dns(response_header(2) + body), (True, 'www.example.com', 1, 0, ['192.0.2.1']))
+
+    def test_nxdomain(self):
+        parsed = parse_dns(dns_message('missing.example', response=True, rcode=RCODE_NXDOMAIN))
+        self.assertEqual(parsed, (True, 'missing.example', 1, RCODE_NXDOMAIN, []))
+
+    def test_pointers_are_relative_to_the_message(self):
+        frame = udp_frame('8.8.8.8', '10.0.0.1', 53, 40000,
+                          dns_message('example.com', response=True, addresses=['192.0.2.7']))
+        offset = decode_frame(frame, 100.0)['payload_offset']
+        self.assertEqual(parse_dns(frame, offset)[4], ['192.0.2.7'])
+
+    def test_compressed_question_name(self):
+        # 问题名称由一个标签加指向报文后部的指针组成
+        tail = dns_name('example.com')
+        question = b'\x03www' + struct.pack('!H', 0xC000 | 12 + 6 + 4) + struct.pack('!HH', 1, 1)
+        message = HEADER.pack(1, 0x0100, 1, 0, 0, 0) + question + tail
+        self.assertEqual(parse_dns(message)[1], 'www.example.com')
+
+    def test_pointer_loops_and_long_chains_are_rejected(self):
+        loop = HEADER.pack(1, 0x0100, 1, 0, 0, 0) + struct.pack('!H', 0xC00C) + struct.pack('!HH', 1, 1)
+        self.assertIsNone(parse_dns(loop))
+
+        def chain(jumps):
+            # 从偏移12开始的一串指针，每个指向下一个，最后是名称
+            pointers = b''.join(struct.pack('!H', 0xC000 | 12 + 2 * (index + 1)) for index in range(jumps))
+            return HEADER.pack(1, 0x0100, 1, 0, 0, 0) + pointers + dns_name('deep.example') + struct.pack('!HH', 1, 1)
+
+        # 查询类型从第一个指针之后读取（读到的是其余指针），这里只检查名称
+        self.assertEqual(parse_dns(chain(MAX_POINTERS))[1], 'deep.example')
+        self.assertIsNone(parse_dns(chain(MAX_POINTERS + 1)))
+
+    def test_truncated_messages(self):
+        message = dns_message('example.com', response=True, addresses=['192.0.2.1', '192.0.2.2'])
+        question_end = 12 + len(dns_name('example.com')) + 4
+        for length in range(len(message)):
+            parsed = parse_dns(message[:length])
+            if length < question_end:
+                self.assertIsNone(parsed)
+            elif parsed is not None:
+                # 应答被截断时只返回完整的地址
+                self.assertIn(parsed[4], ([], ['192.0.2.1']))
+        self.assertIsNone(parse_dns(HEADER.pack(1, 0x0100, 0, 0, 0, 0)))
+
+    def test_label_running_past_the_end(self):
+        message = HEADER.pack(1, 0x0100, 1, 0, 0, 0) + b'\x3fshort'
+        self.assertIsNone(parse_dns(message))
+
+
+class DnsTableTest(unittest.TestCase):
+    def add(self, table, message, timestamp=100.0, weight=1):
+        return table.add_packet(timestamp, message, 0, weight)
+
+    def test_counts_and_reverse_cache(self):
+        table = DnsTable()
+        self.add(table, dns_message('example.com'))
+        self.add(table, dns_message('example.com', qtype=QTYPE_AAAA), 100.5)
+        self.add(table, dns_message('example.com', response=True, addresses=['192.0.2.1']), 101.0)
+        self.add(table, dns_message('missing.example', response=True, rcode=RCODE_NXDOMAIN), 102.0)
+        self.add(table, dns_message('broken.example', response=True, rcode=2), 103.0)
+        domain = table.get_domain('Example.COM.')
+        self.assertEqual((domain['queries'], domain['responses'], domain['qtypes'], domain['addresses']),
+                         (2, 1, ['A', 'AAAA'], ['192.0.2.1']))
+        self.assertEqual((domain['first_seen'], domain['last_seen']), (100.0, 101.0))
+        self.assertEqual(table.get_domain('missing.example')['nxdomain'], 1)
+        self.assertEqual(table.get_domain('broken.example')['failures'], 1)
+        self.assertEqual(table.lookup('192.0.2.1'), 'example.com')
+        self.assertEqual([domain['name'] for domain in table.top_domains(1, 'nxdomain')], ['missing.example'])
+        self.assertIsNone(self.add(table, b'\x00' * 5))
+
+    def test_weight_zero_only_updates_the_cache(self):
+        table = DnsTable()
+        self.add(table, dns_message('example.com', response=True, addresses=['192.0.2.1']), weight=0)
+        self.assertEqual(len(table), 0)
+        self.assertEqual(table.lookup('192.0.2.1'), 'example.com')
+
+    def test_bounded_domains_and_addresses(self):
+        table = DnsTable(max_domains=2, max_addresses=2)
+        for index in range(3):
+            self.add(table, dns_message(f'host{index}.example', response=True, addresses=[f'192.0.2.{index}']))
+        self.assertEqual(len(table), 2)
+        self.assertIsNone(table.get_domain('host0.example'))
+        self.assertIsNone(table.lookup('192.0.2.0'))
+        self.assertEqual(table.lookup('192.0.2.2'), 'host2.example')
+
+    def test_shard_exports_merge(self):
+        shard = DnsTable(export_changes=True)
+        merged = DnsTable()
+        self.add(shard, dns_message('example.com'), 100.0)
+        self.add(shard, dns_message('example.com', response=True, addresses=['192.0.2.1']), 101.0)
+        self.assertEqual(len(shard), 0)
+        merged.merge_export(shard.drain_export())
+        self.add(shard, dns_message('example.com'), 99.0)
+        merged.merge_export(shard.drain_export())
+        domain = merged.get_domain('example.com')
+        self.assertEqual((domain['queries'], domain['responses'], domain['first_seen'], domain['last_seen']),
+                         (2, 1, 99.0, 101.0))
+        self.assertEqual(merged.lookup('192.0.2.1'), 'example.com')
+        self.assertEqual(shard.drain_export(), [])
+
+    def test_flows_are_labelled_with_the_resolved_name(self):
+        state = TrafficState(max_history=10, sketch_window=0)
+        frame = udp_frame('8.8.8.8', '10.0.0.1', 53, 40000,
+                          dns_message('example.com', response=True, addresses=['93.184.216.34']))
+        state.update(decode_frame(frame, 100.0), 1, frame)
+        frame = tcp_frame('10.0.0.1', '93.184.216.34', 40001, 443, TCP_SYN)
+        record = state.update(decode_frame(frame, 100.1), 1, frame)
+        self.assertEqual(record.hostname, 'example.com')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+
+from core.network.endpoint_table import PEER_SET_LIMIT, EndpointRecord, EndpointTable
+from core.network.packet_utils import ip_to_int
+
+A = ip_to_int('10.0.0.1')
+B = ip_to_int('10.0.0.2')
+C = ip_to_int('10.0.0.3')
+
+
+class EndpointRecordTest(unittest.TestCase):
+    def test_peers_switch_to_an_estimate_past_the_limit(self):
+        record = EndpointRecord(A, 100.0)
+        for peer in range(PEER_SET_LIMIT):
+            record.add_peer(peer)
+            record.add_peer(peer)
+        self.assertIsInstance(record.peers, set)
+        self.assertEqual(record.peer_count, PEER_SET_LIMIT)
+        for peer in range(PEER_SET_LIMIT, 1000):
+            record.add_peer(peer)
+        self.assertNotIsInstance(record.peers, set)
+        # 精度8时标准误差约6.5%
+        self.assertAlmostEqual(record.peer_count / 1000, 1.0, delta=0.25)
+
+
+class EndpointTableTest(unittest.TestCase):
+    def test_both_ends_are_counted(self):
+        table = EndpointTable()
+        table.add_packet(100.0, 60, A, B)
+        table.add_packet(101.0, 1500, B, A)
+        table.add_packet(102.0, 100, A, C, weight=4)
+        host = table.get_host('10.0.0.1')
+        self.assertEqual((host['packets_out'], host['bytes_out'], host['packets_in'], host['bytes_in']),
+                         (5, 460, 1, 1500))
+        self.assertEqual((host['peers'], host['first_seen'], host['last_seen']), (2, 100.0, 102.0))
+        self.assertEqual(table.get_host(C)['bytes_in'], 400)
+        self.assertIsNone(table.get_host('10.0.0.9'))
+
+    def test_least_recently_active_host_is_evicted(self):
+        table = EndpointTable(max_hosts=2)
+        table.add_packet(100.0, 60, A, B)
+        table.add_packet(101.0, 60, B, C)
+        self.assertEqual(len(table), 2)
+        self.assertIsNone(table.get_host(A))
+        self.assertEqual(table.evicted_count, 1)
+
+    def test_top_talkers_rank_total_bytes(self):
+        table = EndpointTable(top_capacity=10)
+        table.add_packet(100.0, 1000, A, B)
+        table.add_packet(100.0, 300, C, B)
+        talkers = table.top_talkers(2)
+        self.assertEqual([ip for ip, _ in talkers], ['10.0.0.2', '10.0.0.1'])
+        self.assertEqual((talkers[0][1]['estimated_bytes'], talkers[0][1]['error']), (1300, 0))
+
+    def test_evicted_hosts_keep_their_top_talker_entry(self):
+        table = EndpointTable(max_hosts=2, top_capacity=10)
+        table.add_packet(100.0, 5000, A, B)
+        table.add_packet(101.0, 10, C, B)
+        self.assertIsNone(table.get_host(A))
+        self.assertEqual(dict(table.top_talkers(3))['10.0.0.1']['bytes_out'], 5000)
+
+    def test_clear(self):
+        table = EndpointTable(max_hosts=1)
+        table.add_packet(100.0, 60, A, B)
+        table.clear()
+        self.assertEqual((len(table), table.evicted_count, table.top_talkers()), (0, 0, []))
+
+
+class EndpointExportTest(unittest.TestCase):
+    def test_shard_exports_merge_into_the_same_table(self):
+        single = EndpointTable()
+        shards = [EndpointTable(export_changes=True) for _ in range(2)]
+        merged = EndpointTable()
+        packets = [(100.0 + index, 100 + index, A + index % 3, B + index % 5) for index in range(40)]
+        for index, (timestamp, length, src, dst) in enumerate(packets):
+            single.add_packet(timestamp, length, src, dst)
+            shards[index % 2].add_packet(timestamp, length, src, dst)
+            if index % 7 == 0:
+                for shard in shards:
+                    merged.merge_export(shard.drain_export())
+        for shard in shards:
+            merged.merge_export(shard.drain_export())
+        self.assertEqual(len(shards[0]), 0)
+        self.assertEqual(shards[0].drain_export(), [])
+        self.assertEqual(len(merged), len(single))
+        for ip in single.hosts:
+            self.assertEqual(merged.get_host(ip), single.get_host(ip))
+        self.assertEqual(merged.top_talkers(3), single.top_talkers(3))
+
+    def test_out_of_order_exports_keep_the_earliest_and_latest_times(self):
+        shard = EndpointTable(export_changes=True)
+        merged = EndpointTable()
+        shard.add_packet(200.0, 60, A, B)
+        merged.merge_export(shard.drain_export())
+        shard.add_packet(150.0, 60, A, C)
+        merged.merge_export(shard.drain_export())
+        host = merged.get_host(A)
+        self.assertEqual((host['first_seen'], host['last_seen'], host['peers'], host['packets_out']),
+                         (150.0, 200.0, 2, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import os
+import tempfile
+import unittest
+
+from core.network.enforcement import (
+    Allowlist, BlockEnforcer, IpsetBackend, NftablesBackend, configured_resolvers, create_backend,
+    default_gateways, split_addresses
+)
+from core.network.intrusion_prevention import IntrusionPrevention
+
+
+class SplitAddressesTest(unittest.TestCase):
+    def test_splits_by_version_and_drops_invalid(self):
+        ipv4, ipv6 = split_addresses(['1.2.3.4', '::1', 'bad; drop table', '2001:db8::1'])
+        self.assertEqual(ipv4, ['1.2.3.4'])
+        self.assertEqual(ipv6, ['::1', '2001:db8::1'])
+
+
+class NftablesBackendTest(unittest.TestCase):
+    def test_setup_creates_sets_chains_and_initial_elements(self):
+        backend = NftablesBackend(hooks=('input',), dry_run=True)
+        self.assertTrue(backend.setup(['1.2.3.4', '::2']))
+        self.assertEqual(len(backend.commands), 1)
+        argv, script = backend.commands[0]
+        self.assertEqual(argv, ['nft', '-f', '-'])
+        lines = script.splitlines()
+        self.assertIn('add table inet kali_app', lines)
+        self.assertIn('flush set inet kali_app blocked_v4', lines)
+        self.assertIn('add rule inet kali_app input ip saddr @blocked_v4 drop', lines)
+        self.assertIn('add element inet kali_app blocked_v4 { 1.2.3.4 }', lines)
+        self.assertIn('add element inet kali_app blocked_v6 { ::2 }', lines)
+
+    def test_apply_is_one_transaction_with_chunked_elements(self):
+        backend = NftablesBackend(chunk_size=2, dry_run=True)
+        self.assertTrue(backend.apply(['10.0.0.1', '10.0.0.2', '10.0.0.3'], ['10.0.0.9']))
+        self.assertEqual(len(backend.commands), 1)
+        self.assertEqual(backend.commands[0][1].splitlines(), [
+            'delete element inet kali_app blocked_v4 { 10.0.0.9 }',
+            'add element inet kali_app blocked_v4 { 10.0.0.1, 10.0.0.2 }',
+            'add element inet kali_app blocked_v4 { 10.0.0.3 }',
+        ])
+
+    def test_empty_apply_runs_nothing(self):
+        backend = NftablesBackend(dry_run=True)
+        self.assertTrue(backend.apply([], []))
+        self.assertEqual(backend.commands, [])
+
+    def test_teardown_deletes_table(self):
+        backend = NftablesBackend(dry_run=True)
+        backend.teardown()
+        self.assertEqual(backend.commands, [(['nft', '-f', '-'], 'delete table inet kali_app\n')])
+
+
+class IpsetBackendTest(unittest.TestCase):
+    def test_setup_apply_and_teardown(self):
+        backend = IpsetBackend(dry_run=True)
+        backend.setup(['1.2.3.4'])
+        backend.apply(['5.5.5.5', '::5'], ['1.2.3.4'])
+        backend.teardown()
+        restore = [(argv, script) for argv, script in backend.commands if argv[:3] == ['ipset', '-exist', 'restore']]
+        self.assertEqual(len(restore), 2)
+        self.assertIn('add kali_blocked 1.2.3.4', restore[0][1].splitlines())
+        self.assertEqual(restore[1][1].splitlines(), [
+            'del kali_blocked 1.2.3.4', 'add kali_blocked 5.5.5.5', 'add kali_blocked6 ::5'
+        ])
+        inserted = [argv for argv, _ in backend.commands if argv[1] == '-I']
+        self.assertEqual(len(inserted), 2)
+        self.assertEqual(backend.commands[-1], (['ipset', 'destroy', 'kali_blocked6'], None))
+
+
+class CreateBackendTest(unittest.TestCase):
+    def test_names(self):
+        self.assertTrue(create_backend('dry-run').dry_run)
+        self.assertIsInstance(create_backend('ipset', dry_run=True), IpsetBackend)
+        with self.assertRaises(ValueError):
+            create_backend('pf')
+
+
+class BlockEnforcerTest(unittest.TestCase):
+    def test_burst_becomes_one_update(self):
+        backend = create_backend('dry-run')
+        enforcer = BlockEnforcer(backend, flush_interval=60)
+        enforcer.start(['9.9.9.9'])
+        try:
+            for index in range(10000):
+                enforcer.block(f"10.{index // 65536}.{index // 256 % 256}.{index % 256}")
+            self.assertEqual(enforcer.flush(), 10000)
+        finally:
+            enforcer.stop()
+        # setup、一次批量更新、teardown
+        self.assertEqual(len(backend.commands), 3)
+        self.assertEqual(enforcer.updates, 1)
+        self.assertEqual(enforcer.get_statistics()['applied_changes'], 10000)
+
+    def test_block_then_unblock_in_one_batch_cancels(self):
+        backend = create_backend('dry-run')
+        enforcer = BlockEnforcer(backend, flush_interval=60)
+        enforcer.start()
+        try:
+            enforcer.block('1.1.1.1')
+            enforcer.unblock('1.1.1.1')
+            self.assertEqual(enforcer.flush(), 0)
+            enforcer.block('2.2.2.2')
+            enforcer.flush()
+            enforcer.unblock('2.2.2.2')
+            enforcer.flush()
+        finally:
+            enforcer.stop()
+        scripts = [script for _, script in backend.commands[1:-1]]
+        self.assertEqual(scripts, [
+            'add element inet kali_app blocked_v4 { 2.2.2.2 }\n',
+            'delete element inet kali_app blocked_v4 { 2.2.2.2 }\n',
+        ])
+
+    def test_invalid_address_is_not_queued(self):
+        enforcer = BlockEnforcer(create_backend('dry-run'))
+        enforcer.block('1.2.3.4; flush ruleset')
+        self.assertEqual(enforcer.pending, {})
+
+
+class AllowlistTest(unittest.TestCase):
+    def test_addresses_and_networks(self):
+        allowlist = Allowlist(['8.8.8.8', '192.168.0.0/16', '::1/128', 'nonsense'])
+        self.assertIn('8.8.8.8', allowlist)
+        self.assertIn('192.168.44.1', allowlist)
+        self.assertIn('::1', allowlist)
+        self.assertNotIn('8.8.4.4', allowlist)
+        self.assertNotIn('not an ip', allowlist)
+        self.assertEqual(len(allowlist), 3)
+
+    def test_gateway_and_resolvers_are_read_from_system_files(self):
+        directory = tempfile.mkdtemp()
+        route = os.path.join(directory, 'route')
+        with open(route, 'w') as f:
+            f.write("Iface\tDestination\tGateway\tFlags\n")
+            f.write("eth0\t00000000\t0101A8C0\t0003\n")
+            f.write("eth0\t0001A8C0\t00000000\t0001\n")
+        resolv = os.path.join(directory, 'resolv.conf')
+        with open(resolv, 'w') as f:
+            f.write("# comment\nnameserver 9.9.9.9\nnameserver fe80::1%eth0\nsearch lan\n")
+        self.assertEqual(default_gateways(route), {'192.168.1.1'})
+        self.assertEqual(configured_resolvers(resolv), {'9.9.9.9', 'fe80::1'})
+
+    def test_intrusion_prevention_never_blocks_allowlisted_sources(self):
+        backend = create_backend('dry-run')
+        enforcer = BlockEnforcer(backend)
+        ips = IntrusionPrevention(enforcer=enforcer, allowlist=['8.8.8.8'])
+        # DNS服务器回到客户端临时端口的应答看起来像端口扫描
+        replies = [
+            {'src': '8.8.8.8', 'dst': '10.0.0.5', 'protocol': 'UDP', 'sport': 53, 'dport': 40000 + index,
+             'timestamp': 100 + index * 0.1}
+            for index in range(12)
+        ]
+        self.assertEqual(ips.add_connections(replies), [])
+        self.assertFalse(ips.block_ip('8.8.8.8', 'manual'))
+        self.assertNotIn('8.8.8.8', ips.blocked_ips)
+        self.assertEqual(enforcer.pending, {})
+        self.assertTrue(ips.block_ip('6.6.6.6', 'manual'))
+        self.assertFalse(ips.block_ip('6.6.6.6', 'manual'))
+        self.assertEqual(enforcer.pending, {'6.6.6.6': True})
+
+
+if __name__ == '__main__':
+    unittest.main()
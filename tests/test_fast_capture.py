@@ -0,0 +1,70 @@
+import unittest
+
+from core.network.fast_capture import decode_frame, decode_ipv4
+from tests.packets import (
+    TCP_ACK, TCP_PSH, TCP_SYN, ethernet_frame, icmp_frame, ipv4_packet, tcp_frame, tcp_segment, udp_frame
+)
+
+
+class DecodeFrameTest(unittest.TestCase):
+    def test_tcp(self):
+        frame = tcp_frame('10.0.0.1', '10.0.0.2', 40000, 443, TCP_SYN)
+        info = decode_frame(frame, 100.0)
+        self.assertEqual(info, {
+            'timestamp': 100.0, 'length': len(frame), 'protocol': 'TCP', 'src': '10.0.0.1', 'dst': '10.0.0.2',
+            'sport': 40000, 'dport': 443, 'flags': 'S'
+        })
+
+    def test_tcp_payload_offset(self):
+        frame = tcp_frame('10.0.0.1', '10.0.0.2', 40000, 80, TCP_PSH | TCP_ACK, b'GET / HTTP/1.1\r\n')
+        info = decode_frame(frame, 100.0)
+        self.assertEqual(info['flags'], 'PA')
+        self.assertEqual(frame[info['payload_offset']:], b'GET / HTTP/1.1\r\n')
+
+    def test_udp_and_icmp(self):
+        info = decode_frame(udp_frame('10.0.0.1', '8.8.8.8', 5353, 53, b'\x00' * 12), 1.0)
+        self.assertEqual((info['protocol'], info['sport'], info['dport']), ('UDP', 5353, 53))
+        self.assertIn('payload_offset', info)
+        info = decode_frame(icmp_frame('10.0.0.1', '10.0.0.2', 3, 1), 1.0)
+        self.assertEqual((info['protocol'], info['type'], info['code']), ('ICMP', 3, 1))
+
+    def test_vlan_tag_is_skipped(self):
+        ip_packet = ipv4_packet('10.0.0.1', '10.0.0.2', 6, tcp_segment(1, 22))
+        info = decode_frame(ethernet_frame(ip_packet, vlan=100), 1.0)
+        self.assertEqual((info['protocol'], info['dport']), ('TCP', 22))
+
+    def test_truncated_and_non_ip_frames(self):
+        self.assertEqual(decode_frame(b'\x00' * 10, 1.0)['protocol'], 'Unknown')
+        arp = b'\x02' * 12 + b'\x08\x06' + b'\x00' * 28
+        self.assertEqual(decode_frame(arp, 1.0)['protocol'], 'Unknown')
+        frame = tcp_frame('10.0.0.1', '10.0.0.2', 1, 2)
+        # 截断在TCP首部中间时只保留IP层信息
+        info = decode_frame(frame[:14 + 20 + 8], 1.0)
+        self.assertEqual(info['protocol'], 'IP')
+        self.assertNotIn('sport', info)
+        self.assertEqual(decode_frame(frame[:14 + 12], 1.0)['protocol'], 'Unknown')
+
+    def test_default_timestamp(self):
+        self.assertGreater(decode_frame(b'', None)['timestamp'], 0)
+
+
+class DecodeIpv4Test(unittest.TestCase):
+    def test_later_fragments_have_no_ports(self):
+        packet = ipv4_packet('10.0.0.1', '10.0.0.2', 17, b'\x00' * 16, fragment=10)
+        info = decode_ipv4(packet, 0, {})
+        self.assertEqual(info, {'protocol': 'IP', 'src': '10.0.0.1', 'dst': '10.0.0.2'})
+
+    def test_non_ipv4_version_is_ignored(self):
+        packet = bytearray(ipv4_packet('10.0.0.1', '10.0.0.2', 6, tcp_segment(1, 2)))
+        packet[0] = 0x65
+        self.assertEqual(decode_ipv4(bytes(packet), 0, {}), {})
+
+    def test_zero_total_length_uses_buffer_length(self):
+        packet = bytearray(ipv4_packet('10.0.0.1', '10.0.0.2', 6, tcp_segment(1, 2, payload=b'data')))
+        packet[2:4] = b'\x00\x00'
+        info = decode_ipv4(bytes(packet), 0, {})
+        self.assertEqual(packet[info['payload_offset']:], b'data')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import unittest
+
+from core.network.flow_table import ActivityWheel, FlowRecord, FlowTable, make_flow_key
+from core.network.packet_utils import PROTO_TCP, PROTO_UDP, ip_to_int
+from core.network.traffic_state import TrafficState
+
+
+A = ip_to_int('10.0.0.1')
+B = ip_to_int('10.0.0.2')
+
+
+def packet(src, dst, sport, dport, length=100, timestamp=100.0, protocol='TCP'):
+    return {'src': src, 'dst': dst, 'sport': sport, 'dport': dport, 'protocol': protocol,
+            'length': length, 'timestamp': timestamp}
+
+
+class MakeFlowKeyTest(unittest.TestCase):
+    def test_both_directions_share_a_key(self):
+        forward_key, forward = make_flow_key(PROTO_TCP, A, 40000, B, 443)
+        reverse_key, reverse = make_flow_key(PROTO_TCP, B, 443, A, 40000)
+        self.assertEqual(forward_key, reverse_key)
+        self.assertNotEqual(forward, reverse)
+
+    def test_protocol_and_ports_are_part_of_the_key(self):
+        key = make_flow_key(PROTO_TCP, A, 40000, B, 443)[0]
+        self.assertNotEqual(key, make_flow_key(PROTO_UDP, A, 40000, B, 443)[0])
+        self.assertNotEqual(key, make_flow_key(PROTO_TCP, A, 40001, B, 443)[0])
+
+
+class FlowTableTest(unittest.TestCase):
+    def test_reverse_packets_merge_into_the_initiators_flow(self):
+        table = FlowTable()
+        table.update(packet('10.0.0.1', '10.0.0.2', 40000, 443, 60))
+        record = table.update(packet('10.0.0.2', '10.0.0.1', 443, 40000, 1500, 100.5))
+        self.assertEqual(len(table), 1)
+        self.assertEqual((record.src_ip, record.sport, record.dst_ip, record.dport),
+                         ('10.0.0.1', 40000, '10.0.0.2', 443))
+        self.assertEqual((record.count, record.bytes, record.rev_count, record.rev_bytes), (2, 1560, 1, 1500))
+        self.assertEqual(record.label, '10.0.0.1:40000->10.0.0.2:443')
+        self.assertEqual((record.first_seen, record.last_seen), (100.0, 100.5))
+
+    def test_packets_without_addresses_are_ignored(self):
+        table = FlowTable()
+        self.assertIsNone(table.update({'protocol': 'ARP', 'length': 42, 'timestamp': 100.0}))
+        self.assertEqual(len(table), 0)
+
+    def test_capacity_evicts_least_recently_active_flow_to_sink(self):
+        evicted = []
+        table = FlowTable(max_flows=2, sink=evicted.append)
+        table.update(packet('10.0.0.1', '10.0.0.2', 1, 80))
+        table.update(packet('10.0.0.1', '10.0.0.2', 2, 80))
+        # 第一个流重新活动后，最久未活动的是第二个流
+        table.update(packet('10.0.0.2', '10.0.0.1', 80, 1))
+        table.update(packet('10.0.0.1', '10.0.0.2', 3, 80))
+        self.assertEqual([record.sport for record in evicted], [2])
+        self.assertEqual(sorted(record.sport for record in table), [1, 3])
+        self.assertEqual(table.evicted_count, 1)
+
+    def test_idle_flows_expire(self):
+        evicted = []
+        table = FlowTable(idle_timeout=30, sink=evicted.append)
+        table.update(packet('10.0.0.1', '10.0.0.2', 1, 80, timestamp=100.0))
+        table.update(packet('10.0.0.1', '10.0.0.2', 2, 80, timestamp=120.0))
+        self.assertEqual(table.expire(140.0), 1)
+        self.assertEqual([record.sport for record in evicted], [1])
+        # 数据包路径按expire_interval顺带淘汰
+        table.update(packet('10.0.0.1', '10.0.0.2', 3, 80, timestamp=200.0))
+        self.assertEqual([record.sport for record in table], [3])
+
+    def test_flush_keep_emits_without_removing(self):
+        evicted = []
+        table = FlowTable(sink=evicted.append)
+        table.update(packet('10.0.0.1', '10.0.0.2', 1, 80))
+        table.update(packet('10.0.0.1', '10.0.0.2', 2, 80))
+        table.flush(keep=True)
+        self.assertEqual(len(evicted), 2)
+        self.assertEqual(len(table), 2)
+        table.flush()
+        self.assertEqual(len(evicted), 4)
+        self.assertEqual(len(table), 0)
+
+    def test_sink_errors_do_not_break_the_table(self):
+        def sink(record):
+            raise RuntimeError('disk full')
+        table = FlowTable(max_flows=1, sink=sink)
+        table.update(packet('10.0.0.1', '10.0.0.2', 1, 80))
+        table.update(packet('10.0.0.1', '10.0.0.2', 2, 80))
+        self.assertEqual(len(table), 1)
+
+    def test_top_flows_by_bytes(self):
+        table = FlowTable()
+        table.update(packet('10.0.0.1', '10.0.0.2', 1, 80, 100))
+        table.update(packet('10.0.0.1', '10.0.0.2', 2, 80, 900))
+        top = table.get_top_flows(1)
+        self.assertEqual(top[0][0], '10.0.0.1:2->10.0.0.2:80')
+        self.assertEqual(top[0][1]['bytes'], 900)
+
+
+class ActiveFlowsTest(unittest.TestCase):
+    def test_wheel_counts_each_flow_in_its_last_second(self):
+        wheel = ActivityWheel(10)
+        wheel.add(100.2)
+        wheel.add(105.7)
+        wheel.remove(100.2)
+        wheel.add(108.0)
+        self.assertEqual(wheel.count(109.9), 2)
+        self.assertEqual(wheel.count(115.0), 1)
+        self.assertEqual(wheel.count(118.0), 0)
+
+    def test_active_flows_follow_updates_and_evictions(self):
+        table = FlowTable(max_flows=2, idle_timeout=1000)
+        table.update(packet('10.0.0.1', '10.0.0.2', 1, 80, timestamp=100.0))
+        table.update(packet('10.0.0.1', '10.0.0.2', 2, 80, timestamp=101.0))
+        table.update(packet('10.0.0.1', '10.0.0.2', 1, 80, timestamp=105.0))
+        self.assertEqual(table.active_flows(105.0), 2)
+        self.assertEqual(table.active_flows(112.0), 1)
+        table.update(packet('10.0.0.1', '10.0.0.2', 3, 80, timestamp=106.0))
+        self.assertEqual(table.active_flows(106.0), 2)
+        self.assertEqual(table.latest, 106.0)
+
+    def test_offline_state_counts_against_the_latest_packet(self):
+        state = TrafficState(max_history=10, sketch_window=0)
+        state.update(packet('10.0.0.1', '10.0.0.2', 1, 80, timestamp=1000.0))
+        state.update(packet('10.0.0.1', '10.0.0.2', 2, 80, timestamp=1004.0))
+        # 录制时间远早于当前时间
+        self.assertEqual(state.get_statistics()['active_flows'], 0)
+        state.offline = True
+        self.assertEqual(state.get_statistics()['active_flows'], 2)
+        state.reset()
+        self.assertEqual(state.get_statistics()['active_flows'], 0)
+
+
+class FlowRecordRowTest(unittest.TestCase):
+    def test_row_round_trip(self):
+        table = FlowTable()
+        table.update(packet('10.0.0.1', '10.0.0.2', 40000, 53, 80, protocol='UDP'))
+        record = table.update(packet('10.0.0.2', '10.0.0.1', 53, 40000, 200, 101.0, protocol='UDP'))
+        record.interface = 'eth0'
+        row = record.to_row()
+        self.assertEqual(len(row), len(FlowRecord.ROW_FIELDS))
+        restored = FlowRecord.from_row(row)
+        self.assertEqual(restored.key, record.key)
+        self.assertEqual(restored.to_row(), row)
+        self.assertEqual(restored.to_dict(), record.to_dict())
+
+
+if __name__ == '__main__':
+    unittest.main()
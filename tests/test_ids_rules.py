@@ -0,0 +1,123 @@
+import unittest
+
+from core.network.ids_rules import AGGREGATE_COUNT, AGGREGATE_DISTINCT, RuleEngine, normalize_rule
+from core.network.intrusion_prevention import IntrusionPrevention
+
+
+def observe_all(engine, connections):
+    states = {}
+    alerts = []
+    for timestamp, conn in connections:
+        alerts.extend(engine.observe(conn, timestamp, lambda key, _: states.setdefault(key, {})))
+    return alerts, states
+
+
+class NormalizeRuleTest(unittest.TestCase):
+    def test_legacy_rule_without_pattern_counts_distinct_ports(self):
+        rule = normalize_rule({'name': 'scan', 'threshold': 10, 'time_window': 30})
+        self.assertEqual(rule['window'], 30)
+        self.assertEqual(rule['aggregate'], AGGREGATE_DISTINCT)
+        self.assertEqual(rule['field'], 'dport')
+        self.assertEqual(rule['key'], 'src')
+        self.assertEqual(rule['action'], 'alert')
+        self.assertEqual(rule['match'], {})
+
+    def test_legacy_rule_with_pattern_counts_connections(self):
+        rule = normalize_rule({'name': 'rate', 'threshold': 5, 'pattern': lambda conn: True})
+        self.assertEqual(rule['aggregate'], AGGREGATE_COUNT)
+        self.assertEqual(rule['window'], 10)
+
+    def test_invalid_rules_are_rejected(self):
+        with self.assertRaises(ValueError):
+            normalize_rule({'name': 'bad', 'aggregate': 'sum'})
+        with self.assertRaises(ValueError):
+            normalize_rule({'name': 'bad', 'aggregate': AGGREGATE_DISTINCT, 'field': None})
+        with self.assertRaises(ValueError):
+            normalize_rule({'name': 'bad', 'match': {'dst_port': 22}})
+
+
+class RuleEngineTest(unittest.TestCase):
+    def test_rules_differing_only_in_threshold_share_a_window(self):
+        engine = RuleEngine([
+            {'name': 'ssh-warn', 'match': {'protocol': 'TCP', 'dport': 22}, 'aggregate': 'count', 'threshold': 2},
+            {'name': 'ssh-block', 'match': {'protocol': 'TCP', 'dport': 22}, 'aggregate': 'count',
+             'threshold': 4, 'action': 'block'},
+            {'name': 'web', 'match': {'protocol': 'TCP', 'dport': 80}, 'aggregate': 'count', 'threshold': 2},
+            {'name': 'no-threshold'},
+        ])
+        self.assertEqual(len(engine.groups), 2)
+        self.assertEqual([threshold for threshold, _ in engine.groups[0].thresholds], [2, 4])
+        self.assertEqual(engine.idle_timeout, 10)
+
+    def test_dispatch_by_protocol_and_port(self):
+        engine = RuleEngine([
+            {'name': 'ssh', 'match': {'protocol': 'TCP', 'dport': '22'}, 'aggregate': 'count', 'threshold': 1},
+            {'name': 'high', 'match': {'protocol': 'TCP', 'dport': '1000-65535'}, 'aggregate': 'count',
+             'threshold': 1},
+            {'name': 'udp', 'match': {'protocol': 'UDP'}, 'aggregate': 'count', 'threshold': 1},
+            {'name': 'any', 'aggregate': 'count', 'threshold': 1},
+        ])
+        names = lambda conn: sorted(rule['name'] for group in engine.candidates(conn) for _, rule in group.thresholds)
+        self.assertEqual(names({'protocol': 'TCP', 'dport': 22}), ['any', 'high', 'ssh'])
+        self.assertEqual(names({'protocol': 'UDP', 'dport': 53}), ['any', 'udp'])
+        self.assertEqual(names({'protocol': 'ICMP'}), ['any'])
+        # 区间条件由检查函数而不是分派索引处理
+        high = [group for group in engine.groups if group.thresholds[0][1]['name'] == 'high'][0]
+        self.assertTrue(high.matches({'dport': 8080}))
+        self.assertFalse(high.matches({'dport': 22}))
+
+    def test_thresholds_fire_in_order_and_only_above_the_threshold(self):
+        engine = RuleEngine([
+            {'name': 'warn', 'match': {'dport': 22}, 'aggregate': 'count', 'threshold': 2},
+            {'name': 'block', 'match': {'dport': 22}, 'aggregate': 'count', 'threshold': 3, 'action': 'block'},
+        ])
+        conn = {'src': '10.0.0.1', 'dport': 22}
+        results = []
+        states = {}
+        for index in range(4):
+            alerts = engine.observe(conn, 100 + index, lambda key, _: states.setdefault(key, {}))
+            results.append([(alert['rule'], alert['count']) for alert in alerts])
+        self.assertEqual(results, [[], [], [('warn', 3)], [('warn', 4), ('block', 4)]])
+        self.assertEqual(engine.check(states['10.0.0.1'], 103.5, '10.0.0.1')[1]['action'], 'block')
+        # 窗口滑过后计数归零
+        self.assertEqual(engine.check(states['10.0.0.1'], 200, '10.0.0.1'), [])
+
+    def test_distinct_ports_and_flag_conditions(self):
+        engine = RuleEngine([
+            {'name': 'syn-scan', 'match': {'protocol': 'TCP', 'flags': 'S', 'flags_absent': 'A'},
+             'aggregate': 'distinct', 'field': 'dport', 'threshold': 3},
+        ])
+        connections = [(100, {'src': '1.1.1.1', 'protocol': 'TCP', 'flags': 'SA', 'dport': port})
+                       for port in range(10)]
+        connections += [(101, {'src': '2.2.2.2', 'protocol': 'TCP', 'flags': 'S', 'dport': port % 4})
+                        for port in range(10)]
+        alerts, states = observe_all(engine, connections)
+        self.assertEqual({alert['key'] for alert in alerts}, {'2.2.2.2'})
+        self.assertEqual(max(alert['count'] for alert in alerts), 4)
+        self.assertEqual(set(states), {'2.2.2.2'})
+
+    def test_rules_keyed_by_other_fields(self):
+        engine = RuleEngine([
+            {'name': 'spray', 'match': {'dport': 22}, 'key': 'dst', 'aggregate': 'distinct', 'field': 'src',
+             'threshold': 2},
+        ])
+        connections = [(100, {'src': f'10.0.0.{index}', 'dst': '192.168.1.5', 'dport': 22}) for index in range(3)]
+        alerts, _ = observe_all(engine, connections)
+        self.assertEqual(alerts, [{'rule': 'spray', 'action': 'alert', 'severity': 'medium', 'count': 3,
+                                   'key': ('dst', '192.168.1.5')}])
+
+
+class DefaultRulesTest(unittest.TestCase):
+    def test_connection_rate_counts_new_connections_of_any_protocol(self):
+        ips = IntrusionPrevention(allowlist=[])
+        reasons = []
+        ips.block_listeners.append(lambda ip, reason, timestamp: reasons.append(reason))
+        flood = [{'src': '6.6.6.6', 'dst': '10.0.0.5', 'protocol': 'UDP', 'sport': 10000 + index, 'dport': 53}
+                 for index in range(51)]
+        self.assertEqual(ips.add_connections(flood[:50], [100 + index * 0.05 for index in range(50)]), [])
+        self.assertEqual(ips.add_connections(flood[50:], [102.5]), ['6.6.6.6'])
+        self.assertEqual(reasons, ['连接频率检测'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from core.network.intrusion_prevention import IntrusionPrevention
+
+
+class AlertHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.ips = IntrusionPrevention(allowlist=[], rules=[
+            {'name': 'ssh', 'match': {'dport': 22}, 'aggregate': 'count', 'threshold': 2, 'window': 10},
+            {'name': 'spray', 'match': {'dport': 22}, 'key': 'dst', 'aggregate': 'distinct', 'field': 'src',
+             'threshold': 1, 'window': 10},
+        ])
+
+    def test_alert_only_matches_are_recorded_once_per_window(self):
+        connections = [{'src': '10.0.0.1', 'dst': '10.0.0.9', 'dport': 22} for _ in range(6)]
+        connections.append({'src': '10.0.0.2', 'dst': '10.0.0.9', 'dport': 22})
+        self.assertEqual(self.ips.add_connections(connections, [100 + index * 0.5 for index in range(7)]), [])
+        history = self.ips.get_alert_history()
+        self.assertEqual([(alert['rule'], alert['key'], alert['timestamp']) for alert in history], [
+            ('ssh', '10.0.0.1', 101.0),
+            ('spray', ('dst', '10.0.0.9'), 103.0),
+        ])
+        self.assertEqual(self.ips.blocked_ips, set())
+        # 窗口过后再次超过阈值时重新记录
+        for index in range(3):
+            self.ips.add_connection({'src': '10.0.0.1', 'dst': '10.0.0.9', 'dport': 22}, 112 + index)
+        history = self.ips.get_alert_history(2)
+        self.assertEqual([(alert['rule'], alert['timestamp']) for alert in history], [('spray', 113), ('ssh', 114)])
+        self.assertEqual(self.ips.get_statistics()['alerts'], 4)
+
+    def test_history_is_bounded(self):
+        ips = IntrusionPrevention(allowlist=[], alert_history_size=5, rules=[
+            {'name': 'ssh', 'match': {'dport': 22}, 'aggregate': 'count', 'threshold': 0},
+        ])
+        ips.add_connections([{'src': f'10.0.0.{index}', 'dport': 22} for index in range(20)], [100] * 20)
+        history = ips.get_alert_history(limit=0)
+        self.assertEqual([alert['key'] for alert in history], [f'10.0.0.{index}' for index in range(15, 20)])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from core.network import NetworkSecurity
+from core.network.flow_archive import FlowArchive
+from core.network.ip_enrichment import IpEnricher
+from core.network.pcap_replay import (
+    LINKTYPE_ETHERNET, LINKTYPE_LINUX_SLL, LINKTYPE_LINUX_SLL2, LINKTYPE_RAW, CaptureFileReader,
+    decode_link_frame, list_capture_files
+)
+from core.network.traffic_monitor import NetworkMonitor
+from tests.packets import (
+    TCP_SYN, ipv4_packet, pcap_file, pcapng_enhanced_packet, pcapng_interface, pcapng_packet, pcapng_section,
+    pcapng_simple_packet, tcp_frame, tcp_segment, udp_frame
+)
+
+
+def read_all(path):
+    with CaptureFileReader(path) as reader:
+        return [(bytes(frame), timestamp, linktype) for frame, timestamp, linktype in reader.packets()]
+
+
+class CaptureTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write(self, name, data):
+        with open(self.path(name), 'wb') as f:
+            f.write(data)
+        return self.path(name)
+
+
+class PcapReaderTest(CaptureTestCase):
+    def test_microsecond_little_and_big_endian(self):
+        frames = [(1000.25, tcp_frame('10.0.0.1', '10.0.0.2', 1, 80)),
+                  (1001.5, udp_frame('10.0.0.1', '8.8.8.8', 2, 53))]
+        for order in ('<', '>'):
+            packets = read_all(pcap_file(self.path(f'capture{order == ">"}.pcap'), frames, byte_order=order))
+            self.assertEqual([(timestamp, frame) for frame, timestamp, _ in packets], frames)
+            self.assertEqual({linktype for _, _, linktype in packets}, {LINKTYPE_ETHERNET})
+
+    def test_nanosecond_resolution(self):
+        frame = tcp_frame('10.0.0.1', '10.0.0.2', 1, 80)
+        packets = read_all(pcap_file(self.path('nano.pcap'), [(1000.123456789, frame)], nanoseconds=True))
+        self.assertAlmostEqual(packets[0][1], 1000.123456789, places=6)
+
+    def test_truncated_last_record_is_skipped(self):
+        frames = [(1000.0, tcp_frame('10.0.0.1', '10.0.0.2', 1, 80))] * 2
+        path = pcap_file(self.path('cut.pcap'), frames)
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 10)
+        self.assertEqual(len(read_all(path)), 1)
+
+    def test_empty_and_unknown_files(self):
+        self.assertEqual(read_all(self.write('empty.pcap', b'')), [])
+        with self.assertRaises(ValueError):
+            CaptureFileReader(self.write('text.pcap', b'not a capture file')).close()
+
+
+class PcapngReaderTest(CaptureTestCase):
+    def test_block_types_and_interfaces(self):
+        ethernet = tcp_frame('10.0.0.1', '10.0.0.2', 1, 80)
+        raw = ipv4_packet('10.0.0.3', '10.0.0.4', 6, tcp_segment(2, 443))
+        data = (pcapng_section() + pcapng_interface(LINKTYPE_ETHERNET) + pcapng_interface(LINKTYPE_RAW, tsresol=9)
+                + pcapng_enhanced_packet(ethernet, 1500250000)
+                + pcapng_enhanced_packet(raw, 1500000000123, interface=1)
+                + pcapng_packet(ethernet, 1501000000)
+                + pcapng_simple_packet(ethernet)
+                # 未定义的接口编号被跳过
+                + pcapng_enhanced_packet(ethernet, 1, interface=5))
+        packets = read_all(self.write('capture.pcapng', data))
+        self.assertEqual(packets, [
+            (ethernet, 1500.25, LINKTYPE_ETHERNET),
+            (raw, 1500.000000123, LINKTYPE_RAW),
+            (ethernet, 1501.0, LINKTYPE_ETHERNET),
+            (ethernet, 0.0, LINKTYPE_ETHERNET),
+        ])
+
+    def test_big_endian_section_and_binary_tsresol(self):
+        frame = udp_frame('10.0.0.1', '8.8.8.8', 2, 53)
+        data = (pcapng_section('>') + pcapng_interface(byte_order='>', tsresol=0x80 | 10)
+                + pcapng_enhanced_packet(frame, 1024 * 1000 + 512, byte_order='>'))
+        self.assertEqual(read_all(self.write('big.pcapng', data)), [(frame, 1000.5, LINKTYPE_ETHERNET)])
+
+    def test_new_section_resets_byte_order_and_interfaces(self):
+        frame = tcp_frame('10.0.0.1', '10.0.0.2', 1, 80)
+        data = (pcapng_section('<') + pcapng_interface(LINKTYPE_RAW) + pcapng_enhanced_packet(frame[14:], 1000000)
+                + pcapng_section('>') + pcapng_interface(LINKTYPE_ETHERNET, byte_order='>')
+                + pcapng_enhanced_packet(frame, 2000000, byte_order='>'))
+        self.assertEqual(read_all(self.write('sections.pcapng', data)), [
+            (frame[14:], 1.0, LINKTYPE_RAW), (frame, 2.0, LINKTYPE_ETHERNET)
+        ])
+
+    def test_simple_packet_respects_snaplen(self):
+        frame = tcp_frame('10.0.0.1', '10.0.0.2', 1, 80, payload=b'x' * 100)
+        data = pcapng_section() + pcapng_interface(snaplen=60) + pcapng_simple_packet(frame)
+        self.assertEqual(read_all(self.write('snap.pcapng', data))[0][0], frame[:60])
+
+    def test_corrupt_block_length_stops_reading(self):
+        frame = tcp_frame('10.0.0.1', '10.0.0.2', 1, 80)
+        block = bytearray(pcapng_enhanced_packet(frame, 1000000))
+        block[4:8] = struct.pack('<I', 8)
+        data = pcapng_section() + pcapng_interface() + pcapng_enhanced_packet(frame, 1000000) + bytes(block)
+        self.assertEqual(len(read_all(self.write('corrupt.pcapng', data))), 1)
+
+
+class DecodeLinkFrameTest(unittest.TestCase):
+    def setUp(self):
+        self.packet = ipv4_packet('10.0.0.1', '10.0.0.2', 6, tcp_segment(40000, 22, TCP_SYN))
+
+    def assertDecoded(self, info):
+        self.assertEqual((info['protocol'], info['src'], info['dst'], info['sport'], info['dport'], info['flags']),
+                         ('TCP', '10.0.0.1', '10.0.0.2', 40000, 22, 'S'))
+
+    def test_ethernet_and_raw(self):
+        self.assertDecoded(decode_link_frame(b'\x02' * 12 + b'\x08\x00' + self.packet, LINKTYPE_ETHERNET, 1.0))
+        self.assertDecoded(decode_link_frame(self.packet, LINKTYPE_RAW, 1.0))
+        self.assertDecoded(decode_link_frame(self.packet, 12, 1.0))
+
+    def test_linux_cooked_captures(self):
+        sll = struct.pack('!HHH8sH', 0, 1, 6, b'\x02' * 8, 0x0800)
+        self.assertDecoded(decode_link_frame(sll + self.packet, LINKTYPE_LINUX_SLL, 1.0))
+        sll2 = struct.pack('!HHIHBB8s', 0x0800, 0, 2, 1, 0, 6, b'\x02' * 8)
+        info = decode_link_frame(sll2 + self.packet, LINKTYPE_LINUX_SLL2, 2.0)
+        self.assertDecoded(info)
+        self.assertEqual((info['timestamp'], info['length']), (2.0, 20 + len(self.packet)))
+
+    def test_non_ip_and_short_frames(self):
+        sll = struct.pack('!HHH8sH', 0, 1, 6, b'\x02' * 8, 0x0806)
+        self.assertEqual(decode_link_frame(sll + b'\x00' * 28, LINKTYPE_LINUX_SLL, 1.0)['protocol'], 'Unknown')
+        self.assertEqual(decode_link_frame(b'\x08\x00', LINKTYPE_LINUX_SLL2, 1.0)['protocol'], 'Unknown')
+        self.assertEqual(decode_link_frame(self.packet, 147, 1.0)['protocol'], 'Unknown')
+
+
+class ListCaptureFilesTest(CaptureTestCase):
+    def test_rotated_files_are_ordered_by_first_packet(self):
+        frame = tcp_frame('10.0.0.1', '10.0.0.2', 1, 80)
+        pcap_file(self.path('capture.pcap2'), [(3000.0, frame)])
+        pcap_file(self.path('capture.pcap10'), [(1000.0, frame)])
+        pcap_file(self.path('capture.pcap'), [(2000.0, frame)])
+        self.write('capture.pcapng', pcapng_section() + pcapng_interface() + pcapng_enhanced_packet(frame, 500000000))
+        self.write('notes.txt', b'ignored')
+        self.write('broken.pcap', b'garbage!')
+        self.assertEqual([os.path.basename(path) for path in list_capture_files(self.directory)],
+                         ['capture.pcapng', 'capture.pcap10', 'capture.pcap', 'capture.pcap2'])
+
+    def test_ties_and_empty_files_use_natural_name_order(self):
+        frame = tcp_frame('10.0.0.1', '10.0.0.2', 1, 80)
+        for name in ('part10.pcap', 'part2.pcap', 'part1.pcap'):
+            pcap_file(self.path(name), [(1000.0, frame)])
+        pcap_file(self.path('empty.pcap'), [])
+        self.assertEqual([os.path.basename(path) for path in list_capture_files(self.directory)],
+                         ['part1.pcap', 'part2.pcap', 'part10.pcap', 'empty.pcap'])
+
+    def test_single_file_path(self):
+        self.assertEqual(list_capture_files('/tmp/one.pcap'), ['/tmp/one.pcap'])
+
+
+class ReplayTest(CaptureTestCase):
+    def test_replay_directory_through_the_monitor(self):
+        frame = tcp_frame('10.0.0.1', '10.0.0.2', 40000, 80, TCP_SYN)
+        pcap_file(self.path('a.pcap'), [(1000.0, frame)] * 3)
+        pcap_file(self.path('b.pcap'), [(1001.0, udp_frame('10.0.0.1', '8.8.8.8', 5000, 53))] * 2)
+        monitor = NetworkMonitor(max_history=100)
+        report = monitor.replay(self.directory)
+        self.assertEqual((report['files'], report['packets']), (2, 5))
+        self.assertEqual(set(report['stage_seconds']), {'read', 'decode', 'analyze', 'intrusion'})
+        self.assertNotIn('alerts', report)
+        statistics = monitor.get_statistics()
+        self.assertEqual((statistics['packet_count'], statistics['flow_count'], statistics['active_flows']), (5, 2, 2))
+
+
+class ReplayIsolationTest(CaptureTestCase):
+    def test_replay_does_not_touch_live_intrusion_prevention(self):
+        scan = [(1000 + index * 0.01, tcp_frame('6.6.6.6', '10.0.0.5', 50000, 1000 + index, TCP_SYN))
+                for index in range(30)]
+        path = pcap_file(self.path('incident.pcap'), scan)
+        security = NetworkSecurity(enforcement='dry-run')
+        security.traffic_monitor.set_flow_archive(FlowArchive(os.path.join(self.directory, 'flows')))
+        security.traffic_monitor.enricher = IpEnricher()
+        frozen = []
+        security.intrusion_prevention.block_listeners.append(lambda *args: frozen.append(args))
+
+        for _ in range(2):
+            report = security.replay_capture(path)
+            self.assertEqual(report['packets'], 30)
+            self.assertEqual(report['blocked_ips'], ['6.6.6.6'])
+            self.assertEqual([alert['rule'] for alert in report['alerts']], ['端口扫描检测'])
+
+        live = security.intrusion_prevention
+        self.assertEqual(live.blocked_ips, set())
+        self.assertEqual(len(live.sources), 0)
+        self.assertEqual(live.enforcer.pending, {})
+        self.assertEqual(frozen, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
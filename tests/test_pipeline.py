@@ -0,0 +1,133 @@
+import queue
+import time
+import unittest
+
+from core.network.pipeline import AnalysisPipeline, flow_shard, is_dns_response
+from core.network.traffic_state import TrafficState, merge_summaries
+from core.network.fast_capture import decode_frame
+from tests.packets import TCP_ACK, TCP_SYN, tcp_frame, udp_frame
+
+DNS_RESPONSE = b'\x12\x34\x81\x80' + b'\x00' * 8
+
+
+def fake_capture(pipeline, frames, start=100.0):
+    """按抓包线程的方式逐帧投递"""
+    for index, frame in enumerate(frames):
+        pipeline.submit(frame, start + index * 0.001)
+
+
+class FlowShardTest(unittest.TestCase):
+    def test_both_directions_land_on_one_shard(self):
+        for index in range(50):
+            client = f'10.0.{index}.{index * 3 % 256}'
+            forward = tcp_frame(client, '192.168.1.1', 40000 + index, 443)
+            reverse = tcp_frame('192.168.1.1', client, 443, 40000 + index)
+            for shards in (2, 3, 8):
+                self.assertEqual(flow_shard(forward, shards), flow_shard(reverse, shards))
+
+    def test_non_ip_frames_go_to_the_first_shard(self):
+        self.assertEqual(flow_shard(b'\x00' * 12 + b'\x08\x06' + b'\x00' * 28, 4), 0)
+        self.assertEqual(flow_shard(b'\x00' * 20, 4), 0)
+        self.assertEqual(flow_shard(tcp_frame('10.0.0.1', '10.0.0.3', 1, 2), 1), 0)
+
+    def test_dns_response_detection(self):
+        self.assertTrue(is_dns_response(udp_frame('8.8.8.8', '10.0.0.1', 53, 40000, DNS_RESPONSE)))
+        self.assertFalse(is_dns_response(udp_frame('10.0.0.1', '8.8.8.8', 40000, 53, DNS_RESPONSE)))
+        self.assertFalse(is_dns_response(tcp_frame('8.8.8.8', '10.0.0.1', 53, 40000, payload=DNS_RESPONSE)))
+
+
+class SubmitTest(unittest.TestCase):
+    def make_pipeline(self, **options):
+        # 不启动工作单元，直接检查投递到各分片队列的批次
+        pipeline = AnalysisPipeline(num_workers=2, flush_interval=3600, **options)
+        pipeline.queues = [queue.Queue(pipeline.queue_size) for _ in range(2)]
+        pipeline._pending = [[], []]
+        pipeline._last_flush = time.monotonic()
+        return pipeline
+
+    def test_dns_responses_are_copied_to_other_shards_with_weight_zero(self):
+        pipeline = self.make_pipeline()
+        frame = udp_frame('8.8.8.8', '10.0.0.1', 53, 40000, DNS_RESPONSE)
+        shard = flow_shard(frame, 2)
+        pipeline.submit(frame, 100.0)
+        pipeline.flush()
+        self.assertEqual(pipeline.queues[shard].get_nowait(), [(frame, 100.0, None, 1)])
+        self.assertEqual(pipeline.queues[1 - shard].get_nowait(), [(frame, 100.0, None, 0)])
+        self.assertEqual(pipeline.submitted_packets, 1)
+
+    def test_full_queue_drops_whole_batches_without_counting_dns_copies(self):
+        pipeline = self.make_pipeline(batch_size=2, queue_size=1)
+        frames = [tcp_frame('10.0.0.1', '10.0.0.2', 1000 + index, 80) for index in range(6)]
+        fake_capture(pipeline, frames)
+        shard = flow_shard(frames[0], 2)
+        self.assertEqual(pipeline.queues[shard].qsize(), 1)
+        self.assertEqual(pipeline.dropped_packets, 4)
+        # 另一个分片的队列已满时，只含DNS副本的批次被丢弃不算丢包
+        other = 1 - shard
+        pipeline.queues[other].put_nowait([])
+        dns = udp_frame('10.0.0.1', '10.0.0.2', 53, 40000, DNS_RESPONSE)
+        self.assertEqual(flow_shard(dns, 2), shard)
+        pipeline.submit(dns, 101.0)
+        pipeline.flush()
+        self.assertEqual(pipeline.dropped_packets, 5)
+
+
+class ThreadPipelineTest(unittest.TestCase):
+    def test_fake_capture_through_thread_workers(self):
+        pipeline = AnalysisPipeline(num_workers=3, batch_size=8, publish_interval=0.05,
+                                    state_options={'sketch_window': 0})
+        connections = []
+        pipeline.connection_sink = connections.extend
+        frames = []
+        for index in range(20):
+            client = f'10.0.0.{index + 1}'
+            frames.append(tcp_frame(client, '192.168.1.1', 40000, 80, TCP_SYN))
+            frames.append(tcp_frame('192.168.1.1', client, 80, 40000, TCP_SYN | TCP_ACK))
+            frames.append(tcp_frame(client, '192.168.1.1', 40000, 80, TCP_ACK, b'x' * 100))
+        frames.append(udp_frame('8.8.8.8', '10.0.0.1', 53, 40000, DNS_RESPONSE))
+        pipeline.start()
+        try:
+            fake_capture(pipeline, frames)
+        finally:
+            pipeline.stop()
+        summary = pipeline.get_summary(5, 10)
+        statistics = summary['statistics']
+        self.assertEqual(statistics['packet_count'], 61)
+        # 每个TCP连接的两个方向合并为一个流，另有一个DNS流
+        self.assertEqual(statistics['flow_count'], 21)
+        self.assertEqual(statistics['total_bytes'], sum(len(frame) for frame in frames))
+        self.assertEqual(len(summary['top_flows']), 5)
+        self.assertEqual(len(summary['recent_packets']), 10)
+        self.assertEqual(pipeline.dropped_packets, 0)
+        # 只有发起连接的包交给入侵检测
+        self.assertEqual(sorted(conn['src'] for conn in connections if conn['protocol'] == 'TCP'),
+                         sorted(f'10.0.0.{index + 1}' for index in range(20)))
+
+
+class MergeSummariesTest(unittest.TestCase):
+    def test_counts_add_and_rankings_merge(self):
+        summaries = []
+        for shard, clients in enumerate((['10.0.0.1', '10.0.0.2'], ['10.0.0.3'])):
+            state = TrafficState(max_history=100, sketch_window=0)
+            for index, client in enumerate(clients):
+                frame = tcp_frame(client, '192.168.1.1', 40000, 443, payload=b'x' * (100 * (index + 2 * shard + 1)))
+                info = decode_frame(frame, 100.0 + shard + index)
+                state.update(info, 1, frame)
+            summaries.append(state.summary(10, 10))
+        merged = merge_summaries(summaries, top_limit=2, recent_limit=2)
+        self.assertEqual(merged['statistics']['packet_count'], 3)
+        self.assertEqual(merged['statistics']['flow_count'], 3)
+        self.assertEqual([flow[1]['src'] for flow in merged['top_flows']], ['10.0.0.3', '10.0.0.2'])
+        # 目的端口443在两个分片中都有，按键相加
+        self.assertEqual(merged['top_ports'][0][0], 443)
+        self.assertEqual([packet['timestamp'] for packet in merged['recent_packets']], [101.0, 101.0])
+        self.assertEqual(merged['recent_packets'][-1]['src'], '10.0.0.3')
+
+    def test_empty(self):
+        merged = merge_summaries([])
+        self.assertEqual(merged['statistics']['packet_count'], 0)
+        self.assertEqual(merged['top_flows'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import time
+import unittest
+
+from core.network.fast_capture import decode_frame
+from core.network.sampling import SAMPLE_COUNT, SAMPLE_FLOW, AdaptiveSampler, frame_flow_hash
+from core.network.traffic_state import TrafficState
+from tests.packets import ethernet_frame, ipv4_packet, tcp_frame, udp_frame
+
+
+class Load:
+    """可控的负载输入：(队列填充率, 累计丢包数)"""
+
+    def __init__(self):
+        self.fill = 0.0
+        self.dropped = 0
+
+    def __call__(self):
+        return self.fill, self.dropped
+
+
+def make_sampler(mode=SAMPLE_COUNT, **options):
+    # CPU预算设得很高，升降只取决于load
+    load = Load()
+    sampler = AdaptiveSampler(mode, cpu_budget=100.0, adjust_interval=3600, load=load, **options)
+    sampler.adjust()
+    return sampler, load
+
+
+def adjust(sampler):
+    time.sleep(0.001)
+    sampler.adjust()
+
+
+def set_rate(sampler, load, rate):
+    load.fill = 1.0
+    while sampler.rate < rate:
+        adjust(sampler)
+    # 介于两个阈值之间，之后admit()触发的评估不再改变N
+    load.fill = 0.3
+
+
+class FrameFlowHashTest(unittest.TestCase):
+    def test_symmetric_and_port_sensitive(self):
+        forward = tcp_frame('10.0.0.1', '10.0.0.2', 40000, 443)
+        reverse = tcp_frame('10.0.0.2', '10.0.0.1', 443, 40000)
+        self.assertEqual(frame_flow_hash(forward), frame_flow_hash(reverse))
+        self.assertNotEqual(frame_flow_hash(forward), frame_flow_hash(tcp_frame('10.0.0.1', '10.0.0.2', 40001, 443)))
+        self.assertNotEqual(frame_flow_hash(forward), frame_flow_hash(udp_frame('10.0.0.1', '10.0.0.2', 40000, 443)))
+
+    def test_frames_without_a_flow_key(self):
+        self.assertIsNone(frame_flow_hash(b'\x00' * 12 + b'\x08\x06' + b'\x00' * 28))
+        self.assertIsNone(frame_flow_hash(ethernet_frame(ipv4_packet('10.0.0.1', '10.0.0.2', 6, b''), vlan=5)))
+        self.assertIsNone(frame_flow_hash(b'\x00' * 20))
+
+
+class AdaptiveSamplerTest(unittest.TestCase):
+    def test_options(self):
+        with self.assertRaises(ValueError):
+            AdaptiveSampler('random')
+        self.assertEqual(AdaptiveSampler(max_rate=1000).max_rate, 512)
+        self.assertEqual(AdaptiveSampler(max_rate=0).max_rate, 1)
+
+    def test_unsampled_until_overloaded(self):
+        sampler, _ = make_sampler()
+        frame = tcp_frame('10.0.0.1', '10.0.0.2', 1, 80)
+        self.assertEqual([sampler.admit(frame, 100.0) for _ in range(5)], [1] * 5)
+        self.assertFalse(sampler.get_statistics()['sampled'])
+
+    def test_rate_doubles_under_load_and_halves_when_idle(self):
+        sampler, load = make_sampler(max_rate=4)
+        load.fill = 0.9
+        adjust(sampler)
+        self.assertEqual(sampler.rate, 2)
+        load.fill = 0.3
+        # 填充率介于两个阈值之间时保持不变
+        adjust(sampler)
+        self.assertEqual(sampler.rate, 2)
+        load.dropped = 10
+        adjust(sampler)
+        adjust(sampler)
+        # 丢包只在计数增加时触发一次，随后受max_rate限制
+        self.assertEqual(sampler.rate, 4)
+        load.fill = 0.9
+        adjust(sampler)
+        self.assertEqual(sampler.rate, 4)
+        load.fill = 0.0
+        adjust(sampler)
+        adjust(sampler)
+        adjust(sampler)
+        self.assertEqual(sampler.rate, 1)
+        statistics = sampler.get_statistics()
+        self.assertTrue(statistics['sampled'])
+        self.assertEqual(statistics['adjustments'], 4)
+
+    def test_cpu_budget_raises_the_rate(self):
+        sampler = AdaptiveSampler(cpu_budget=0.0, load=lambda: (0.0, 0))
+        sampler.adjust()
+        sum(range(100000))
+        sampler.adjust()
+        self.assertEqual(sampler.rate, 2)
+
+    def test_count_mode_keeps_one_in_n_with_weight_n(self):
+        sampler, load = make_sampler()
+        set_rate(sampler, load, 8)
+        frame = tcp_frame('10.0.0.1', '10.0.0.2', 1, 80)
+        weights = [sampler.admit(frame, 100.0) for _ in range(800)]
+        self.assertEqual(sum(weights), 800)
+        self.assertEqual(weights[:8], [0] * 7 + [8])
+        statistics = sampler.get_statistics()
+        self.assertEqual((statistics['offered_packets'], statistics['kept_packets']), (800, 100))
+
+    def test_flow_mode_keeps_whole_flows_and_nests_when_rate_doubles(self):
+        sampler, load = make_sampler(SAMPLE_FLOW)
+        clients = [f'10.0.{index // 256}.{index % 256}' for index in range(2000)]
+
+        def kept(rate):
+            set_rate(sampler, load, rate)
+            result = set()
+            for index, client in enumerate(clients):
+                weight = sampler.admit(tcp_frame(client, '192.168.1.1', 40000, 443), 100.0)
+                # 同一流反方向的包得到相同结果
+                self.assertEqual(sampler.admit(tcp_frame('192.168.1.1', client, 443, 40000), 100.0), weight)
+                if weight:
+                    self.assertEqual(weight, rate)
+                    result.add(index)
+            return result
+
+        quarter = kept(4)
+        eighth = kept(8)
+        self.assertAlmostEqual(len(quarter) / 500, 1.0, delta=0.25)
+        self.assertTrue(eighth <= quarter)
+        self.assertAlmostEqual(len(eighth) / 250, 1.0, delta=0.3)
+
+    def test_flow_mode_counts_frames_without_a_flow_key(self):
+        sampler, load = make_sampler(SAMPLE_FLOW)
+        set_rate(sampler, load, 4)
+        arp = b'\x00' * 12 + b'\x08\x06' + b'\x00' * 28
+        self.assertEqual([sampler.admit(arp, 100.0) for _ in range(8)], [0, 0, 0, 4] * 2)
+
+    def test_wrap_passes_the_weight(self):
+        sampler, load = make_sampler()
+        set_rate(sampler, load, 2)
+        calls = []
+        handle = sampler.wrap(lambda *args: calls.append(args))
+        frame = udp_frame('10.0.0.1', '8.8.8.8', 5000, 53)
+        for _ in range(4):
+            handle(frame, 100.0, 'eth0')
+        self.assertEqual(calls, [(frame, 100.0, 'eth0', 2)] * 2)
+
+    def test_reset(self):
+        sampler, load = make_sampler()
+        set_rate(sampler, load, 4)
+        sampler.reset()
+        self.assertEqual((sampler.rate, sampler.sampled, sampler.adjustments), (1, False, 0))
+
+
+class WeightedStateTest(unittest.TestCase):
+    def test_weighted_counts_are_estimates(self):
+        state = TrafficState(max_history=10, sketch_window=0)
+        frame = tcp_frame('10.0.0.1', '10.0.0.2', 40000, 80, payload=b'x' * 46)
+        state.update(decode_frame(frame, 100.0), 4, frame)
+        state.update(decode_frame(frame, 100.5), 4, frame)
+        statistics = state.get_statistics()
+        self.assertEqual((statistics['packet_count'], statistics['total_bytes']), (8, 8 * len(frame)))
+        self.assertEqual((statistics['observed_packets'], statistics['observed_bytes']), (2, 2 * len(frame)))
+        self.assertEqual(len(state.get_recent_packets(10)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import random
+import unittest
+
+from core.network.packet_utils import ip_to_int
+from core.network.sketches import CountMinSketch, HyperLogLog, TrafficSketches, VirtualHyperLogLog, mix_hash
+
+
+class HyperLogLogTest(unittest.TestCase):
+    def test_estimates_within_expected_error(self):
+        for count in (10, 1000, 100000):
+            hll = HyperLogLog(12)
+            for value in range(count):
+                hll.add(value)
+                hll.add(value)
+            # 精度12时标准误差约1.6%
+            self.assertAlmostEqual(hll.count() / count, 1.0, delta=0.06)
+
+    def test_empty(self):
+        self.assertEqual(HyperLogLog(10).count(), 0.0)
+
+    def test_merged_changes_equal_the_union(self):
+        left = HyperLogLog(10, track_changes=True)
+        right = HyperLogLog(10, track_changes=True)
+        union = HyperLogLog(10)
+        for value in range(5000):
+            (left if value % 2 else right).add(value)
+            union.add(value)
+        merged = HyperLogLog(10)
+        merged.merge_changes(left.drain_changes())
+        merged.merge_changes(right.drain_changes())
+        self.assertEqual(merged.registers, union.registers)
+        self.assertEqual(left.drain_changes(), {})
+
+
+class VirtualHyperLogLogTest(unittest.TestCase):
+    def test_per_key_estimates_despite_noise(self):
+        vhll = VirtualHyperLogLog(1 << 16)
+        scanner = mix_hash(ip_to_int('6.6.6.6'))
+        quiet = mix_hash(ip_to_int('10.0.0.9'))
+        for port in range(2000):
+            vhll.add(scanner, mix_hash(port))
+        for index in range(20000):
+            vhll.add(mix_hash(index % 500), mix_hash(index))
+        vhll.add(quiet, mix_hash(80))
+        self.assertAlmostEqual(vhll.estimate(scanner) / 2000, 1.0, delta=0.35)
+        self.assertLess(vhll.estimate(quiet), 100)
+        self.assertLess(vhll.estimate(mix_hash(ip_to_int('10.0.0.10'))), 100)
+        self.assertEqual(VirtualHyperLogLog(1 << 16).estimate(scanner), 0.0)
+
+    def test_merge_changes(self):
+        shard = VirtualHyperLogLog(1 << 12, track_changes=True)
+        key = mix_hash(1)
+        for value in range(300):
+            shard.add(key, mix_hash(value))
+        merged = VirtualHyperLogLog(1 << 12)
+        merged.merge_changes(shard.drain_changes())
+        self.assertEqual(merged.registers, shard.registers)
+        self.assertEqual(merged.estimate(key), shard.estimate(key))
+
+
+class CountMinSketchTest(unittest.TestCase):
+    def test_never_underestimates(self):
+        sketch = CountMinSketch(width=64, depth=4)
+        rng = random.Random(1)
+        truth = {}
+        for _ in range(5000):
+            key = rng.randrange(500)
+            truth[key] = truth.get(key, 0) + 1
+            sketch.add(mix_hash(key), 1, 100)
+        for key, count in truth.items():
+            estimate, weight = sketch.estimate(mix_hash(key))
+            self.assertGreaterEqual(estimate, count)
+            self.assertGreaterEqual(weight, count * 100)
+
+    def test_exact_when_sparse_and_merge_adds(self):
+        left = CountMinSketch()
+        right = CountMinSketch()
+        left.add(mix_hash(1), 3, 300)
+        right.add(mix_hash(1), 2, 200)
+        right.add(mix_hash(2), 1, 10)
+        left.merge(right.counts, right.weights)
+        self.assertEqual(left.estimate(mix_hash(1)), (5, 500))
+        self.assertEqual(left.estimate(mix_hash(2)), (1, 10))
+        self.assertEqual(left.estimate(mix_hash(3)), (0, 0))
+
+    def test_width_must_be_a_power_of_two(self):
+        with self.assertRaises(ValueError):
+            CountMinSketch(width=1000)
+        with self.assertRaises(ValueError):
+            CountMinSketch(width=1 << 17)
+
+
+class TrafficSketchesTest(unittest.TestCase):
+    def make(self, **options):
+        return TrafficSketches(window=60, windows=3, spread_registers=1 << 14, **options)
+
+    def add_scan(self, sketches, start=120.0):
+        scanner = ip_to_int('6.6.6.6')
+        for port in range(300):
+            sketches.add_packet(start + port * 0.1, 60, scanner, ip_to_int('10.0.0.5'), port)
+        for host in range(50):
+            sketches.add_packet(start + host * 0.1, 100, ip_to_int('10.0.1.1'), ip_to_int(f'10.0.2.{host}'), 443)
+
+    def test_source_destination_and_port_spread(self):
+        sketches = self.make()
+        self.add_scan(sketches)
+        sketches.commit()
+        spread = sketches.source_spread('6.6.6.6')
+        self.assertEqual((spread['window_start'], spread['packets'], spread['bytes']), (120, 300, 18000))
+        self.assertAlmostEqual(spread['distinct_ports'] / 300, 1.0, delta=0.35)
+        self.assertLessEqual(spread['distinct_hosts'], 10)
+        self.assertAlmostEqual(sketches.source_spread('10.0.1.1')['distinct_hosts'] / 50, 1.0, delta=0.5)
+        self.assertEqual(sketches.destination_spread('10.0.0.5')['packets'], 300)
+        self.assertEqual(sketches.port_spread(443)['packets'], 50)
+        totals = sketches.window_totals()
+        self.assertEqual((totals['packets'], totals['distinct_sources']), (350, 2))
+        self.assertAlmostEqual(totals['distinct_destinations'], 51, delta=3)
+
+    def test_queries_do_not_commit_the_pending_second(self):
+        sketches = self.make()
+        sketches.add_packet(100.0, 60, 1, 2, 80)
+        self.assertIsNone(sketches.window_totals())
+        sketches.commit()
+        self.assertEqual(sketches.window_totals()['packets'], 1)
+
+    def test_windows_rotate_and_late_data_is_dropped(self):
+        sketches = self.make()
+        for minute in range(5):
+            sketches.add_packet(minute * 60 + 1, 60, 1, 2, 80)
+        sketches.commit()
+        self.assertEqual(sketches.window_starts(), [120, 180, 240])
+        sketches.add_packet(5, 60, 1, 2, 80, weight=10)
+        sketches.commit()
+        self.assertEqual(sketches.window_starts(), [120, 180, 240])
+        self.assertIsNone(sketches.source_spread('0.0.0.1', start=0))
+        self.assertEqual(sketches.window_totals(130)['packets'], 1)
+
+    def test_weighted_packets(self):
+        sketches = self.make()
+        sketches.add_packet(100.0, 60, 1, 2, 80, weight=8)
+        sketches.commit()
+        self.assertEqual(sketches.window_totals()['bytes'], 480)
+
+    def test_shard_exports_merge_into_the_same_result(self):
+        single = self.make()
+        shards = [self.make(export_changes=True) for _ in range(2)]
+        merged = self.make()
+        rng = random.Random(7)
+        for index in range(2000):
+            src = ip_to_int(f'10.0.{rng.randrange(4)}.{rng.randrange(256)}')
+            dst = ip_to_int(f'192.168.0.{rng.randrange(64)}')
+            port = rng.randrange(1, 1024)
+            timestamp = 100 + index * 0.05
+            single.add_packet(timestamp, 100, src, dst, port)
+            shards[(src ^ dst) % 2].add_packet(timestamp, 100, src, dst, port)
+            if index % 500 == 0:
+                for shard in shards:
+                    merged.merge_export(shard.drain_export())
+        single.commit()
+        for shard in shards:
+            merged.merge_export(shard.drain_export())
+        self.assertEqual(merged.window_starts(), single.window_starts())
+        for start in single.window_starts():
+            self.assertEqual(merged.window_totals(start), single.window_totals(start))
+            self.assertEqual(merged.source_spread('10.0.1.7', start), single.source_spread('10.0.1.7', start))
+            self.assertEqual(merged.port_spread(80, start), single.port_spread(80, start))
+
+
+if __name__ == '__main__':
+    unittest.main()
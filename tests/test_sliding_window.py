@@ -0,0 +1,95 @@
+import unittest
+
+from core.network.sliding_window import DistinctWindow, TimingWheel, WindowCounter
+
+
+class WindowCounterTest(unittest.TestCase):
+    def test_counts_events_inside_the_window(self):
+        counter = WindowCounter(10)
+        for second in range(10):
+            self.assertEqual(counter.add(100 + second), second + 1)
+        # 每前进一个桶宽只滑出最早的桶
+        self.assertEqual(counter.count(110), 9)
+        self.assertEqual(counter.count(115), 4)
+        self.assertEqual(counter.count(500), 0)
+
+    def test_amount_and_late_events(self):
+        counter = WindowCounter(10)
+        self.assertEqual(counter.add(100, amount=5), 5)
+        self.assertEqual(counter.add(99.5), 6)
+        # 早于窗口的事件被忽略
+        self.assertEqual(counter.add(80), 6)
+
+    def test_long_gap_clears_all_buckets(self):
+        counter = WindowCounter(1)
+        counter.add(10)
+        counter.add(10.95)
+        self.assertEqual(counter.add(1000), 1)
+        self.assertEqual(sum(counter.counts), 1)
+
+
+class DistinctWindowTest(unittest.TestCase):
+    def test_counts_distinct_values_and_expires_them(self):
+        window = DistinctWindow(10)
+        for index, port in enumerate([22, 80, 22, 443, 80]):
+            window.add(port, 100 + index)
+        self.assertEqual(window.count(104), 3)
+        # 22最近出现在102，80在104
+        self.assertEqual(window.count(112.5), 2)
+        self.assertEqual(window.count(114.5), 0)
+        self.assertEqual(window.last_seen, {})
+
+    def test_repeats_within_a_bucket_do_not_grow_the_order(self):
+        window = DistinctWindow(10)
+        for index in range(1000):
+            window.add(22, 100 + index * 0.0001)
+        self.assertEqual(len(window.order), 1)
+        self.assertEqual(window.add(22, 101.5), 1)
+        self.assertEqual(len(window.order), 2)
+
+    def test_out_of_order_event_counts_at_latest_time(self):
+        window = DistinctWindow(10)
+        window.add(1, 100)
+        window.add(2, 95)
+        self.assertEqual(window.last_seen[2], 100)
+        self.assertEqual(window.count(109), 2)
+
+
+class TimingWheelTest(unittest.TestCase):
+    def test_entries_are_due_at_their_deadline(self):
+        wheel = TimingWheel()
+        self.assertEqual(wheel.advance(100), [])
+        wheel.schedule('a', 101.5)
+        wheel.schedule('b', 103)
+        self.assertEqual(len(wheel), 2)
+        self.assertEqual(wheel.advance(100.9), [])
+        self.assertEqual(wheel.advance(102), [(101, 'a')])
+        self.assertEqual(wheel.advance(103), [(103, 'b')])
+        self.assertEqual(len(wheel), 0)
+
+    def test_past_deadlines_move_to_the_next_tick(self):
+        wheel = TimingWheel()
+        wheel.advance(100)
+        self.assertEqual(wheel.schedule('late', 50), 101)
+
+    def test_entries_beyond_one_turn_wait_for_their_round(self):
+        wheel = TimingWheel(size=8)
+        wheel.advance(0)
+        wheel.schedule('far', 20)
+        self.assertEqual(wheel.advance(12), [])
+        self.assertEqual(wheel.advance(19), [])
+        self.assertEqual(wheel.advance(20), [(20, 'far')])
+
+    def test_large_jump_scans_every_slot_once(self):
+        wheel = TimingWheel(size=8)
+        wheel.advance(0)
+        for second in range(1, 6):
+            wheel.schedule(second, second)
+        self.assertEqual(sorted(key for _, key in wheel.advance(1000)), [1, 2, 3, 4, 5])
+        wheel.clear()
+        self.assertIsNone(wheel.current)
+        self.assertEqual(len(wheel), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+import unittest
+
+from core.network.fast_capture import decode_frame
+from core.network.packet_utils import ip_to_int
+from core.network.tcp_state import (
+    TCP_CLOSED, TCP_ESTABLISHED, TCP_FIN_FORWARD, TCP_FIN_REVERSE, TCP_RESET, TCP_SYN_RECEIVED,
+    TCP_SYN_SENT, merge_tcp
+)
+from core.network.traffic_state import TrafficState
+from tests.packets import TCP_ACK, TCP_FIN, TCP_PSH, TCP_RST, TCP_SYN, tcp_frame
+
+SERVER = '10.0.0.80'
+
+
+class Connections:
+    """在一个TrafficState中投递多个客户端到SERVER的TCP连接"""
+
+    def __init__(self, **options):
+        self.state = TrafficState(max_history=10, sketch_window=0, **options)
+
+    def client(self, client, flags, timestamp, sport=40000, payload=b''):
+        frame = tcp_frame(client, SERVER, sport, 80, flags, payload)
+        return self.state.update(decode_frame(frame, timestamp), 1, frame)
+
+    def server(self, client, flags, timestamp, sport=40000):
+        frame = tcp_frame(SERVER, client, 80, sport, flags)
+        return self.state.update(decode_frame(frame, timestamp), 1, frame)
+
+    def handshake(self, client, start, rtt, ack_rtt=0.001, sport=40000):
+        self.client(client, TCP_SYN, start, sport)
+        self.server(client, TCP_SYN | TCP_ACK, start + rtt, sport)
+        return self.client(client, TCP_ACK, start + rtt + ack_rtt, sport)
+
+    @property
+    def tcp(self):
+        return self.state.tcp
+
+
+class HandshakeTest(unittest.TestCase):
+    def test_round_trip_times(self):
+        connections = Connections()
+        record = connections.client('10.0.0.1', TCP_SYN, 100.0)
+        self.assertEqual(record.tcp_state, TCP_SYN_SENT)
+        # 重传的SYN保留首次时间
+        connections.client('10.0.0.1', TCP_SYN, 100.5)
+        record = connections.server('10.0.0.1', TCP_SYN | TCP_ACK, 100.75)
+        self.assertEqual(record.tcp_state, TCP_SYN_RECEIVED)
+        record = connections.client('10.0.0.1', TCP_ACK, 100.875)
+        self.assertEqual(record.tcp_state, TCP_ESTABLISHED)
+        self.assertEqual((record.rtt, record.ack_rtt), (0.75, 0.125))
+        self.assertEqual(record.to_dict()['tcp_state'], 'ESTABLISHED')
+        self.assertEqual(connections.tcp.handshakes, 1)
+
+    def test_connection_already_open_when_capture_started(self):
+        connections = Connections()
+        record = connections.client('10.0.0.1', TCP_ACK | TCP_PSH, 100.0, payload=b'data')
+        self.assertEqual((record.tcp_state, record.rtt), (TCP_ESTABLISHED, None))
+        self.assertEqual(connections.tcp.handshakes, 0)
+
+    def test_syn_ack_without_syn_is_not_measured(self):
+        connections = Connections()
+        # 流的发起方是第一个看到的包的源（这里是服务器）
+        record = connections.server('10.0.0.1', TCP_SYN | TCP_ACK, 100.0)
+        self.assertEqual(record.tcp_state, TCP_SYN_RECEIVED)
+        self.assertIsNone(record.rtt)
+        self.assertEqual(connections.tcp.handshake_rtt.count, 0)
+
+    def test_close_and_reset(self):
+        connections = Connections()
+        connections.handshake('10.0.0.1', 100.0, 0.01)
+        record = connections.server('10.0.0.1', TCP_FIN | TCP_ACK, 101.0)
+        self.assertEqual(record.tcp_state, TCP_FIN_REVERSE)
+        # 同一方向重复的FIN不改变状态
+        connections.server('10.0.0.1', TCP_FIN | TCP_ACK, 101.1)
+        self.assertEqual(record.tcp_state, TCP_FIN_REVERSE)
+        connections.client('10.0.0.1', TCP_FIN | TCP_ACK, 101.2)
+        self.assertEqual(record.tcp_state, TCP_CLOSED)
+
+        record = connections.handshake('10.0.0.2', 100.0, 0.01)
+        connections.client('10.0.0.2', TCP_FIN | TCP_ACK, 101.0)
+        self.assertEqual(record.tcp_state, TCP_FIN_FORWARD)
+        connections.server('10.0.0.2', TCP_RST, 101.1)
+        connections.client('10.0.0.2', TCP_RST, 101.2)
+        self.assertEqual(record.tcp_state, TCP_RESET)
+        self.assertEqual(connections.tcp.resets, 1)
+
+    def test_port_reuse_starts_a_new_handshake(self):
+        connections = Connections()
+        record = connections.handshake('10.0.0.1', 100.0, 0.5)
+        connections.client('10.0.0.1', TCP_FIN | TCP_ACK, 101.0)
+        connections.server('10.0.0.1', TCP_FIN | TCP_ACK, 101.1)
+        self.assertEqual(record.tcp_state, TCP_CLOSED)
+        connections.client('10.0.0.1', TCP_SYN, 200.0)
+        self.assertEqual((record.tcp_state, record.rtt, record.ack_rtt), (TCP_SYN_SENT, None, None))
+        connections.server('10.0.0.1', TCP_SYN | TCP_ACK, 200.25)
+        self.assertEqual(record.rtt, 0.25)
+
+
+class HalfOpenTest(unittest.TestCase):
+    def test_half_open_connections_per_destination(self):
+        connections = Connections()
+        for index in range(5):
+            connections.client(f'10.0.1.{index}', TCP_SYN, 100.0)
+        connections.server('10.0.1.0', TCP_SYN | TCP_ACK, 100.1)
+        self.assertEqual(connections.tcp.half_open, {ip_to_int(SERVER): 5})
+        connections.client('10.0.1.0', TCP_ACK, 100.2)
+        connections.server('10.0.1.1', TCP_RST, 100.3)
+        statistics = connections.state.get_tcp_statistics()
+        self.assertEqual(statistics['half_open_connections'], 3)
+        self.assertEqual(statistics['half_open_by_destination'], [(SERVER, 3)])
+        self.assertEqual((statistics['handshakes'], statistics['resets']), (1, 1))
+
+    def test_evicted_flows_release_their_half_open_count(self):
+        connections = Connections(max_flows=2)
+        connections.client('10.0.1.1', TCP_SYN, 100.0)
+        connections.client('10.0.1.2', TCP_SYN, 100.1)
+        connections.client('10.0.1.3', TCP_ACK, 100.2)
+        self.assertEqual(sum(connections.tcp.half_open.values()), 1)
+        connections.client('10.0.1.4', TCP_ACK, 100.3)
+        self.assertEqual(connections.tcp.half_open, {})
+
+    def test_clear(self):
+        connections = Connections()
+        connections.handshake('10.0.1.1', 100.0, 0.01)
+        connections.client('10.0.1.2', TCP_SYN, 100.0)
+        connections.state.reset()
+        tracker = connections.tcp
+        self.assertEqual((tracker.half_open, len(tracker.servers), tracker.handshakes, tracker.handshake_rtt.count),
+                         ({}, 0, 0, 0))
+
+
+class ServerRttTest(unittest.TestCase):
+    def test_slowest_servers_and_bounded_table(self):
+        state = TrafficState(max_history=10, sketch_window=0)
+        tracker = state.tcp
+        tracker.max_servers = 2
+        for index, (server, rtt) in enumerate((('10.0.0.1', 0.01), ('10.0.0.2', 0.2), ('10.0.0.1', 0.03),
+                                               ('10.0.0.3', 0.1))):
+            client = f'192.168.0.{index}'
+            syn = tcp_frame(client, server, 40000, 443, TCP_SYN)
+            syn_ack = tcp_frame(server, client, 443, 40000, TCP_SYN | TCP_ACK)
+            state.update(decode_frame(syn, 100.0), 1, syn)
+            state.update(decode_frame(syn_ack, 100.0 + rtt), 1, syn_ack)
+        statistics = merge_tcp([tracker.export()])
+        # 10.0.0.2最久未更新，被淘汰
+        servers = dict(statistics['slow_servers'])
+        self.assertEqual(list(servers), ['10.0.0.3', '10.0.0.1'])
+        self.assertEqual(servers['10.0.0.1']['samples'], 2)
+        self.assertAlmostEqual(servers['10.0.0.1']['mean_ms'], 20.0)
+        self.assertAlmostEqual(servers['10.0.0.1']['max_ms'], 30.0)
+        self.assertEqual(statistics['handshake_rtt']['samples'], 4)
+
+
+class MergeTcpTest(unittest.TestCase):
+    def test_shard_exports_add_up(self):
+        exports = []
+        for shard in range(2):
+            connections = Connections()
+            connections.handshake('10.0.0.1', 100.0, 0.01 * (shard + 1), sport=40000 + shard)
+            connections.client('10.0.0.2', TCP_SYN, 100.0, sport=40000 + shard)
+            exports.append(connections.tcp.export())
+        merged = merge_tcp(exports)
+        self.assertEqual((merged['handshakes'], merged['half_open_connections']), (2, 2))
+        self.assertEqual(merged['half_open_by_destination'], [(SERVER, 2)])
+        server = dict(merged['slow_servers'])[SERVER]
+        self.assertEqual(server['samples'], 2)
+        self.assertAlmostEqual(server['mean_ms'], 15.0)
+        self.assertAlmostEqual(server['max_ms'], 20.0)
+        self.assertEqual(merged['handshake_rtt']['samples'], 2)
+
+    def test_empty(self):
+        merged = merge_tcp([])
+        self.assertEqual((merged['handshakes'], merged['slow_servers'], merged['handshake_rtt']['samples']),
+                         (0, [], 0))
+
+
+if __name__ == '__main__':
+    unittest.main()